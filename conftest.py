@@ -61,3 +61,10 @@ def pytest_configure(config):
     settings.BITBUCKET_CONSUMER_SECRET = '123'
     settings.GITHUB_APP_ID = 'abc'
     settings.GITHUB_API_SECRET = '123'
+
+
+def pytest_runtest_teardown(item):
+    # sentry flushes redis between tests, but not our in-process caches
+    from sentry_plugins.github.cache import user_email_cache, user_id_cache
+    user_email_cache.local.clear()
+    user_id_cache.local.clear()
@@ -32,10 +32,10 @@ install_requires = [
     'BeautifulSoup>=3.2.1',
     # sentry also requires this, so we're just enforcing that it needs to exist
     'boto3>=1.4.4,<1.5.0',
+    'ijson>=2.3',
     'python-dateutil',
     'PyJWT',
     'requests-oauthlib>=0.3.0',
-    'unidiff>=0.5.4'
 ]
 
 
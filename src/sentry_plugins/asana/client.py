@@ -1,9 +1,9 @@
 from __future__ import absolute_import
 
 from requests.exceptions import HTTPError
-from sentry.http import build_session
 
 from sentry_plugins.exceptions import ApiError, ApiUnauthorized
+from sentry_plugins.http import get_session
 
 
 class AsanaClient(object):
@@ -17,7 +17,7 @@ class AsanaClient(object):
             'Authorization': 'Bearer %s' % token,
         }
 
-        session = build_session()
+        session = get_session(self.API_URL)
         try:
             resp = getattr(session, method.lower())(
                 url='%s%s' % (self.API_URL, path),
@@ -1,24 +1,37 @@
 from __future__ import absolute_import
 
+import logging
 import six
 
+from itertools import chain, islice, takewhile
+from multiprocessing.pool import ThreadPool
 from django.conf import settings
 from requests.exceptions import HTTPError
-from unidiff import PatchSet
-from sentry.http import build_session
+from sentry.utils import metrics
 
+from sentry_plugins.bitbucket.diff import CHUNK_SIZE, get_file_changes, iter_lines
+from sentry_plugins.cache import file_changes_cache
 from sentry_plugins.exceptions import ApiError
+from sentry_plugins.http import get_session
 
 from requests_oauthlib import OAuth1
 
+logger = logging.getLogger('sentry.plugins.bitbucket')
+
 
 class BitbucketClient(object):
     API_URL = u'https://api.bitbucket.org/'
 
+    # maximum number of commit diffs fetched concurrently
+    MAX_DIFF_WORKERS = 4
+
+    # maximum number of commits returned by compare_commits
+    MAX_COMPARE_COMMITS = 250
+
     def __init__(self, auth):
         self.auth = auth
 
-    def request(self, method, version, path, data=None, params=None, json=True):
+    def request(self, method, version, path, data=None, params=None, json=True, stream=False):
 
         oauth = OAuth1(
             six.text_type(settings.BITBUCKET_CONSUMER_KEY),
@@ -28,7 +41,7 @@ class BitbucketClient(object):
             signature_type='auth_header'
         )
 
-        session = build_session()
+        session = get_session(self.API_URL)
         try:
             resp = getattr(session, method.lower())(
                 url='%s%s%s' % (self.API_URL, version, path),
@@ -36,11 +49,16 @@ class BitbucketClient(object):
                 data=(data if version == '1.0' else None),
                 json=(data if version == '2.0' else None),
                 params=params,
+                stream=stream,
             )
             resp.raise_for_status()
         except HTTPError as e:
             raise ApiError.from_response(e.response)
 
+        # the caller is responsible for consuming and closing the response
+        if stream:
+            return resp
+
         if resp.status_code == 204:
             return {}
 
@@ -108,51 +126,78 @@ class BitbucketClient(object):
             ),
         )
 
-    def transform_patchset(self, patch_set):
-        file_changes = []
-        for patched_file in patch_set.added_files:
-            file_changes.append({
-                'path': patched_file.path,
-                'type': 'A',
-            })
-
-        for patched_file in patch_set.removed_files:
-            file_changes.append({
-                'path': patched_file.path,
-                'type': 'D',
-            })
-
-        for patched_file in patch_set.modified_files:
-            file_changes.append({
-                'path': patched_file.path,
-                'type': 'M',
-            })
-
-        return file_changes
-
     def get_commit_filechanges(self, repo, sha):
-        # returns unidiff file
+        cache_key = '{}:{}'.format(repo, sha)
+        file_changes = file_changes_cache.get(cache_key)
+        if file_changes is None:
+            file_changes = self._get_commit_filechanges(repo, sha)
+            file_changes_cache.set(cache_key, file_changes)
+        return file_changes
 
-        diff_file = self.request(
+    def _get_commit_filechanges(self, repo, sha):
+        # the diff is scanned as it streams in, only looking at file headers
+        resp = self.request(
             'GET',
             '2.0',
             '/repositories/{}/diff/{}'.format(
                 repo,
                 sha,
             ),
-            data=None,
-            params=None,
-            json=False,
+            stream=True,
         )
-        ps = PatchSet.from_string(diff_file)
-        return self.transform_patchset(ps)
+        try:
+            return get_file_changes(iter_lines(resp.iter_content(CHUNK_SIZE)))
+        finally:
+            resp.close()
 
     def zip_commit_data(self, repo, commit_list):
-        for commit in commit_list:
-            commit.update({'patch_set': self.get_commit_filechanges(repo, commit['hash'])})
-        return commit_list
-
-    def get_last_commits(self, repo, end_sha):
+        # diffs are fetched concurrently as each one is a separate request, and
+        # ``commit_list`` may be lazily paginated so downloading diffs overlaps
+        # with fetching the remaining pages of commits
+        commit_list = iter(commit_list)
+        head = list(islice(commit_list, 2))
+        if len(head) <= 1:
+            # not worth spinning up threads for
+            for commit in head:
+                commit.update({'patch_set': self.get_commit_filechanges(repo, commit['hash'])})
+            return head
+        commit_list = chain(head, commit_list)
+
+        pool = ThreadPool(self.MAX_DIFF_WORKERS)
+        try:
+            commits = []
+            results = []
+            for commit in commit_list:
+                commits.append(commit)
+                results.append(
+                    pool.apply_async(self.get_commit_filechanges, (repo, commit['hash']))
+                )
+
+            for commit, result in zip(commits, results):
+                commit.update({'patch_set': result.get()})
+        finally:
+            pool.close()
+            pool.join()
+        return commits
+
+    def get_next_path(self, data):
+        next_url = data.get('next')
+        prefix = self.API_URL + '2.0'
+        if not next_url or not next_url.startswith(prefix):
+            return None
+        return next_url[len(prefix):]
+
+    def iter_commits(self, repo, end_sha):
+        # follows the pagination links lazily, so callers can stop early
+        # see https://developer.atlassian.com/bitbucket/api/2/reference/meta/pagination
+        path = '/repositories/{}/commits/{}'.format(repo, end_sha)
+        while path:
+            data = self.request('GET', '2.0', path)
+            for commit in data['values']:
+                yield commit
+            path = self.get_next_path(data)
+
+    def get_last_commits(self, repo, end_sha, limit=None):
         # return api request that fetches last ~30 commits
         # see https://developer.atlassian.com/bitbucket/api/2/reference/resource/repositories/%7Busername%7D/%7Brepo_slug%7D/commits/%7Brevision%7D
         # using end_sha as parameter
@@ -161,17 +206,34 @@ class BitbucketClient(object):
             end_sha,
         ))
 
-        return self.zip_commit_data(repo, data['values'])
+        # only fetch diffs for the commits we're actually going to return
+        return self.zip_commit_data(repo, data['values'][:limit])
 
-    def compare_commits(self, repo, start_sha, end_sha):
+    def compare_commits(self, repo, start_sha, end_sha, limit=None):
         # where start sha is oldest and end is most recent
         # see https://developer.atlassian.com/bitbucket/api/2/reference/resource/repositories/%7Busername%7D/%7Brepo_slug%7D/commits/%7Brevision%7D
-        data = self.request('GET', '2.0', '/repositories/{}/commits/{}'.format(repo, end_sha))
-        commits = []
-        for commit in data['values']:
-            # TODO(maxbittker) fetch extra pages (up to a max) when this is paginated (more than 30 commits)
-            if commit['hash'] == start_sha:
-                break
-            commits.append(commit)
-
-        return self.zip_commit_data(repo, commits)
+        # pages are only fetched until we see start_sha or hit the limit
+        if limit is None:
+            limit = self.MAX_COMPARE_COMMITS
+
+        commits = islice(
+            takewhile(
+                lambda commit: commit['hash'] != start_sha,
+                self.iter_commits(repo, end_sha),
+            ),
+            limit,
+        )
+        commits = self.zip_commit_data(repo, commits)
+        if len(commits) >= limit:
+            # we never got to start_sha, so there may be more commits
+            logger.warning(
+                'bitbucket.compare-commits.truncated',
+                extra={
+                    'repository': repo,
+                    'start_sha': start_sha,
+                    'end_sha': end_sha,
+                    'limit': limit,
+                }
+            )
+            metrics.incr('sentry-plugins.bitbucket.compare-commits.truncated')
+        return commits
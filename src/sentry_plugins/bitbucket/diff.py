@@ -0,0 +1,156 @@
+"""
+A streaming scanner for git diffs.
+
+We only need the list of files touched by a commit (and whether each was
+added, removed or modified), so rather than building a full ``PatchSet``
+with every hunk and line we read the diff line by line and only look at
+the extended headers following each ``diff --git`` line. Hunk bodies are
+skipped, and since content lines always start with a space, ``+``, ``-``
+or ``\\``, they can't be mistaken for the start of the next file. Memory
+use stays flat no matter how large the diff is.
+"""
+from __future__ import absolute_import
+
+import codecs
+
+DEV_NULL = b'/dev/null'
+
+# bytes read from the response at a time
+CHUNK_SIZE = 64 * 1024
+
+# lines are cut off after this many bytes; header lines never get close,
+# and we don't look at the content of any other line
+MAX_LINE_LENGTH = 16 * 1024
+
+
+def iter_lines(chunks):
+    """
+    Split an iterable of byte chunks into lines (without line endings).
+    """
+    pending = []
+    pending_size = 0
+    for chunk in chunks:
+        lines = chunk.split(b'\n')
+        for line in lines[:-1]:
+            if pending:
+                pending.append(line)
+                line = b''.join(pending)[:MAX_LINE_LENGTH]
+                pending = []
+                pending_size = 0
+            yield line
+        # parts of an unfinished line are only joined once it's complete,
+        # and past the cut off they aren't kept at all
+        if lines[-1] and pending_size < MAX_LINE_LENGTH:
+            pending.append(lines[-1])
+            pending_size += len(lines[-1])
+    if pending:
+        yield b''.join(pending)[:MAX_LINE_LENGTH]
+
+
+def unquote(path):
+    # git quotes paths with unusual characters C style, e.g. "a/caf\303\251"
+    if len(path) > 1 and path[:1] == b'"' and path[-1:] == b'"':
+        path = codecs.escape_decode(path[1:-1])[0]
+    return path
+
+
+def strip_prefix(path):
+    if path[:2] in (b'a/', b'b/'):
+        return path[2:]
+    return path
+
+
+def parse_git_paths(line):
+    # "diff --git a/foo.py b/foo.py" -> ("foo.py", "foo.py"). Paths may
+    # contain spaces, which only makes the split unambiguous when both
+    # sides are the same; when they aren't (renames, copies) the other
+    # headers tell us the real paths.
+    paths = line[len(b'diff --git '):].rstrip(b'\r')
+    half = (len(paths) - 1) // 2
+    source, target = paths[:half], paths[half + 1:]
+    if strip_prefix(unquote(source)) != strip_prefix(unquote(target)):
+        source, _, target = paths.rpartition(b' b/')
+        target = b'b/' + target
+    return strip_prefix(unquote(source)), strip_prefix(unquote(target))
+
+
+def parse_filename(line):
+    # "--- a/path/to/file.py\t2017-05-16 23:21:40" -> "path/to/file.py"
+    path = unquote(line[4:].split(b'\t', 1)[0].rstrip(b'\r'))
+    if path == DEV_NULL:
+        return None
+    return strip_prefix(path)
+
+
+def get_changes(source, target, change_type):
+    if change_type == 'A':
+        return [(target, 'A')]
+    if change_type == 'D':
+        return [(source, 'D')]
+    if change_type == 'R':
+        return [(source, 'D'), (target, 'A')]
+    if change_type == 'C':
+        return [(target, 'A')]
+    return [(target, 'M')]
+
+
+def iter_file_changes(lines):
+    """
+    Yield a ``(path, type)`` pair for every file in a git diff, where
+    ``type`` is one of ``A``, ``D`` or ``M``.
+
+    Files with no content changes (binary files, empty files, pure renames
+    and mode changes) only have a ``diff --git`` line and extended headers,
+    so those decide what happened to a file. A rename is reported as the
+    removal of the old path and the addition of the new one.
+    """
+    header = None
+    in_header = False
+
+    for line in lines:
+        if line.startswith(b'diff --git '):
+            if header is not None:
+                for change in get_changes(*header):
+                    yield change
+            source, target = parse_git_paths(line)
+            header = [source, target, 'M']
+            in_header = True
+        elif not in_header:
+            continue
+        elif line.startswith(b'@@'):
+            in_header = False
+        elif line.startswith(b'new file mode '):
+            header[2] = 'A'
+        elif line.startswith(b'deleted file mode '):
+            header[2] = 'D'
+        elif line.startswith(b'rename from '):
+            header[0] = unquote(line[len(b'rename from '):].rstrip(b'\r'))
+            header[2] = 'R'
+        elif line.startswith(b'rename to '):
+            header[1] = unquote(line[len(b'rename to '):].rstrip(b'\r'))
+            header[2] = 'R'
+        elif line.startswith(b'copy from '):
+            header[0] = unquote(line[len(b'copy from '):].rstrip(b'\r'))
+            header[2] = 'C'
+        elif line.startswith(b'copy to '):
+            header[1] = unquote(line[len(b'copy to '):].rstrip(b'\r'))
+            header[2] = 'C'
+        elif line.startswith(b'--- '):
+            header[0] = parse_filename(line) or header[0]
+        elif line.startswith(b'+++ '):
+            header[1] = parse_filename(line) or header[1]
+
+    if header is not None:
+        for change in get_changes(*header):
+            yield change
+
+
+def get_file_changes(lines):
+    # added files come first, followed by removed and then modified files
+    changes = {'A': [], 'D': [], 'M': []}
+    for path, change_type in iter_file_changes(lines):
+        changes[change_type].append({
+            'path': path.decode('utf-8', 'replace'),
+            'type': change_type,
+        })
+    return changes['A'] + changes['D'] + changes['M']
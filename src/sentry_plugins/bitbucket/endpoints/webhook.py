@@ -7,6 +7,7 @@ import re
 
 import ipaddress
 
+from django.conf import settings
 from django.db import IntegrityError, transaction
 from django.http import HttpResponse, Http404
 from django.utils.decorators import method_decorator
@@ -14,10 +15,15 @@ from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import View
 from django.utils import timezone
 from simplejson import JSONDecodeError
-from sentry.models import (Commit, CommitAuthor, Organization, Repository)
+from sentry.models import (Commit, Organization, Repository)
 from sentry.plugins.providers import RepositoryProvider
 from sentry.utils import json
 
+from sentry_plugins.bitbucket.tasks import process_webhook
+from sentry_plugins.webhooks import (
+    forget_webhook_delivery, get_or_create_commit_authors, record_webhook_delivery
+)
+
 logger = logging.getLogger('sentry.webhooks')
 
 # Bitbucket Cloud IP range: https://confluence.atlassian.com/bitbucket/manage-webhooks-735643732.html#Managewebhooks-trigger_webhookTriggeringwebhooks
@@ -42,8 +48,6 @@ def parse_raw_user_name(raw):
 class PushEventWebhook(Webhook):
     # https://confluence.atlassian.com/bitbucket/event-payloads-740262817.html#EventPayloads-Push
     def __call__(self, organization, event):
-        authors = {}
-
         try:
             repo = Repository.objects.get(
                 organization_id=organization.id,
@@ -57,41 +61,39 @@ class PushEventWebhook(Webhook):
             repo.config['name'] = event['repository']['full_name']
             repo.save()
 
-        for change in event['push']['changes']:
-            for commit in change.get('commits', []):
-                if RepositoryProvider.should_ignore_commit(commit['message']):
-                    continue
+        commits = [
+            c for change in event['push']['changes'] for c in change.get('commits', [])
+            if not RepositoryProvider.should_ignore_commit(c['message'])
+        ]
+
+        names = {}
+        for commit in commits:
+            author_email = parse_raw_user_email(commit['author']['raw'])
+            # TODO(dcramer): we need to deal with bad values here, but since
+            # its optional, lets just throw it out for now
+            if len(author_email) <= 75:
+                names.setdefault(author_email, parse_raw_user_name(commit['author']['raw']))
 
-                author_email = parse_raw_user_email(commit['author']['raw'])
+        authors = get_or_create_commit_authors(organization.id, names)
 
-                # TODO(dcramer): we need to deal with bad values here, but since
-                # its optional, lets just throw it out for now
-                if len(author_email) > 75:
-                    author = None
-                elif author_email not in authors:
-                    authors[author_email] = author = CommitAuthor.objects.get_or_create(
+        for commit in commits:
+            author = authors.get(parse_raw_user_email(commit['author']['raw']))
+            try:
+                with transaction.atomic():
+
+                    Commit.objects.create(
+                        repository_id=repo.id,
                         organization_id=organization.id,
-                        email=author_email,
-                        defaults={'name': commit['author']['raw'].split('<')[0].strip()}
-                    )[0]
-                else:
-                    author = authors[author_email]
-                try:
-                    with transaction.atomic():
-
-                        Commit.objects.create(
-                            repository_id=repo.id,
-                            organization_id=organization.id,
-                            key=commit['hash'],
-                            message=commit['message'],
-                            author=author,
-                            date_added=dateutil.parser.parse(
-                                commit['date'],
-                            ).astimezone(timezone.utc),
-                        )
-
-                except IntegrityError:
-                    pass
+                        key=commit['hash'],
+                        message=commit['message'],
+                        author=author,
+                        date_added=dateutil.parser.parse(
+                            commit['date'],
+                        ).astimezone(timezone.utc),
+                    )
+
+            except IntegrityError:
+                pass
 
 
 class BitbucketWebhookEndpoint(View):
@@ -102,6 +104,10 @@ class BitbucketWebhookEndpoint(View):
     def get_handler(self, event_type):
         return self._handlers.get(event_type)
 
+    def is_async(self):
+        # when enabled, handlers run in a task and redeliveries are dropped
+        return getattr(settings, 'BITBUCKET_WEBHOOK_ASYNC', False)
+
     @method_decorator(csrf_exempt)
     def dispatch(self, request, *args, **kwargs):
         if request.method != 'POST':
@@ -133,7 +139,7 @@ class BitbucketWebhookEndpoint(View):
             return HttpResponse(status=400)
 
         try:
-            handler = self.get_handler(request.META['HTTP_X_EVENT_KEY'])
+            event_type = request.META['HTTP_X_EVENT_KEY']
         except KeyError:
             logger.error(
                 'bitbucket.webhook.missing-event', extra={
@@ -142,6 +148,7 @@ class BitbucketWebhookEndpoint(View):
             )
             return HttpResponse(status=400)
 
+        handler = self.get_handler(event_type)
         if not handler:
             return HttpResponse(status=204)
 
@@ -154,6 +161,8 @@ class BitbucketWebhookEndpoint(View):
             )
             return HttpResponse(status=401)
 
+        is_async = self.is_async()
+
         try:
             event = json.loads(body.decode('utf-8'))
         except JSONDecodeError:
@@ -166,5 +175,31 @@ class BitbucketWebhookEndpoint(View):
             )
             return HttpResponse(status=400)
 
+        # only claimed once the body is known to be valid, so a broken delivery
+        # doesn't keep its redelivery from being processed
+        delivery_id = request.META.get('HTTP_X_REQUEST_UUID')
+        if is_async and not record_webhook_delivery('bitbucket', delivery_id):
+            logger.info(
+                'bitbucket.webhook.duplicate-delivery',
+                extra={
+                    'organization_id': organization.id,
+                    'delivery_id': delivery_id,
+                }
+            )
+            return HttpResponse(status=202)
+
+        if is_async:
+            try:
+                process_webhook.delay(
+                    organization_id=organization.id,
+                    event_type=event_type,
+                    event=event,
+                )
+            except Exception:
+                # allow the redelivery to be processed
+                forget_webhook_delivery('bitbucket', delivery_id)
+                raise
+            return HttpResponse(status=202)
+
         handler()(organization, event)
         return HttpResponse(status=204)
@@ -14,6 +14,9 @@ from sentry.plugins import providers
 from sentry.utils.http import absolute_uri
 
 from sentry_plugins.base import CorePluginMixin
+from sentry_plugins.cache import (
+    compare_commits_cache, get_compare_commits_key, is_sha
+)
 from sentry_plugins.exceptions import ApiError, ApiUnauthorized
 
 from .client import BitbucketClient
@@ -378,16 +381,30 @@ class BitbucketRepositoryProvider(BitbucketMixin, providers.RepositoryProvider):
         if actor is None:
             raise NotImplementedError('Cannot fetch commits anonymously')
 
+        # the commits between two SHAs never change, so we can cache them
+        cacheable = is_sha(end_sha) and (start_sha is None or is_sha(start_sha))
+        if cacheable:
+            cache_key = get_compare_commits_key(repo, start_sha, end_sha)
+            commits = compare_commits_cache.get(cache_key)
+            if commits is not None:
+                return commits
+
+        commits = self._compare_commits(repo, start_sha, end_sha, actor)
+        if cacheable:
+            compare_commits_cache.set(cache_key, commits)
+        return commits
+
+    def _compare_commits(self, repo, start_sha, end_sha, actor):
         client = self.get_client(actor)
         # use config name because that is kept in sync via webhooks
         name = repo.config['name']
         if start_sha is None:
             try:
-                res = client.get_last_commits(name, end_sha)
+                res = client.get_last_commits(name, end_sha, limit=10)
             except Exception as e:
                 self.raise_error(e)
             else:
-                return self._format_commits(repo, res[:10])
+                return self._format_commits(repo, res)
         else:
             try:
                 res = client.compare_commits(name, start_sha, end_sha)
@@ -0,0 +1,18 @@
+from __future__ import absolute_import
+
+from sentry.models import Organization
+from sentry.tasks.base import instrumented_task, retry
+
+from sentry_plugins.webhooks import process_webhook_event
+
+
+@instrumented_task(
+    name='sentry_plugins.bitbucket.tasks.process_webhook',
+    default_retry_delay=60 * 5,
+    max_retries=5,
+)
+@retry(exclude=(Organization.DoesNotExist, ))
+def process_webhook(organization_id, event_type, event, **kwargs):
+    from sentry_plugins.bitbucket.endpoints.webhook import BitbucketWebhookEndpoint
+
+    process_webhook_event('bitbucket', BitbucketWebhookEndpoint(), organization_id, event_type, event)
@@ -0,0 +1,92 @@
+from __future__ import absolute_import
+
+import re
+import time
+
+from django.conf import settings
+from sentry.utils import json, metrics
+
+# The Redis cluster manager (``clusters``) was added in Sentry 8.2 (GH-2714)
+# and replaces ``make_rb_cluster`` (which will be removed in a future version.)
+try:
+    from sentry.utils.redis import clusters
+    cluster = clusters.get('default')
+except ImportError:
+    from sentry.utils.redis import make_rb_cluster
+    cluster = make_rb_cluster(settings.SENTRY_REDIS_OPTIONS['hosts'])
+
+_sha_re = re.compile(r'^[0-9a-f]{40}$')
+
+
+def is_sha(value):
+    # refs can also be branch or tag names, which aren't safe to cache on
+    return bool(value and _sha_re.match(value))
+
+
+class CommitCache(object):
+    """
+    A size-bounded Redis cache for data derived from immutable commit SHAs.
+
+    Entries never need invalidating, so they are only evicted once they
+    expire or when the cache grows past ``max_entries``, in which case the
+    least recently used entries are dropped first.
+    """
+
+    def __init__(self, name, max_entries, ttl=60 * 60 * 24 * 7):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+    def get_key(self, key):
+        return 'sentry-plugins:%s:%s' % (self.name, key)
+
+    def get_index_key(self):
+        return 'sentry-plugins:%s:index' % (self.name, )
+
+    def get(self, key):
+        key = self.get_key(key)
+        client = cluster.get_routing_client()
+        result = client.get(key)
+        if result is None:
+            metrics.incr('sentry-plugins.%s-cache.miss' % (self.name, ))
+            return None
+
+        metrics.incr('sentry-plugins.%s-cache.hit' % (self.name, ))
+        client.zadd(self.get_index_key(), time.time(), key)
+        return json.loads(result)
+
+    def set(self, key, value):
+        key = self.get_key(key)
+        index_key = self.get_index_key()
+        with cluster.map() as client:
+            client.setex(key, self.ttl, json.dumps(value))
+            client.zadd(index_key, time.time(), key)
+            client.expire(index_key, self.ttl)
+        self.trim()
+
+    def trim(self):
+        index_key = self.get_index_key()
+        client = cluster.get_routing_client()
+        excess = client.zcard(index_key) - self.max_entries
+        if excess <= 0:
+            return
+
+        evicted = client.zrange(index_key, 0, excess - 1)
+        if not evicted:
+            return
+
+        with cluster.map() as map_client:
+            for key in evicted:
+                map_client.delete(key)
+            map_client.zrem(index_key, *evicted)
+
+
+# formatted results of RepositoryProvider.compare_commits
+compare_commits_cache = CommitCache('compare-commits', max_entries=10000)
+
+# file changes for a single commit
+file_changes_cache = CommitCache('file-changes', max_entries=50000)
+
+
+def get_compare_commits_key(repo, start_sha, end_sha):
+    return '%s:%s:%s' % (repo.id, start_sha or '', end_sha)
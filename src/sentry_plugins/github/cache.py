@@ -0,0 +1,99 @@
+from __future__ import absolute_import
+
+import threading
+import time
+
+from collections import OrderedDict
+from sentry.utils import json, metrics
+
+from sentry_plugins.cache import cluster
+
+# returned by ``get`` when nothing is cached; ``None`` is a cached miss
+MISSING = object()
+
+
+class LocalCache(object):
+    """
+    A small thread safe LRU with per-entry expiration.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value, expires = self._data.pop(key)
+            except KeyError:
+                return MISSING
+            if expires < time.time():
+                return MISSING
+            self._data[key] = (value, expires)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, time.time() + ttl)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class GitHubUserCache(object):
+    """
+    Caches lookups about GitHub users across webhook deliveries.
+
+    Values are stored in Redis with an in-process LRU in front of it. Misses
+    (``None``) are cached too, but for a shorter period, so that we don't keep
+    spending GitHub's anonymous API quota on users we can't resolve.
+    """
+
+    def __init__(self, name, ttl, miss_ttl, local_ttl=60, max_local_size=1000):
+        self.name = name
+        self.ttl = ttl
+        self.miss_ttl = miss_ttl
+        self.local_ttl = local_ttl
+        self.local = LocalCache(max_local_size)
+
+    def get_key(self, key):
+        return 'sentry-plugins:github:%s:%s' % (self.name, key)
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is not MISSING:
+            metrics.incr('sentry-plugins.github.%s-cache.local-hit' % (self.name, ))
+            return value
+
+        client = cluster.get_routing_client()
+        result = client.get(self.get_key(key))
+        if result is None:
+            metrics.incr('sentry-plugins.github.%s-cache.miss' % (self.name, ))
+            return MISSING
+
+        metrics.incr('sentry-plugins.github.%s-cache.hit' % (self.name, ))
+        value = json.loads(result)
+        self.local.set(key, value, self.local_ttl)
+        return value
+
+    def set(self, key, value):
+        ttl = self.miss_ttl if value is None else self.ttl
+        client = cluster.get_routing_client()
+        client.setex(self.get_key(key), ttl, json.dumps(value))
+        self.local.set(key, value, min(ttl, self.local_ttl))
+
+
+# GitHub username -> GitHub user id
+user_id_cache = GitHubUserCache('user-id', ttl=60 * 60 * 24, miss_ttl=60 * 60)
+
+# (organization id, GitHub username) -> email of the matching Sentry user
+user_email_cache = GitHubUserCache('user-email', ttl=60 * 60, miss_ttl=60 * 15)
+
+
+def get_user_email_key(organization, username):
+    return '%s:%s' % (organization.id, username)
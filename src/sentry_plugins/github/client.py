@@ -2,9 +2,9 @@ from __future__ import absolute_import
 
 from requests.exceptions import HTTPError
 from django.conf import settings
-from sentry.http import build_session
 
 from sentry_plugins.exceptions import ApiError
+from sentry_plugins.http import get_session
 
 
 class GitHubClient(object):
@@ -16,7 +16,7 @@ class GitHubClient(object):
         self.token = token
 
     def _request(self, method, path, headers=None, data=None, params=None):
-        session = build_session()
+        session = get_session(self.url)
         try:
             resp = getattr(session, method.lower())(
                 url='{}{}'.format(self.url, path),
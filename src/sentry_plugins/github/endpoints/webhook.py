@@ -6,6 +6,18 @@ import hmac
 import logging
 import six
 
+# the pure Python backend (the default before ijson 3) is many times slower
+# than ``json.loads``
+try:
+    import ijson.backends.yajl2_c as ijson
+except ImportError:
+    import ijson
+
+from django.utils.encoding import force_bytes
+from ijson.common import JSONError, ObjectBuilder
+from itertools import islice
+from tempfile import SpooledTemporaryFile
+from django.conf import settings
 from django.db import IntegrityError, transaction
 from django.http import HttpResponse, Http404
 from django.utils.crypto import constant_time_compare
@@ -21,10 +33,89 @@ from sentry.plugins.providers import RepositoryProvider
 from sentry.utils import json
 
 from sentry_plugins.exceptions import ApiError
+from sentry_plugins.github.cache import (
+    MISSING, get_user_email_key, user_email_cache, user_id_cache
+)
 from sentry_plugins.github.client import GitHubClient
+from sentry_plugins.github.tasks import process_webhook
+from sentry_plugins.webhooks import (
+    forget_webhook_delivery, get_or_create_commit_authors, record_webhook_delivery
+)
 
 logger = logging.getLogger('sentry.webhooks')
 
+# bytes read from the request body at a time
+BODY_CHUNK_SIZE = 64 * 1024
+
+# request bodies (and the commits parsed out of them) larger than this are
+# spooled to disk, and only bodies larger than this are parsed incrementally
+MAX_BODY_MEMORY_SIZE = 1024 * 1024
+
+
+def iter_batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def build_json_value(events, prefix, event_type, value):
+    # consume the events of the value starting with ``event_type`` and build it
+    if event_type not in ('start_map', 'start_array'):
+        return value
+    builder = ObjectBuilder()
+    end_event = event_type.replace('start', 'end')
+    current = prefix
+    while (current, event_type) != (prefix, end_event):
+        builder.event(event_type, value)
+        current, event_type, value = next(events)
+    builder.event(event_type, value)
+    return builder.value
+
+
+def iter_spooled_items(spool, start, end):
+    spool.seek(start)
+    while spool.tell() < end:
+        yield json.loads(spool.readline())
+
+
+def load_json_event(fp, spool, lazy_keys=()):
+    """
+    Parse a JSON object from ``fp`` in a single pass.
+
+    Items of the arrays under ``lazy_keys`` (e.g. a push's commits) aren't
+    kept in memory; they are written to ``spool`` as they are parsed and
+    returned as generators reading them back one at a time. The whole
+    document has been parsed (and so is known to be valid) by the time this
+    returns.
+    """
+    events = ijson.parse(fp)
+    if next(events, None) != ('', 'start_map', None):
+        raise JSONError('expected an object')
+
+    event = {}
+    for prefix, event_type, value in events:
+        if prefix or event_type != 'map_key':
+            continue
+
+        key = value
+        prefix, event_type, value = next(events)
+        if key not in lazy_keys or event_type != 'start_array':
+            event[key] = build_json_value(events, prefix, event_type, value)
+            continue
+
+        start = spool.tell()
+        for prefix, event_type, value in events:
+            if event_type == 'end_array' and prefix == key:
+                break
+            item = build_json_value(events, prefix, event_type, value)
+            spool.write(force_bytes(json.dumps(item)) + b'\n')
+        event[key] = iter_spooled_items(spool, start, spool.tell())
+
+    return event
+
 
 def is_anonymous_email(email):
     return email[-25:] == '@users.noreply.github.com'
@@ -34,18 +125,30 @@ def get_external_id(username):
     return 'github:%s' % username
 
 
+def get_file_changes(commit):
+    # a file can only have a single change per commit
+    file_changes = []
+    seen = set()
+    for change_type, key in (('A', 'added'), ('D', 'removed'), ('M', 'modified')):
+        for filename in commit[key]:
+            if filename not in seen:
+                seen.add(filename)
+                file_changes.append((filename, change_type))
+    return file_changes
+
+
 class Webhook(object):
     def __call__(self, organization, event):
         raise NotImplementedError
 
 
 class PushEventWebhook(Webhook):
+    # number of commits whose authors are resolved and inserted together
+    batch_size = 100
+
     # https://developer.github.com/v3/activity/events/types/#pushevent
     def __call__(self, organization, event):
-        authors = {}
-
         client = GitHubClient()
-        gh_username_cache = {}
 
         try:
             repo = Repository.objects.get(
@@ -62,141 +165,286 @@ class PushEventWebhook(Webhook):
             repo.config['name'] = event['repository']['full_name']
             repo.save()
 
-        for commit in event['commits']:
-            if not commit['distinct']:
-                continue
+        commits = (
+            c for c in event['commits']
+            if c['distinct'] and not RepositoryProvider.should_ignore_commit(c['message'])
+        )
 
-            if RepositoryProvider.should_ignore_commit(commit['message']):
-                continue
+        # commits may be streamed from the request body, so we handle them in
+        # batches to keep memory use bounded regardless of the push size
+        for batch in iter_batches(commits, self.batch_size):
+            self.handle_commits(client, organization, repo, batch)
+
+    def handle_commits(self, client, organization, repo, commits):
+        pending = []
+
+        gh_username_cache, anonymous_authors = self.resolve_anonymous_authors(
+            client, organization, commits
+        )
 
+        authors = {}
+        author_emails = []
+        missing = {}
+        for commit in commits:
             author_email = commit['author']['email']
             if '@' not in author_email:
                 author_email = u'{}@localhost'.format(
                     author_email[:65],
                 )
-            # try to figure out who anonymous emails are
             elif is_anonymous_email(author_email):
                 gh_username = commit['author'].get('username')
-                # bot users don't have usernames
                 if gh_username:
-                    external_id = get_external_id(gh_username)
-                    if gh_username in gh_username_cache:
-                        author_email = gh_username_cache[gh_username] or author_email
-                    else:
-                        try:
-                            commit_author = CommitAuthor.objects.get(
-                                external_id=external_id,
-                                organization_id=organization.id,
-                            )
-                        except CommitAuthor.DoesNotExist:
-                            commit_author = None
-
-                        if commit_author is not None and not is_anonymous_email(
-                            commit_author.email
-                        ):
-                            author_email = commit_author.email
-                            gh_username_cache[gh_username] = author_email
-                        else:
-                            try:
-                                gh_user = client.request_no_auth('GET', '/users/%s' % gh_username)
-                            except ApiError as exc:
-                                logger.exception(six.text_type(exc))
-                            else:
-                                # even if we can't find a user, set to none so we
-                                # don't re-query
-                                gh_username_cache[gh_username] = None
-                                try:
-                                    user = User.objects.filter(
-                                        social_auth__provider='github',
-                                        social_auth__uid=gh_user['id'],
-                                        org_memberships=organization,
-                                    )[0]
-                                except IndexError:
-                                    pass
-                                else:
-                                    author_email = user.email
-                                    gh_username_cache[gh_username] = author_email
-                                    if commit_author is not None:
-                                        try:
-                                            with transaction.atomic():
-                                                commit_author.update(
-                                                    email=author_email,
-                                                    external_id=external_id,
-                                                )
-                                        except IntegrityError:
-                                            pass
-
-                        if commit_author is not None:
-                            authors[author_email] = commit_author
-
-            # TODO(dcramer): we need to deal with bad values here, but since
-            # its optional, lets just throw it out for now
+                    author_email = gh_username_cache.get(gh_username) or author_email
+                    if gh_username in anonymous_authors:
+                        authors[author_email] = anonymous_authors[gh_username]
+
+            author_emails.append(author_email)
+
+            missing.setdefault(author_email, commit['author'])
+
+        self.resolve_authors(
+            organization,
+            {
+                email: data
+                for email, data in six.iteritems(missing)
+                # TODO(dcramer): we need to deal with bad values here, but since
+                # its optional, lets just throw it out for now
+                if len(email) <= 75 and email not in authors
+            },
+            authors,
+        )
+
+        for commit, author_email in zip(commits, author_emails):
             if len(author_email) > 75:
                 author = None
-            elif author_email not in authors:
-                authors[author_email] = author = CommitAuthor.objects.get_or_create(
-                    organization_id=organization.id,
-                    email=author_email,
-                    defaults={
-                        'name': commit['author']['name'][:128],
-                    }
-                )[0]
+            else:
+                author = authors[author_email]
 
-                update_kwargs = {}
+            pending.append(
+                {
+                    'key': commit['id'],
+                    'message': commit['message'],
+                    'author': author,
+                    'date_added': dateutil.parser.parse(
+                        commit['timestamp'],
+                    ).astimezone(timezone.utc),
+                    'file_changes': get_file_changes(commit),
+                }
+            )
 
-                if author.name != commit['author']['name']:
-                    update_kwargs['name'] = commit['author']['name']
+        self.create_commits(organization, repo, pending)
+
+    def resolve_anonymous_authors(self, client, organization, commits):
+        """
+        Try to figure out who anonymous (``users.noreply.github.com``) emails
+        belong to. Authors we already know the GitHub username of come first,
+        the rest are looked up on GitHub; those lookups are cached across
+        deliveries so we don't keep spending anonymous API quota on them.
+
+        Returns a mapping of GitHub username to the resolved email (or
+        ``None``), and a mapping of GitHub username to the ``CommitAuthor``
+        already associated with it.
+        """
+        usernames = set()
+        for commit in commits:
+            gh_username = commit['author'].get('username')
+            # bot users don't have usernames
+            if gh_username and is_anonymous_email(commit['author']['email']):
+                usernames.add(gh_username)
+
+        if not usernames:
+            return {}, {}
+
+        external_ids = {get_external_id(u): u for u in usernames}
+        anonymous_authors = {}
+        for commit_author in CommitAuthor.objects.filter(
+            organization_id=organization.id,
+            external_id__in=list(external_ids),
+        ):
+            anonymous_authors[external_ids[commit_author.external_id]] = commit_author
 
-                gh_username = commit['author'].get('username')
-                if gh_username:
-                    external_id = get_external_id(gh_username)
-                    if author.external_id != external_id and not is_anonymous_email(author.email):
-                        update_kwargs['external_id'] = external_id
-
-                if update_kwargs:
-                    try:
-                        with transaction.atomic():
-                            author.update(**update_kwargs)
-                    except IntegrityError:
-                        pass
-            else:
-                author = authors[author_email]
+        gh_username_cache = {}
+        gh_user_ids = {}
+        for gh_username in usernames:
+            commit_author = anonymous_authors.get(gh_username)
+            if commit_author is not None and not is_anonymous_email(commit_author.email):
+                gh_username_cache[gh_username] = commit_author.email
+                continue
 
-            try:
-                with transaction.atomic():
-                    c = Commit.objects.create(
-                        repository_id=repo.id,
-                        organization_id=organization.id,
-                        key=commit['id'],
-                        message=commit['message'],
-                        author=author,
-                        date_added=dateutil.parser.parse(
-                            commit['timestamp'],
-                        ).astimezone(timezone.utc),
-                    )
-                    for fname in commit['added']:
-                        CommitFileChange.objects.create(
-                            organization_id=organization.id,
-                            commit=c,
-                            filename=fname,
-                            type='A',
+            author_email = user_email_cache.get(get_user_email_key(organization, gh_username))
+            if author_email is not MISSING:
+                gh_username_cache[gh_username] = author_email
+                continue
+
+            gh_user_id = user_id_cache.get(gh_username)
+            if gh_user_id is MISSING:
+                try:
+                    gh_user = client.request_no_auth('GET', '/users/%s' % gh_username)
+                except ApiError as exc:
+                    logger.exception(six.text_type(exc))
+                    if exc.code == 404:
+                        user_id_cache.set(gh_username, None)
+                    continue
+                gh_user_id = six.text_type(gh_user['id'])
+                user_id_cache.set(gh_username, gh_user_id)
+            elif gh_user_id is None:
+                continue
+
+            # even if we can't find a user, set to none so we
+            # don't re-query
+            gh_username_cache[gh_username] = None
+            gh_user_ids[gh_user_id] = gh_username
+
+        if gh_user_ids:
+            for gh_user_id, author_email in User.objects.filter(
+                social_auth__provider='github',
+                social_auth__uid__in=list(gh_user_ids),
+                org_memberships=organization,
+            ).values_list('social_auth__uid', 'email'):
+                gh_username = gh_user_ids[gh_user_id]
+                if gh_username_cache[gh_username] is None:
+                    gh_username_cache[gh_username] = author_email
+
+            for gh_username in six.itervalues(gh_user_ids):
+                user_email_cache.set(
+                    get_user_email_key(organization, gh_username), gh_username_cache[gh_username]
+                )
+
+        for gh_username, commit_author in six.iteritems(anonymous_authors):
+            author_email = gh_username_cache.get(gh_username)
+            if author_email and is_anonymous_email(commit_author.email):
+                try:
+                    with transaction.atomic():
+                        commit_author.update(
+                            email=author_email,
+                            external_id=get_external_id(gh_username),
                         )
-                    for fname in commit['removed']:
-                        CommitFileChange.objects.create(
+                except IntegrityError:
+                    pass
+
+        return gh_username_cache, anonymous_authors
+
+    def resolve_authors(self, organization, missing, authors):
+        """
+        Fetch or create the ``CommitAuthor`` for every email in ``missing``
+        (a mapping of email to the commit's author payload), keeping names
+        and external ids in sync with what GitHub sent us.
+        """
+        resolved = get_or_create_commit_authors(
+            organization.id,
+            {email: data['name'] for email, data in six.iteritems(missing)},
+            external_ids={
+                email: get_external_id(data['username'])
+                for email, data in six.iteritems(missing)
+                if data.get('username') and not is_anonymous_email(email)
+            },
+        )
+
+        for author_email, author in six.iteritems(resolved):
+            data = missing[author_email]
+            update_kwargs = {}
+
+            if author.name != data['name']:
+                update_kwargs['name'] = data['name']
+
+            gh_username = data.get('username')
+            if gh_username:
+                external_id = get_external_id(gh_username)
+                if author.external_id != external_id and not is_anonymous_email(author.email):
+                    update_kwargs['external_id'] = external_id
+
+            if update_kwargs:
+                try:
+                    with transaction.atomic():
+                        author.update(**update_kwargs)
+                except IntegrityError:
+                    pass
+
+            authors[author_email] = author
+
+    def create_commits(self, organization, repo, commits):
+        """
+        Insert all new commits and their file changes in bulk.
+
+        Commits which already exist are skipped up front. If a concurrent
+        delivery wins the race and the bulk insert conflicts, we fall back to
+        inserting row by row so the remaining commits are still stored.
+        """
+        if not commits:
+            return
+
+        existing = set(
+            Commit.objects.filter(
+                repository_id=repo.id,
+                key__in=[c['key'] for c in commits],
+            ).values_list('key', flat=True)
+        )
+
+        new_commits = []
+        for commit in commits:
+            if commit['key'] in existing:
+                continue
+            existing.add(commit['key'])
+            new_commits.append(commit)
+
+        if not new_commits:
+            return
+
+        try:
+            with transaction.atomic():
+                Commit.objects.bulk_create(
+                    [
+                        Commit(
+                            repository_id=repo.id,
                             organization_id=organization.id,
-                            commit=c,
-                            filename=fname,
-                            type='D',
-                        )
-                    for fname in commit['modified']:
-                        CommitFileChange.objects.create(
+                            key=c['key'],
+                            message=c['message'],
+                            author=c['author'],
+                            date_added=c['date_added'],
+                        ) for c in new_commits
+                    ]
+                )
+                # bulk_create doesn't give us primary keys back on all backends
+                commit_ids = dict(
+                    Commit.objects.filter(
+                        repository_id=repo.id,
+                        key__in=[c['key'] for c in new_commits],
+                    ).values_list('key', 'id')
+                )
+                CommitFileChange.objects.bulk_create(
+                    [
+                        CommitFileChange(
                             organization_id=organization.id,
-                            commit=c,
-                            filename=fname,
-                            type='M',
-                        )
-            except IntegrityError:
-                pass
+                            commit_id=commit_ids[c['key']],
+                            filename=filename,
+                            type=change_type,
+                        ) for c in new_commits for filename, change_type in c['file_changes']
+                    ]
+                )
+        except IntegrityError:
+            for commit in new_commits:
+                self.create_commit(organization, repo, commit)
+
+    def create_commit(self, organization, repo, commit):
+        try:
+            with transaction.atomic():
+                c = Commit.objects.create(
+                    repository_id=repo.id,
+                    organization_id=organization.id,
+                    key=commit['key'],
+                    message=commit['message'],
+                    author=commit['author'],
+                    date_added=commit['date_added'],
+                )
+                for filename, change_type in commit['file_changes']:
+                    CommitFileChange.objects.create(
+                        organization_id=organization.id,
+                        commit=c,
+                        filename=filename,
+                        type=change_type,
+                    )
+        except IntegrityError:
+            pass
 
 
 class GithubWebhookEndpoint(View):
@@ -208,17 +456,36 @@ class GithubWebhookEndpoint(View):
     def get_handler(self, event_type):
         return self._handlers.get(event_type)
 
-    def is_valid_signature(self, method, body, secret, signature):
+    def is_async(self):
+        # when enabled, handlers run in a task and redeliveries are dropped
+        return getattr(settings, 'GITHUB_WEBHOOK_ASYNC', False)
+
+    def get_signature(self, method, secret):
         if method == 'sha1':
             mod = hashlib.sha1
         else:
             raise NotImplementedError('signature method %s is not supported' % (method, ))
-        expected = hmac.new(
+        return hmac.new(
             key=secret.encode('utf-8'),
-            msg=body,
             digestmod=mod,
-        ).hexdigest()
-        return constant_time_compare(expected, signature)
+        )
+
+    def read_body(self, request, signature):
+        """
+        Copy the request body into a spooled file, updating ``signature``
+        with each chunk as it passes through, and return the file along with
+        the number of bytes read.
+        """
+        body = SpooledTemporaryFile(max_size=MAX_BODY_MEMORY_SIZE)
+        size = 0
+        while True:
+            chunk = request.read(BODY_CHUNK_SIZE)
+            if not chunk:
+                break
+            signature.update(chunk)
+            body.write(chunk)
+            size += len(chunk)
+        return body, size
 
     @method_decorator(csrf_exempt)
     def dispatch(self, request, *args, **kwargs):
@@ -252,8 +519,17 @@ class GithubWebhookEndpoint(View):
             )
             return HttpResponse(status=401)
 
-        body = six.binary_type(request.body)
-        if not body:
+        # GitHub signs with sha1 (X-Hub-Signature), which is computed as the
+        # body streams in
+        expected = self.get_signature('sha1', secret)
+        body, body_size = self.read_body(request, expected)
+        try:
+            return self.handle_body(request, organization, secret, body, body_size, expected)
+        finally:
+            body.close()
+
+    def handle_body(self, request, organization, secret, body, body_size, expected):
+        if not body_size:
             logger.error(
                 'github.webhook.missing-body', extra={
                     'organization_id': organization.id,
@@ -262,7 +538,7 @@ class GithubWebhookEndpoint(View):
             return HttpResponse(status=400)
 
         try:
-            handler = self.get_handler(request.META['HTTP_X_GITHUB_EVENT'])
+            event_type = request.META['HTTP_X_GITHUB_EVENT']
         except KeyError:
             logger.error(
                 'github.webhook.missing-event', extra={
@@ -271,6 +547,7 @@ class GithubWebhookEndpoint(View):
             )
             return HttpResponse(status=400)
 
+        handler = self.get_handler(event_type)
         if not handler:
             return HttpResponse(status=204)
 
@@ -284,7 +561,11 @@ class GithubWebhookEndpoint(View):
             )
             return HttpResponse(status=400)
 
-        if not self.is_valid_signature(method, body, secret, signature):
+        if method != 'sha1':
+            # raises for methods we don't support
+            expected = self.get_signature(method, secret)
+
+        if not constant_time_compare(expected.hexdigest(), signature):
             logger.error(
                 'github.webhook.invalid-signature', extra={
                     'organization_id': organization.id,
@@ -292,17 +573,56 @@ class GithubWebhookEndpoint(View):
             )
             return HttpResponse(status=401)
 
+        is_async = self.is_async()
+
+        spool = None
         try:
-            event = json.loads(body.decode('utf-8'))
-        except JSONDecodeError:
-            logger.error(
-                'github.webhook.invalid-json',
-                extra={
-                    'organization_id': organization.id,
-                },
-                exc_info=True
-            )
-            return HttpResponse(status=400)
+            try:
+                body.seek(0)
+                if is_async or body_size <= MAX_BODY_MEMORY_SIZE:
+                    # the async task needs the whole event anyways
+                    event = json.loads(body.read().decode('utf-8'))
+                else:
+                    spool = SpooledTemporaryFile(max_size=MAX_BODY_MEMORY_SIZE)
+                    event = load_json_event(body, spool, lazy_keys=('commits', ))
+            except (JSONDecodeError, JSONError):
+                logger.error(
+                    'github.webhook.invalid-json',
+                    extra={
+                        'organization_id': organization.id,
+                    },
+                    exc_info=True
+                )
+                return HttpResponse(status=400)
+
+            # only claimed once the body is known to be valid, so a broken delivery
+            # doesn't keep its redelivery from being processed
+            delivery_id = request.META.get('HTTP_X_GITHUB_DELIVERY')
+            if is_async and not record_webhook_delivery('github', delivery_id):
+                logger.info(
+                    'github.webhook.duplicate-delivery',
+                    extra={
+                        'organization_id': organization.id,
+                        'delivery_id': delivery_id,
+                    }
+                )
+                return HttpResponse(status=202)
 
-        handler()(organization, event)
-        return HttpResponse(status=204)
+            if is_async:
+                try:
+                    process_webhook.delay(
+                        organization_id=organization.id,
+                        event_type=event_type,
+                        event=event,
+                    )
+                except Exception:
+                    # allow the redelivery to be processed
+                    forget_webhook_delivery('github', delivery_id)
+                    raise
+                return HttpResponse(status=202)
+
+            handler()(organization, event)
+            return HttpResponse(status=204)
+        finally:
+            if spool is not None:
+                spool.close()
@@ -14,9 +14,14 @@ from sentry.plugins import providers
 from sentry.utils.http import absolute_uri
 
 from sentry_plugins.base import CorePluginMixin
+from sentry_plugins.cache import (
+    compare_commits_cache, get_compare_commits_key, is_sha
+)
 from sentry_plugins.exceptions import ApiError, ApiUnauthorized
 
 from .client import GitHubClient
+# registers the webhook task with workers which never load the urls
+from .tasks import process_webhook  # NOQA
 
 ERR_INTERNAL = (
     'An internal error occurred with the integration and the Sentry team has'
@@ -382,6 +387,20 @@ class GitHubRepositoryProvider(GitHubMixin, providers.RepositoryProvider):
         if actor is None:
             raise NotImplementedError('Cannot fetch commits anonymously')
 
+        # the commits between two SHAs never change, so we can cache them
+        cacheable = is_sha(end_sha) and (start_sha is None or is_sha(start_sha))
+        if cacheable:
+            cache_key = get_compare_commits_key(repo, start_sha, end_sha)
+            commits = compare_commits_cache.get(cache_key)
+            if commits is not None:
+                return commits
+
+        commits = self._compare_commits(repo, start_sha, end_sha, actor)
+        if cacheable:
+            compare_commits_cache.set(cache_key, commits)
+        return commits
+
+    def _compare_commits(self, repo, start_sha, end_sha, actor):
         client = self.get_client(actor)
         # use config name because that is kept in sync via webhooks
         name = repo.config['name']
@@ -2,9 +2,9 @@ from __future__ import absolute_import
 
 from requests.exceptions import HTTPError
 from six.moves.urllib.parse import quote
-from sentry.http import build_session
 
 from sentry_plugins.exceptions import ApiError
+from sentry_plugins.http import get_session
 
 
 class GitLabClient(object):
@@ -16,7 +16,7 @@ class GitLabClient(object):
         headers = {
             'Private-Token': self.token,
         }
-        session = build_session()
+        session = get_session(self.url)
         try:
             resp = getattr(session, method.lower())(
                 url='{}/api/v3/{}'.format(self.url, path.lstrip('/')),
@@ -155,7 +155,32 @@ def _make_event_card(
     }
 
 
-def make_event_notification(group, event, tenant, new=True, event_target=False):
+def make_event_notification(group, event, tenant, new=True, event_target=False, cache=None):
+    """
+    Returns the notification for ``event`` to send to ``tenant``.
+
+    Nothing but the group and event go into rendering it, so when notifying
+    several tenants about the same event pass the same ``cache`` dict to
+    render it once and hand each tenant its own copy.
+    """
+    key = (group.id, event.id, new, event_target)
+    rv = cache.get(key) if cache is not None else None
+    if rv is None:
+        rv = _render_event_notification(group, event, new, event_target)
+        if cache is not None:
+            cache[key] = rv
+    return _copy_notification(rv)
+
+
+def _copy_notification(notification):
+    # the card and its metadata are copied so each tenant's copy can be
+    # changed without touching the cached one, the rest is shared
+    card = dict(notification['card'])
+    card['metadata'] = dict(card['metadata'])
+    return dict(notification, card=card)
+
+
+def _render_event_notification(group, event, new, event_target):
     project = event.project
     level = group.get_level_display().upper()
 
@@ -183,7 +208,24 @@ def make_event_notification(group, event, tenant, new=True, event_target=False):
     }
 
 
-def make_activity_notification(activity, tenant):
+def make_activity_notification(activity, tenant, cache=None):
+    """
+    Returns the notification for ``activity`` to send to ``tenant``, or
+    ``None`` if there is nothing to say about it.
+
+    Like ``make_event_notification`` this is rendered once per ``cache``.
+    """
+    key = ('activity', activity.id)
+    if cache is not None and key in cache:
+        rv = cache[key]
+    else:
+        rv = _render_activity_notification(activity)
+        if cache is not None:
+            cache[key] = rv
+    return _copy_notification(rv) if rv is not None else None
+
+
+def _render_activity_notification(activity):
     if activity.type in (Activity.UNASSIGNED, Activity.ASSIGNED):
         if activity.type == Activity.ASSIGNED:
             assignee_id = activity.data.get('assignee')
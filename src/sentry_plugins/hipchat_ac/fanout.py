@@ -0,0 +1,149 @@
+from __future__ import absolute_import
+
+import logging
+import os
+import threading
+import time
+
+from collections import defaultdict, deque
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+from sentry.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# calls running at once across all tenants, and for a single tenant
+MAX_WORKERS = 10
+MAX_TENANT_CONCURRENCY = 2
+
+# seconds to wait for a call before it's reported as failed
+CALL_TIMEOUT = 10
+
+
+class FanoutCall(object):
+    def __init__(self, key, func, args):
+        self.key = key
+        self.func = func
+        self.args = args
+        self.started = False
+        self.cancelled = False
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+
+    def run(self):
+        if self.cancelled:
+            self._done.set()
+            return
+        self.started = True
+        try:
+            self._result = self.func(*self.args)
+        except Exception as e:
+            self._error = e
+        finally:
+            self._done.set()
+
+    def get(self, timeout):
+        if not self._done.wait(timeout):
+            raise TimeoutError()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class Fanout(object):
+    """
+    Runs calls for many tenants concurrently on a process wide thread pool.
+
+    Concurrency is bounded globally (by the size of the pool) and per tenant.
+    Calls of a tenant which already has ``max_tenant_concurrency`` calls
+    running are queued outside of the pool and only handed to it once one
+    of those finishes, so one busy room can't take up every worker. The
+    pool is recreated in forked children.
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS, max_tenant_concurrency=MAX_TENANT_CONCURRENCY):
+        self.max_workers = max_workers
+        self.max_tenant_concurrency = max_tenant_concurrency
+        self._lock = threading.Lock()
+        self._pid = None
+        self._pool = None
+        self._running = defaultdict(int)
+        self._waiting = defaultdict(deque)
+
+    def get_pool(self):
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = ThreadPool(self.max_workers)
+                self._pid = os.getpid()
+                # whatever the parent was running isn't running here
+                self._running.clear()
+                self._waiting.clear()
+            return self._pool
+
+    def submit(self, call):
+        pool = self.get_pool()
+        with self._lock:
+            if self._running[call.key] >= self.max_tenant_concurrency:
+                self._waiting[call.key].append(call)
+                return
+            self._running[call.key] += 1
+        pool.apply_async(self._run, (call, ))
+
+    def _run(self, call):
+        try:
+            call.run()
+        finally:
+            with self._lock:
+                waiting = self._waiting.get(call.key)
+                if waiting:
+                    # the next call of the tenant takes over this one's slot
+                    next_call = waiting.popleft()
+                else:
+                    next_call = None
+                    self._waiting.pop(call.key, None)
+                    self._running[call.key] -= 1
+                    if self._running[call.key] <= 0:
+                        del self._running[call.key]
+            if next_call is not None:
+                self.get_pool().apply_async(self._run, (next_call, ))
+
+    def run(self, calls, timeout=CALL_TIMEOUT):
+        """
+        Call ``func(*args)`` for every ``(key, func, args)`` in ``calls``,
+        where ``key`` identifies the tenant.
+
+        Returns a ``(results, errors)`` tuple of dicts by key. Calls which
+        haven't finished after ``timeout`` seconds are reported with a
+        ``multiprocessing.TimeoutError``. Those which haven't started yet
+        are dropped, those which have keep running in the background (and
+        are logged, as nothing bounds them anymore.)
+        """
+        pending = [FanoutCall(key, func, args) for key, func, args in calls]
+        for call in pending:
+            self.submit(call)
+
+        deadline = time.time() + timeout
+        results = {}
+        errors = {}
+        for call in pending:
+            try:
+                results[call.key] = call.get(max(deadline - time.time(), 0))
+            except TimeoutError as e:
+                errors[call.key] = e
+                call.cancelled = True
+                if call.started:
+                    logger.warning(
+                        'hipchat-ac.fanout.orphaned-call',
+                        extra={
+                            'key': call.key,
+                            'timeout': timeout,
+                        }
+                    )
+                    metrics.incr('sentry-plugins.hipchat-ac.fanout.orphaned')
+            except Exception as e:
+                errors[call.key] = e
+        return results, errors
+
+
+fanout = Fanout()
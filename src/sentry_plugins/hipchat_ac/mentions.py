@@ -1,6 +1,7 @@
 from __future__ import absolute_import
 
 import json
+import six
 import time
 
 from sentry.utils.dates import to_datetime, to_timestamp
@@ -12,6 +13,10 @@ from django.conf import settings
 MAX_RECENT = 15
 RECENT_HOURS = 24 * 30
 
+# old mentions are trimmed once this many have piled up, rather than on
+# every write (reads only look at the most recent ones anyway)
+TRIM_THRESHOLD = MAX_RECENT * 2
+
 # The Redis cluster manager (``clusters``) was added in Sentry 8.2 (GH-2714)
 # and replaces ``make_rb_cluster`` (which will be removed in a future version.)
 try:
@@ -22,45 +27,181 @@ except ImportError:
     cluster = make_rb_cluster(settings.SENTRY_REDIS_OPTIONS['hosts'])
 
 
+# Mentions of a tenant are stored as:
+#
+# - a sorted set of ``<group id>/<event id or ->`` ids, by last mention
+# - a hash of id -> JSON encoded item
+# - a set of ids per project, to clear a project's mentions
+#
+# Previously every item was stored under its own key (see
+# ``get_legacy_item_key``), those are moved into the hash as they're found.
+
+EXPIRES = (RECENT_HOURS + 1) * 60 * 60
+
+
 def get_key(tenant):
     return 'sentry-hipchat-ac:%s:mentions' % tenant.id
 
 
-def get_recent_mentions(tenant):
+def get_items_key(tenant):
+    return '%s:items' % get_key(tenant)
+
+
+def get_project_key(tenant, project_id):
+    return '%s:project:%s' % (get_key(tenant), project_id)
+
+
+def get_migrated_key(tenant):
+    return '%s:migrated' % get_key(tenant)
+
+
+def get_legacy_item_key(tenant, id):
+    return '%s:%s' % (get_key(tenant), id)
+
+
+def store_item(client, tenant, id, item):
+    items_key = get_items_key(tenant)
+    project_key = get_project_key(tenant, item['project'])
+    client.hset(items_key, id, json.dumps(item))
+    client.expire(items_key, EXPIRES)
+    client.sadd(project_key, id)
+    client.expire(project_key, EXPIRES)
+
+
+def migrate_items(tenant, ids):
+    """
+    Move items stored under their own key into the tenant's hash, returning
+    the ones which were found by id.
+    """
+    with cluster.map() as client:
+        values = [(id, client.get(get_legacy_item_key(tenant, id))) for id in ids]
+    items = dict((id, json.loads(x.value)) for id, x in values if x.value is not None)
+
+    if items:
+        with cluster.map() as client:
+            for id, item in six.iteritems(items):
+                store_item(client, tenant, id, item)
+                client.delete(get_legacy_item_key(tenant, id))
+    return items
+
+
+def migrate_tenant_mentions(tenant):
     client = cluster.get_routing_client()
-    key = get_key(tenant)
-    ids = [x for x in client.zrangebyscore(key, time.time() - (RECENT_HOURS * 60), '+inf')
-           ][-MAX_RECENT:]
+    migrated_key = get_migrated_key(tenant)
+    if client.exists(migrated_key):
+        return
+
+    ids = client.zrange(get_key(tenant), 0, -1)
+    if ids:
+        values = client.hmget(get_items_key(tenant), ids)
+        missing = [id for id, value in zip(ids, values) if value is None]
+        if missing:
+            migrate_items(tenant, missing)
+    # items stored before the migration have expired by the time this does
+    client.setex(migrated_key, EXPIRES, 1)
 
+
+def remove_mentions(tenant, ids):
+    client = cluster.get_routing_client()
+    items_key = get_items_key(tenant)
+    values = client.hmget(items_key, ids)
     with cluster.map() as map_client:
-        items = [map_client.get('%s:%s' % (key, id)) for id in ids]
-    items = [json.loads(x.value) for x in items if x.value is not None]
+        map_client.zrem(get_key(tenant), *ids)
+        map_client.hdel(items_key, *ids)
+        for id, value in zip(ids, values):
+            if value is not None:
+                map_client.srem(get_project_key(tenant, json.loads(value)['project']), id)
+            else:
+                map_client.delete(get_legacy_item_key(tenant, id))
+
+
+def trim_mentions(tenant):
+    client = cluster.get_routing_client()
+    key = get_key(tenant)
+    ids = set(client.zrangebyscore(key, '-inf', time.time() - (RECENT_HOURS * 60)))
+    ids.update(client.zrange(key, 0, -MAX_RECENT - 1))
+    if ids:
+        remove_mentions(tenant, list(ids))
+
+
+def make_snapshot(project, group, event=None):
+    """
+    Everything needed to render a mention, so that reading recent mentions
+    doesn't need to hit the database.
+    """
+    if event is None:
+        event = group.get_latest_event()
+    return {
+        'message': event.message if event is not None else group.message,
+        'culprit': event.culprit if event is not None else group.culprit,
+        'level': group.get_level_display(),
+        'project_slug': project.slug,
+        'project_name': project.name,
+        'project_url': project.get_absolute_url(),
+        'group_url': group.get_absolute_url(),
+        'event_id': event.id if event is not None else None,
+    }
+
 
-    projects = items and dict(
+def load_snapshots(items):
+    """
+    Build the snapshots of mentions recorded before they were stored along
+    with them.
+    """
+    projects = dict(
         (x.id, x) for x in Project.objects.filter(
             pk__in=[x['project'] for x in items],
         )
-    ) or {}
-    groups = items and dict(
+    )
+    groups = dict(
         (x.id, x) for x in Group.objects.filter(
             pk__in=[x['group'] for x in items],
         )
-    ) or {}
-    events = items and dict(
+    )
+    events = dict(
         (x.id, x) for x in Event.objects.filter(
             pk__in=[x['event'] for x in items if x['event'] is not None],
         )
-    ) or {}
+    )
 
     for item in items:
-        item['project'] = projects.get(item['project'])
-        item['group'] = groups.get(item['group'])
-        item['event'] = events.get(item['event'])
-        if item['event'] is None and item['group'] is not None:
-            item['event'] = item['group'].get_latest_event()
-        item['last_mentioned'] = to_datetime(item['last_mentioned'])
+        project = projects.get(item['project'])
+        group = groups.get(item['group'])
+        if project is None or group is None:
+            continue
+        item['snapshot'] = make_snapshot(project, group, events.get(item['event']))
 
-    return items
+
+def get_recent_mentions(tenant):
+    client = cluster.get_routing_client()
+    key = get_key(tenant)
+    ids = [x for x in client.zrangebyscore(key, time.time() - (RECENT_HOURS * 60), '+inf')
+           ][-MAX_RECENT:]
+
+    values = client.hmget(get_items_key(tenant), ids) if ids else []
+    items = dict((id, json.loads(value)) for id, value in zip(ids, values) if value is not None)
+    if len(items) < len(ids):
+        items.update(migrate_items(tenant, [id for id in ids if id not in items]))
+
+    missing = [(id, items[id]) for id in ids if id in items and 'snapshot' not in items[id]]
+    if missing:
+        load_snapshots([item for _, item in missing])
+        # stored, so these are only built once
+        with cluster.map() as map_client:
+            for id, item in missing:
+                if 'snapshot' in item:
+                    map_client.hset(get_items_key(tenant), id, json.dumps(item))
+    items = [items[id] for id in ids if id in items]
+
+    results = []
+    for item in items:
+        snapshot = item.pop('snapshot', None)
+        if snapshot is None:
+            continue
+        item.update(snapshot)
+        item['last_mentioned'] = to_datetime(item['last_mentioned'])
+        results.append(item)
+    return results
 
 
 def count_recent_mentions(tenant):
@@ -71,45 +212,55 @@ def count_recent_mentions(tenant):
 
 def clear_tenant_mentions(tenant):
     client = cluster.get_routing_client()
-    key = get_key(tenant)
-    client.delete(key)
+    items_key = get_items_key(tenant)
+    project_ids = set(json.loads(x)['project'] for x in client.hvals(items_key))
+    with cluster.map() as map_client:
+        map_client.delete(get_key(tenant))
+        map_client.delete(items_key)
+        for project_id in project_ids:
+            map_client.delete(get_project_key(tenant, project_id))
 
 
 def clear_project_mentions(tenant, projects):
-    client = cluster.get_routing_client()
-    project_ids = set([x.id for x in projects])
-    key = get_key(tenant)
-    ids = client.zrange(key, 0, -1)
-    with cluster.map() as map_client:
-        items = [map_client.get('%s:%s' % (key, id)) for id in ids]
-    items = [json.loads(x.value) for x in items if x.value is not None]
+    migrate_tenant_mentions(tenant)
 
-    to_remove = []
-    for item in items:
-        if item['project'] in project_ids:
-            to_remove.append('%s/%s' % (item['group'], item['event'] or '-'))
+    ids = []
+    with cluster.map() as map_client:
+        for project in projects:
+            ids.append(map_client.smembers(get_project_key(tenant, project.id)))
+    ids = set().union(*(x.value for x in ids))
 
-    if to_remove:
-        client.zrem(key, *to_remove)
+    with cluster.map() as map_client:
+        if ids:
+            map_client.zrem(get_key(tenant), *ids)
+            map_client.hdel(get_items_key(tenant), *ids)
+        for project in projects:
+            map_client.delete(get_project_key(tenant, project.id))
 
 
-def mention_event(project, group, tenant, event=None):
+def mention_event(project, group, tenant, event=None, snapshot=None):
+    """
+    Record a mention of ``group`` (or ``event``) in ``tenant``. When
+    mentioning it in several tenants pass the same ``snapshot`` (see
+    ``make_snapshot``) to all of them.
+    """
+    if snapshot is None:
+        snapshot = make_snapshot(project, group, event)
     ts = to_timestamp(timezone.now())
     id = '%s/%s' % (group.id, event.id if event is not None else '-')
-    item = json.dumps(
-        {
-            'project': project.id,
-            'group': group.id,
-            'event': event.id if event is not None else None,
-            'last_mentioned': ts,
-        }
-    )
+    item = {
+        'project': project.id,
+        'group': group.id,
+        'event': event.id if event is not None else None,
+        'last_mentioned': ts,
+        'snapshot': snapshot,
+    }
 
-    expires = (RECENT_HOURS + 1) * 60 * 60
     with cluster.map() as client:
         key = get_key(tenant)
         client.zadd(key, ts, id)
-        client.expire(key, expires)
-        client.setex('%s:%s' % (key, id), expires, item)
-        client.zremrangebyscore(key, '-inf', time.time() - (RECENT_HOURS * 60))
-        client.zremrangebyrank(key, 0, -MAX_RECENT - 1)
+        client.expire(key, EXPIRES)
+        store_item(client, tenant, id, item)
+        count = client.zcard(key)
+    if count.value > TRIM_THRESHOLD:
+        trim_mentions(tenant)
@@ -1,5 +1,8 @@
 from __future__ import absolute_import
 
+import logging
+import six
+
 from django.conf import settings
 from django.core.urlresolvers import reverse
 from six.moves.urllib.parse import urlparse, quote
@@ -7,6 +10,7 @@ from six.moves.urllib.parse import urlparse, quote
 from sentry import options
 from sentry.plugins import plugins
 from sentry.plugins.bases.notify import NotifyPlugin
+from sentry.utils import metrics
 from sentry.utils.http import absolute_uri
 
 from sentry_plugins.base import CorePluginMixin
@@ -14,6 +18,9 @@ from sentry_plugins.base import CorePluginMixin
 from .cards import make_event_notification, make_activity_notification
 from .endpoints.tenants import HipchatTenantsEndpoint
 from .endpoints.test_config import HipchatTestConfigEndpoint
+from .fanout import fanout
+
+logger = logging.getLogger(__name__)
 
 COLORS = {
     'ALERT': 'red',
@@ -72,6 +79,10 @@ def disable_plugin_for_tenant(project, tenant):
     return rv
 
 
+def send_tenant_notification(tenant, notification):
+    Context.for_tenant(tenant).send_notification(**notification)
+
+
 class HipchatPlugin(CorePluginMixin, NotifyPlugin):
     description = 'Bring Sentry to HipChat.'
     slug = 'hipchat-ac'
@@ -124,28 +135,81 @@ class HipchatPlugin(CorePluginMixin, NotifyPlugin):
             for tenant in Tenant.objects.filter(projects__in=[project]):
                 disable_plugin_for_tenant(project, tenant)
 
+    def notify_tenants(self, notifications, push_glance=False, fail_silently=False):
+        """
+        Send ``notifications``, a list of ``(tenant, notification)`` pairs,
+        to all rooms at once (see ``fanout``.)
+
+        Rooms which fail don't stop the others from being notified. Unless
+        ``fail_silently`` is set the first error is raised once all rooms
+        have been tried.
+        """
+        tenants = dict((tenant.id, tenant) for tenant, _ in notifications)
+        _, errors = fanout.run(
+            [
+                (tenant.id, send_tenant_notification, (tenant, notification))
+                for tenant, notification in notifications
+            ]
+        )
+
+        failed = []
+        for tenant_id, error in six.iteritems(errors):
+            if isinstance(error, OauthClientInvalidError):
+                # the add-on was uninstalled, clean up just like ``Context``
+                tenants.pop(tenant_id).delete()
+                continue
+            logger.warning(
+                'Unable to notify HipChat room: %s',
+                error,
+                extra={'tenant_id': tenant_id},
+            )
+            failed.append(error)
+
+        if push_glance:
+            for tenant in six.itervalues(tenants):
+                schedule_recent_events_glance(Context.for_tenant(tenant))
+
+        metrics.incr('sentry-plugins.hipchat-ac.notify', amount=len(notifications))
+        if failed:
+            metrics.incr('sentry-plugins.hipchat-ac.notify-failed', amount=len(failed))
+            if not fail_silently:
+                raise failed[0]
+
     def notify_users(self, group, event, fail_silently=False):
         tenants = Tenant.objects.filter(projects=event.project)
+        notifications = []
+        cards = {}
+        snapshot = None
         for tenant in tenants:
-            with Context.for_tenant(tenant) as ctx:
-                ctx.send_notification(**make_event_notification(group, event, tenant))
-
-                mentions.mention_event(
-                    project=event.project,
-                    group=group,
-                    tenant=tenant,
-                    event=event,
-                )
-                ctx.push_recent_events_glance()
+            if snapshot is None:
+                snapshot = mentions.make_snapshot(event.project, group, event)
+            # mentions are recorded first so the glance pushed after the
+            # notification includes this one
+            mentions.mention_event(
+                project=event.project,
+                group=group,
+                tenant=tenant,
+                event=event,
+                snapshot=snapshot,
+            )
+            notifications.append(
+                (tenant, make_event_notification(group, event, tenant, cache=cards))
+            )
+
+        self.notify_tenants(notifications, push_glance=True, fail_silently=fail_silently)
 
     def notify_about_activity(self, activity):
         tenants = Tenant.objects.filter(projects=activity.project)
+        notifications = []
+        cards = {}
         for tenant in tenants:
-            with Context.for_tenant(tenant) as ctx:
-                n = make_activity_notification(activity, tenant)
-                if n is not None:
-                    ctx.send_notification(**n)
+            n = make_activity_notification(activity, tenant, cache=cards)
+            if n is not None:
+                notifications.append((tenant, n))
+
+        self.notify_tenants(notifications)
 
 
-from .models import Tenant, Context
+from .models import Tenant, Context, OauthClientInvalidError
+from .tasks import schedule_recent_events_glance
 from . import mentions
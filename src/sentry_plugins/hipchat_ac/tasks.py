@@ -0,0 +1,49 @@
+from __future__ import absolute_import
+
+from django.core.cache import cache
+
+from sentry.tasks.base import instrumented_task
+
+# glance pushes for a room within this many seconds are coalesced into one
+GLANCE_DEBOUNCE = 5
+
+# a scheduled push is assumed to have been lost after this long
+GLANCE_PENDING_TIMEOUT = 60
+
+
+def get_glance_key(tenant_id, room_id):
+    return 'sentry-hipchat-ac:%s:%s:glance-pending' % (tenant_id, room_id)
+
+
+def schedule_recent_events_glance(ctx):
+    """
+    Push the recent events glance of the room of ``ctx`` in a few seconds,
+    unless a push for it is already pending. Since the glance is rendered
+    when the push runs, the room ends up with the latest state either way.
+    """
+    if not cache.add(get_glance_key(ctx.tenant.id, ctx.room_id), 1, GLANCE_PENDING_TIMEOUT):
+        return False
+    push_recent_events_glance.apply_async(
+        kwargs={
+            'tenant_id': ctx.tenant.id,
+            'room_id': ctx.room_id,
+        },
+        countdown=GLANCE_DEBOUNCE,
+    )
+    return True
+
+
+@instrumented_task(name='sentry_plugins.hipchat_ac.tasks.push_recent_events_glance')
+def push_recent_events_glance(tenant_id, room_id, **kwargs):
+    from .models import Context, Tenant
+
+    # cleared before rendering, so changes made while we push schedule
+    # another one rather than getting lost
+    cache.delete(get_glance_key(tenant_id, room_id))
+    try:
+        tenant = Tenant.objects.get(id=tenant_id)
+    except Tenant.DoesNotExist:
+        return
+
+    with Context(tenant=tenant, sender=None, context={'room_id': room_id}) as ctx:
+        ctx.push_recent_events_glance()
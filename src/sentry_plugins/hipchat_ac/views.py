@@ -26,6 +26,7 @@ from .utils import JsonResponse, IS_DEBUG
 from .models import Tenant, Context
 from . import mentions
 from .plugin import (enable_plugin_for_tenant, disable_plugin_for_tenant, get_addon_host_ident)
+from .tasks import schedule_recent_events_glance
 from .cards import (
     make_event_notification, make_generic_notification, make_subscription_update_notification, ICON,
     ICON2X
@@ -370,7 +371,7 @@ class ProjectSelectForm(forms.Form):
                 )
                 if removed_projects:
                     mentions.clear_project_mentions(self.tenant, removed_projects)
-                ctx.push_recent_events_glance()
+                schedule_recent_events_glance(ctx)
 
 
 def webhook(f):
@@ -658,7 +659,7 @@ def on_link_message(request, context, data):
                 tenant=context.tenant,
                 event=params['event'] and event or None,
             )
-            context.push_recent_events_glance()
+            schedule_recent_events_glance(context)
 
     return HttpResponse('', status=204)
 
@@ -670,7 +671,7 @@ def notify_tenant_added(tenant):
                 'The Sentry Hipchat integration was associated with this room.', color='green'
             )
         )
-        ctx.push_recent_events_glance()
+        schedule_recent_events_glance(ctx)
 
 
 def notify_tenant_removal(tenant):
@@ -680,4 +681,6 @@ def notify_tenant_removal(tenant):
                 'The Sentry Hipchat integration was disassociated with this room.', color='red'
             )
         )
+        # pushed right away, not coalesced, so the room doesn't keep showing
+        # the unlinked projects' events
         ctx.push_recent_events_glance()
@@ -0,0 +1,103 @@
+from __future__ import absolute_import
+
+import os
+import threading
+import time
+
+from collections import OrderedDict
+from six.moves.http_cookiejar import DefaultCookiePolicy
+from six.moves.urllib.parse import urlparse
+from sentry.http import build_session
+
+# number of per-host connection pools each session holds, and the number of
+# keep-alive connections kept open inside each of those pools
+POOL_CONNECTIONS = 4
+POOL_MAXSIZE = 10
+
+# sessions which haven't been used in this many seconds are dropped
+IDLE_TIMEOUT = 300
+
+# upper bound on the number of distinct hosts we keep sessions for
+MAX_SESSIONS = 100
+
+
+def get_host(url):
+    parts = urlparse(url)
+    return '%s://%s' % (parts.scheme, parts.netloc)
+
+
+class SessionPool(object):
+    """
+    A process-wide registry of keep-alive ``requests`` sessions, keyed by host.
+
+    Sessions are built with ``sentry.http.build_session`` (so they keep
+    Sentry's network blacklist) but are reused across requests and clients
+    talking to the same host, avoiding a TCP+TLS handshake per request.
+
+    Cookies are never persisted as sessions are shared between tenants, and
+    the registry is discarded in forked children so sockets aren't shared
+    with the parent process.
+
+    Sessions may be shared between threads, so sessions which are dropped
+    (idle, or over ``max_sessions``) are never closed explicitly: a thread
+    might still be using one. Their connections are closed once the last
+    reference to them is gone.
+    """
+
+    def __init__(self, pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE,
+                 idle_timeout=IDLE_TIMEOUT, max_sessions=MAX_SESSIONS):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()
+
+    def build_session(self):
+        session = build_session()
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        for adapter in session.adapters.values():
+            adapter.init_poolmanager(self.pool_connections, self.pool_maxsize)
+        return session
+
+    def _evict(self, now):
+        while self._sessions:
+            key, (_, last_used) = next(iter(self._sessions.items()))
+            if len(self._sessions) <= self.max_sessions and \
+                    now - last_used < self.idle_timeout:
+                break
+            del self._sessions[key]
+
+    def get(self, url):
+        if self._pid != os.getpid():
+            # we were forked; never reuse the parent's sockets
+            self._reset()
+
+        key = get_host(url)
+        now = time.time()
+        with self._lock:
+            try:
+                session, _ = self._sessions.pop(key)
+            except KeyError:
+                session = self.build_session()
+            self._sessions[key] = (session, now)
+            self._evict(now)
+        return session
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+session_pool = SessionPool()
+
+
+def get_session(url):
+    return session_pool.get(url)
@@ -1,46 +1,127 @@
 from __future__ import absolute_import
 
 import logging
+import random
 import re
 import six
+import time
 from hashlib import md5 as _md5
+from six import BytesIO
 
 from requests.exceptions import ConnectionError, RequestException
-from sentry.http import build_session
+from sentry.app import locks
 from sentry.utils import json
 from sentry.utils.cache import cache
+from sentry.utils.locking import UnableToAcquireLock
 from simplejson.decoder import JSONDecodeError
 from BeautifulSoup import BeautifulStoneSoup
 from django.utils.datastructures import SortedDict
 from django.utils.encoding import force_bytes
 
+from sentry_plugins.http import get_session
+
+try:
+    from xml.etree import cElementTree as ElementTree
+except ImportError:
+    from xml.etree import ElementTree
+
 log = logging.getLogger(__name__)
 
+XMLParseError = ElementTree.ParseError
+
+# the body is re-encoded as UTF-8, so any declared encoding has to go
+XML_DECLARATION_RE = re.compile(r'^\s*<\?xml[^>]*\?>')
+
 
 def md5(*bits):
     return _md5(':'.join((force_bytes(bit, errors='replace') for bit in bits)))
 
 
-class JIRAError(Exception):
+def get_compact_text(response):
+    """
+    The response body without any insignificant whitespace.
+    """
+    if response.json is None:
+        return response.text
+    return json.dumps(response.json, separators=(',', ':'))
+
+
+def iter_xml_users(text):
+    """
+    Yield ``(name, display name)`` pairs from the XML flavour of the user
+    picker API, without building a tree of the whole document.
+
+    Raises ``XMLParseError`` for malformed documents.
+    """
+    source = BytesIO(force_bytes(XML_DECLARATION_RE.sub('', text, count=1)))
+    for _, elem in ElementTree.iterparse(source):
+        if elem.tag != 'users':
+            continue
+        name = elem.find('name')
+        # a <users> element wrapping the results rather than a result
+        if name is None:
+            continue
+        html = elem.find('html')
+        yield name.text, ''.join(html.itertext()) if html is not None else None
+        elem.clear()
+
+
+# the body of a response which hasn't been parsed yet
+NOT_PARSED = object()
+
+
+class JIRABody(object):
+    """
+    A response body which is only parsed once it's needed.
+
+    Bodies are parsed as JSON with plain dicts unless ``ordered`` is set
+    (JIRA returns fields in a meaningful order, but python obv. doesn't care).
+    Once parsed the raw text is dropped, and re-serialized should it be
+    needed again. XML bodies are kept as text and parsed on demand too.
+    """
+
+    def __init__(self, text, ordered=False):
+        self.ordered = ordered
+        self._text = text
+        self._json = NOT_PARSED if text else None
+        self._xml = None
+
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = json.dumps(self._json)
+        return self._text
+
+    @property
+    def json(self):
+        if self._json is NOT_PARSED:
+            kwargs = {'object_pairs_hook': SortedDict} if self.ordered else {}
+            try:
+                self._json = json.loads(self._text, **kwargs)
+            except (JSONDecodeError, ValueError):
+                # must be an awful code.
+                self._json = None
+            else:
+                self._text = None
+        return self._json
+
+    @property
+    def xml(self):
+        # perhaps it's XML? see ``iter_xml_users`` for a faster alternative
+        if self._xml is None and self._text and self._text[:5] == "<?xml" and \
+                self.json is None:
+            self._xml = BeautifulStoneSoup(self._text)
+        return self._xml
+
+
+class JIRAError(JIRABody, Exception):
     status_code = None
 
     def __init__(self, response_text, status_code=None):
         if status_code is not None:
             self.status_code = status_code
-        self.text = response_text
-        self.xml = None
-        if response_text:
-            try:
-                self.json = json.loads(response_text, object_pairs_hook=SortedDict)
-            except (JSONDecodeError, ValueError):
-                if self.text[:5] == "<?xml":
-                    # perhaps it's XML?
-                    self.xml = BeautifulStoneSoup(self.text)
-                # must be an awful code.
-                self.json = None
-        else:
-            self.json = None
-        super(JIRAError, self).__init__(response_text[:128])
+        JIRABody.__init__(self, response_text)
+        Exception.__init__(self, response_text[:128])
 
     @classmethod
     def from_response(cls, response):
@@ -51,35 +132,23 @@ class JIRAUnauthorized(JIRAError):
     status_code = 401
 
 
-class JIRAResponse(object):
+class JIRAResponse(JIRABody):
     """
     A Slimy little wrapper around a python-requests response object that renders
     JSON from JIRA's ordered dicts (fields come back in order, but python obv.
     doesn't care)
     """
 
-    def __init__(self, response_text, status_code):
-        self.text = response_text
-        self.xml = None
-        if response_text:
-            try:
-                self.json = json.loads(response_text, object_pairs_hook=SortedDict)
-            except (JSONDecodeError, ValueError):
-                if self.text[:5] == "<?xml":
-                    # perhaps it's XML?
-                    self.xml = BeautifulStoneSoup(self.text)
-                # must be an awful code.
-                self.json = None
-        else:
-            self.json = None
+    def __init__(self, response_text, status_code, ordered=False):
+        super(JIRAResponse, self).__init__(response_text, ordered=ordered)
         self.status_code = status_code
 
     def __repr__(self):
         return "<JIRAResponse<%s> %s>" % (self.status_code, self.text[:120])
 
     @classmethod
-    def from_response(cls, response):
-        return cls(response.text, response.status_code)
+    def from_response(cls, response, ordered=False):
+        return cls(response.text, response.status_code, ordered=ordered)
 
 
 class JIRAClient(object):
@@ -90,6 +159,7 @@ class JIRAClient(object):
     PROJECT_URL = '/rest/api/2/project'
     META_URL = '/rest/api/2/issue/createmeta'
     CREATE_URL = '/rest/api/2/issue'
+    BULK_CREATE_URL = '/rest/api/2/issue/bulk'
     PRIORITIES_URL = '/rest/api/2/priority'
     VERSIONS_URL = '/rest/api/2/project/%s/versions'
     USERS_URL = '/rest/api/2/user/assignable/search'
@@ -98,18 +168,46 @@ class JIRAClient(object):
     COMMENT_URL = '/rest/api/2/issue/%s/comment'
     HTTP_TIMEOUT = 5
 
+    # JIRA's default for jira.bulk.create.max.issues.per.request
+    BULK_CREATE_MAX_ISSUES = 50
+
+    # create meta is served from the cache for this long before it's
+    # considered stale, and kept around (and served while being refreshed)
+    # for up to ``CREATE_META_STALE_TTL``
+    CREATE_META_TTL = 60 * 10
+    CREATE_META_STALE_TTL = 60 * 60 * 24
+    CREATE_META_REFRESH_TIMEOUT = 60
+
+    # bumped whenever the format of ``get_cached`` entries changes
+    CACHE_VERSION = 2
+
+    # how long ``get_cached`` keeps responses around, per endpoint
+    CACHE_TTL = 60
+    PROJECTS_CACHE_TTL = 60 * 5
+    PRIORITIES_CACHE_TTL = 60 * 60
+    VERSIONS_CACHE_TTL = 60 * 15
+    USERS_CACHE_TTL = 60
+
+    # TTLs are stretched by up to this fraction so keys don't expire together
+    CACHE_TTL_JITTER = 0.2
+
+    # how often we check whether another request refilled an expired key
+    CACHE_WAIT_INTERVAL = 0.1
+
     def __init__(self, instance_uri, username, password):
         self.instance_url = instance_uri.rstrip('/')
         self.username = username
         self.password = password
 
     def get_projects_list(self):
-        return self.get_cached(self.PROJECT_URL)
+        return self.get_cached(self.PROJECT_URL, ttl=self.PROJECTS_CACHE_TTL, single_flight=True)
 
     def get_create_meta(self, project):
+        # the form is built in the order JIRA returns the fields in
         return self.make_request(
             'get', self.META_URL, {'projectKeys': project,
-                                   'expand': 'projects.issuetypes.fields'}
+                                   'expand': 'projects.issuetypes.fields'},
+            ordered=True
         )
 
     def get_create_meta_for_project(self, project):
@@ -129,15 +227,113 @@ class JIRAClient(object):
         except IndexError:
             return None
 
+    def get_create_meta_key(self, project, issue_type=None):
+        # what's in the create meta depends on the user's permissions
+        key = 'sentry-jira:createmeta:' + md5(self.instance_url, self.username, project).hexdigest()
+        if issue_type is not None:
+            key = '%s:%s' % (key, issue_type)
+        return key
+
+    def refresh_create_meta(self, project):
+        """
+        Fetch the create meta for ``project`` and cache it, split into the
+        project (with its issue types, but without their fields) and the
+        fields of each issue type.
+
+        Returns a mapping of cache key to the cached entry.
+        """
+        meta = self.get_create_meta_for_project(project)
+        entries = {}
+        if meta:
+            issue_types = []
+            for issue_type in meta['issuetypes']:
+                issue_type = issue_type.copy()
+                fields = issue_type.pop('fields', None) or SortedDict()
+                entries[self.get_create_meta_key(project, issue_type['id'])] = fields
+                issue_types.append(issue_type)
+            meta = meta.copy()
+            meta['issuetypes'] = issue_types
+        entries[self.get_create_meta_key(project)] = meta
+
+        now = time.time()
+        entries = {
+            key: {'value': value,
+                  'timestamp': now}
+            for key, value in six.iteritems(entries)
+        }
+        cache.set_many(entries, self.CREATE_META_STALE_TTL)
+        return entries
+
+    def _get_cached_create_meta(self, project, key):
+        """
+        Returns a ``(value, timestamp)`` tuple for ``key``.
+        """
+        entry = cache.get(key)
+        if entry is None:
+            entry = self.refresh_create_meta(project).get(key)
+            if entry is None:
+                return None, None
+        return entry['value'], entry['timestamp']
+
+    def get_cached_create_meta(self, project):
+        """
+        Returns the (cached) create meta for ``project`` and when it was
+        fetched, as a ``(meta, timestamp)`` tuple. Issue types don't include
+        their fields, use ``get_cached_issue_type_fields`` for those.
+
+        Stale entries are still served, refreshing them is up to the caller
+        (see ``is_create_meta_stale`` and ``should_refresh_create_meta``.)
+        """
+        return self._get_cached_create_meta(project, self.get_create_meta_key(project))
+
+    def get_cached_issue_type_fields(self, project, issue_type):
+        return self._get_cached_create_meta(
+            project, self.get_create_meta_key(project, issue_type)
+        )
+
+    def is_create_meta_stale(self, timestamp):
+        return timestamp is not None and time.time() - timestamp > self.CREATE_META_TTL
+
+    def should_refresh_create_meta(self, project):
+        """
+        Returns ``True`` for a single caller at a time, which should then
+        refresh the (stale) create meta of ``project``.
+        """
+        return cache.add(
+            self.get_create_meta_key(project) + ':refresh', 1, self.CREATE_META_REFRESH_TIMEOUT
+        )
+
+    def invalidate_create_meta(self, project):
+        key = self.get_create_meta_key(project)
+        keys = [key]
+        entry = cache.get(key)
+        if entry and entry['value']:
+            keys.extend(
+                self.get_create_meta_key(project, issue_type['id'])
+                for issue_type in entry['value']['issuetypes']
+            )
+        cache.delete_many(keys)
+
     def get_versions(self, project):
-        return self.get_cached(self.VERSIONS_URL % project)
+        return self.get_cached(
+            self.VERSIONS_URL % project, ttl=self.VERSIONS_CACHE_TTL, single_flight=True
+        )
 
     def get_priorities(self):
-        return self.get_cached(self.PRIORITIES_URL)
+        return self.get_cached(
+            self.PRIORITIES_URL, ttl=self.PRIORITIES_CACHE_TTL, single_flight=True
+        )
 
     def get_users_for_project(self, project):
         return self.make_request('get', self.USERS_URL, {'project': project})
 
+    def get_assignable_users(self, project, start_at=0, max_results=50):
+        return self.make_request(
+            'get', self.USERS_URL, {'project': project,
+                                    'startAt': start_at,
+                                    'maxResults': max_results}
+        )
+
     def search_users_for_project(self, project, username):
         return self.make_request('get', self.USERS_URL, {'project': project, 'username': username})
 
@@ -145,6 +341,10 @@ class JIRAClient(object):
         data = {'fields': raw_form_data}
         return self.make_request('post', self.CREATE_URL, payload=data)
 
+    def create_issues(self, raw_form_data_list):
+        data = {'issueUpdates': [{'fields': raw_form_data} for raw_form_data in raw_form_data_list]}
+        return self.make_request('post', self.BULK_CREATE_URL, payload=data)
+
     def get_issue(self, key):
         return self.make_request('get', self.ISSUE_URL % key)
 
@@ -160,11 +360,44 @@ class JIRAClient(object):
         jql = 'project="%s" AND %s' % (project, jql)
         return self.make_request('get', self.SEARCH_URL, {'jql': jql})
 
-    def make_request(self, method, url, payload=None):
+    def search_issues_by_key(self, keys, max_results=50, fields=()):
+        """
+        The issues with the given ``keys``, leaving out the ones which don't
+        exist (anymore) or aren't visible to the user.
+        """
+        jql = 'issuekey in (%s)' % ', '.join('"%s"' % k.replace('"', '\\"') for k in keys)
+        return self.make_request(
+            'get', self.SEARCH_URL, {
+                'jql': jql,
+                'maxResults': max_results,
+                'fields': ','.join(fields),
+                # unknown keys are an error otherwise
+                'validateQuery': 'false',
+            }
+        )
+
+    def search_updated_issues(self, project, minutes, start_at=0, max_results=50, fields=()):
+        """
+        Issues of ``project`` updated in the last ``minutes`` minutes, least
+        recently updated first.
+        """
+        jql = 'project="%s" AND updated >= "-%dm" ORDER BY updated ASC' % (
+            project.replace('"', '\\"'), minutes,
+        )
+        return self.make_request(
+            'get', self.SEARCH_URL, {
+                'jql': jql,
+                'startAt': start_at,
+                'maxResults': max_results,
+                'fields': ','.join(fields),
+            }
+        )
+
+    def make_request(self, method, url, payload=None, ordered=False):
         if url[:4] != "http":
             url = self.instance_url + url
         auth = self.username.encode('utf8'), self.password.encode('utf8')
-        session = build_session()
+        session = get_session(url)
         try:
             if method == 'get':
                 r = session.get(
@@ -191,17 +424,76 @@ class JIRAClient(object):
             raise JIRAUnauthorized.from_response(r)
         elif r.status_code < 200 or r.status_code >= 300:
             raise JIRAError.from_response(r)
-        return JIRAResponse.from_response(r)
+        return JIRAResponse.from_response(r, ordered=ordered)
+
+    def _get_cached_response(self, key):
+        """
+        Returns a ``(response, is_stale)`` tuple for ``key``.
+        """
+        cached_result = cache.get(key)
+        if not (isinstance(cached_result, tuple) and cached_result[0] == self.CACHE_VERSION):
+            return None, True
+        _, expires, status_code, text = cached_result
+        return JIRAResponse(text, status_code), expires <= time.time()
+
+    def _refill_cache(self, key, full_url, ttl):
+        result = self.make_request('get', full_url)
+        ttl = int(ttl * random.uniform(1, 1 + self.CACHE_TTL_JITTER))
+        cache.set(
+            key,
+            (self.CACHE_VERSION, time.time() + ttl, result.status_code, get_compact_text(result)),
+            ttl * 2,
+        )
+        return result
 
-    def get_cached(self, full_url):
+    def get_cached(self, full_url, ttl=None, single_flight=False):
         """
         Basic Caching mechanism for requests and responses. It only caches responses
         based on URL
         TODO: Implement GET attr in cache as well. (see self.create_meta for example)
+
+        Only a compact, versioned form of the body is cached (never the
+        response object itself), the response is rebuilt from it on read.
+
+        With ``single_flight`` expired keys are refilled by a single request
+        at a time; concurrent requests get the stale value or wait for the
+        refill. That's only worth the lock round trip for a few shared and
+        expensive responses, not for e.g. every autocomplete query.
         """
         key = 'sentry-jira:' + md5(full_url, self.instance_url).hexdigest()
-        cached_result = cache.get(key)
-        if not cached_result:
-            cached_result = self.make_request('get', full_url)
-            cache.set(key, cached_result, 60)
-        return cached_result
+        ttl = ttl or self.CACHE_TTL
+        result, is_stale = self._get_cached_response(key)
+        if not is_stale:
+            return result
+
+        if not single_flight:
+            return self._refill_cache_or_serve_stale(key, full_url, ttl, result)
+
+        lock = locks.get(key + ':lock', duration=self.HTTP_TIMEOUT * 2)
+        try:
+            with lock.acquire():
+                return self._refill_cache_or_serve_stale(key, full_url, ttl, result)
+        except UnableToAcquireLock:
+            pass
+
+        if result is not None:
+            return result
+
+        # whoever holds the lock gives up on JIRA after ``HTTP_TIMEOUT``
+        deadline = time.time() + self.HTTP_TIMEOUT
+        while time.time() < deadline:
+            time.sleep(self.CACHE_WAIT_INTERVAL)
+            result, _ = self._get_cached_response(key)
+            if result is not None:
+                return result
+
+        raise JIRAError('Timed out waiting for a response from JIRA', 504)
+
+    def _refill_cache_or_serve_stale(self, key, full_url, ttl, result):
+        try:
+            return self._refill_cache(key, full_url, ttl)
+        except JIRAError as e:
+            if result is None:
+                raise
+            log.warning('Unable to refresh %s, serving stale response: %s', full_url, e)
+            return result
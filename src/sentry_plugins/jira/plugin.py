@@ -8,13 +8,21 @@ from rest_framework.response import Response
 
 from django.conf import settings
 from django.conf.urls import url
+from django.db import IntegrityError, transaction
 
-from sentry.models import GroupMeta
+from sentry.models import Activity, Group, GroupMeta
 from sentry.plugins.bases.issue2 import IssuePlugin2, IssueGroupActionEndpoint, PluginError
+from sentry.signals import issue_tracker_used
+from sentry.utils.cache import cache
 from sentry.utils.http import absolute_uri
 
 from sentry_plugins.base import CorePluginMixin
-from sentry_plugins.jira.client import JIRAClient, JIRAError, JIRAUnauthorized
+from sentry_plugins.jira.client import (
+    JIRAClient, JIRAError, JIRAUnauthorized, XMLParseError, iter_xml_users, md5
+)
+from sentry_plugins.jira.sync import get_snapshot
+from sentry_plugins.jira.tasks import refresh_assignable_users, refresh_create_meta
+from sentry_plugins.jira.users import AssignableUserIndex, search_users
 from sentry_plugins.utils import get_secret_field_config
 
 # A list of common builtin custom field types for JIRA for easy reference.
@@ -36,6 +44,26 @@ ERR_INTERNAL = (
 )
 
 
+def filter_choices(choices, query, limit):
+    """
+    Choices whose label starts with ``query``, followed by those which merely
+    contain it, in their original order.
+    """
+    query = query.lower()
+    prefix_matches = []
+    substring_matches = []
+    for choice in choices:
+        # custom field options don't necessarily have a label
+        text = (choice[1] or '').lower()
+        if text.startswith(query):
+            prefix_matches.append(choice)
+            if len(prefix_matches) >= limit:
+                break
+        elif query in text and len(substring_matches) < limit:
+            substring_matches.append(choice)
+    return (prefix_matches + substring_matches)[:limit]
+
+
 class JiraPlugin(CorePluginMixin, IssuePlugin2):
     description = 'Integrate JIRA issues by linking a project.'
     slug = 'jira'
@@ -43,6 +71,13 @@ class JiraPlugin(CorePluginMixin, IssuePlugin2):
     conf_title = title
     conf_key = slug
 
+    # how long the form fields built from the create meta are memoized
+    FORM_SCHEMA_TTL = 60 * 10
+
+    # select fields with more choices than this are searched server side
+    MAX_FORM_CHOICES = 500
+    MAX_AUTOCOMPLETE_CHOICES = 50
+
     asset_key = 'jira'
     assets = [
         'dist/jira.js',
@@ -56,6 +91,14 @@ class JiraPlugin(CorePluginMixin, IssuePlugin2):
                 IssueGroupActionEndpoint.as_view(view_method_name='view_autocomplete', plugin=self)
             )
         )
+        _patterns.append(
+            url(
+                r'^create-bulk',
+                IssueGroupActionEndpoint.as_view(
+                    view_method_name='view_create_issues', plugin=self
+                )
+            )
+        )
         return _patterns
 
     def is_configured(self, request, project, **kwargs):
@@ -98,9 +141,8 @@ class JiraPlugin(CorePluginMixin, IssuePlugin2):
         elif field_meta.get('autoCompleteUrl') and \
                 (schema.get('items') == 'user' or schema['type'] == 'user'):
             fieldtype = 'select'
-            sentry_url = '/api/0/issues/%s/plugins/%s/autocomplete' % (group.id, self.slug)
             fkwargs['url'] = '%s?jira_url=%s' % (
-                sentry_url, quote_plus(field_meta['autoCompleteUrl']),
+                self.get_autocomplete_url(group), quote_plus(field_meta['autoCompleteUrl']),
             )
             fkwargs['has_autocomplete'] = True
             fkwargs['placeholder'] = 'Start typing to search for a user'
@@ -142,6 +184,34 @@ class JiraPlugin(CorePluginMixin, IssuePlugin2):
 
         return issue_type_meta
 
+    def get_cached_create_meta(self, project, client, jira_project_key):
+        """
+        Returns the (cached) create meta of ``jira_project_key``, a stale
+        copy is refreshed in the background.
+        """
+        meta, timestamp = client.get_cached_create_meta(jira_project_key)
+        self.maybe_refresh_create_meta(project, client, jira_project_key, timestamp)
+        return meta
+
+    def get_cached_issue_type_fields(self, project, client, jira_project_key, issue_type):
+        return self.get_versioned_issue_type_fields(
+            project, client, jira_project_key, issue_type
+        )[0]
+
+    def get_versioned_issue_type_fields(self, project, client, jira_project_key, issue_type):
+        """
+        Returns a ``(fields, version)`` tuple, the version changes whenever
+        the create meta is refetched.
+        """
+        fields, timestamp = client.get_cached_issue_type_fields(jira_project_key, issue_type)
+        self.maybe_refresh_create_meta(project, client, jira_project_key, timestamp)
+        return fields, timestamp
+
+    def maybe_refresh_create_meta(self, project, client, jira_project_key, timestamp):
+        if client.is_create_meta_stale(timestamp) and \
+                client.should_refresh_create_meta(jira_project_key):
+            refresh_create_meta.delay(project_id=project.id, jira_project=jira_project_key)
+
     def get_new_issue_fields(self, request, group, event, **kwargs):
         fields = super(JiraPlugin, self).get_new_issue_fields(request, group, event, **kwargs)
 
@@ -149,7 +219,7 @@ class JiraPlugin(CorePluginMixin, IssuePlugin2):
 
         client = self.get_jira_client(group.project)
         try:
-            meta = client.get_create_meta_for_project(jira_project_key)
+            meta = self.get_cached_create_meta(group.project, client, jira_project_key)
         except JIRAUnauthorized:
             raise PluginError(
                 'JIRA returned: Unauthorized. '
@@ -175,6 +245,10 @@ class JiraPlugin(CorePluginMixin, IssuePlugin2):
             issue_type = self.get_option('default_issue_type', group.project)
 
         issue_type_meta = self.get_issue_type_meta(issue_type, meta)
+        issue_type_fields, create_meta_version = self.get_versioned_issue_type_fields(
+            group.project, client, jira_project_key, issue_type_meta['id']
+        )
+        issue_type_fields = issue_type_fields or {}
         issue_type_choices = self.make_choices(meta['issuetypes'])
 
         # make sure default issue type is actually
@@ -204,20 +278,76 @@ class JiraPlugin(CorePluginMixin, IssuePlugin2):
 
         # title is renamed to summary before sending to JIRA
         standard_fields = [f['name'] for f in fields] + ['summary']
+
+        fields.extend(
+            self.get_dynamic_fields(
+                group, client, jira_project_key, issue_type_meta['id'], issue_type_fields,
+                create_meta_version, standard_fields
+            )
+        )
+        return fields
+
+    def get_autocomplete_url(self, group):
+        return '/api/0/issues/%s/plugins/%s/autocomplete' % (group.id, self.slug)
+
+    def get_dynamic_fields(
+        self, group, client, jira_project_key, issue_type, issue_type_fields,
+        create_meta_version, standard_fields
+    ):
+        """
+        Returns the form fields for the issue type's own fields.
+
+        These only depend on the create meta (``create_meta_version`` tells
+        the cached versions of it apart) and the options below, so they're
+        memoized (with the group specific autocomplete URLs made relative).
+        """
+        project = group.project
+        key = 'sentry-jira:form-schema:' + md5(
+            client.instance_url,
+            client.username,
+            jira_project_key,
+            issue_type,
+            create_meta_version,
+            ','.join(standard_fields),
+            self.get_option('ignored_fields', project) or '',
+            self.get_option('default_priority', project) or '',
+            self.get_option('default_issue_type', project) or '',
+        ).hexdigest()
+        autocomplete_url = self.get_autocomplete_url(group)
+
+        dynamic_fields = cache.get(key)
+        if dynamic_fields is None:
+            dynamic_fields = self.build_dynamic_fields(
+                group, client, jira_project_key, issue_type, issue_type_fields, standard_fields
+            )
+            for field in dynamic_fields:
+                if field.get('url', '').startswith(autocomplete_url):
+                    field['url'] = field['url'][len(autocomplete_url):]
+            cache.set(key, dynamic_fields, self.FORM_SCHEMA_TTL)
+
+        for field in dynamic_fields:
+            if 'url' in field:
+                field['url'] = autocomplete_url + field['url']
+        return dynamic_fields
+
+    def build_dynamic_fields(
+        self, group, client, jira_project_key, issue_type, issue_type_fields, standard_fields
+    ):
+        fields = []
         ignored_fields = (self.get_option('ignored_fields', group.project) or '').split(',')
 
         # apply ordering to fields based on some known built-in JIRA fields.
         # otherwise weird ordering occurs.
         anti_gravity = {"priority": -150, "fixVersions": -125, "components": -100, "security": -50}
 
-        dynamic_fields = issue_type_meta.get('fields').keys()
+        dynamic_fields = issue_type_fields.keys()
         dynamic_fields.sort(key=lambda f: anti_gravity.get(f) or 0)
         # build up some dynamic fields based on required shit.
         for field in dynamic_fields:
             if field in standard_fields or field in [x.strip() for x in ignored_fields]:
                 # don't overwrite the fixed fields for the form.
                 continue
-            mb_field = self.build_dynamic_field(group, issue_type_meta['fields'][field])
+            mb_field = self.build_dynamic_field(group, issue_type_fields[field])
             if mb_field:
                 mb_field['name'] = field
                 fields.append(mb_field)
@@ -231,8 +361,47 @@ class JiraPlugin(CorePluginMixin, IssuePlugin2):
             elif field['name'] == 'fixVersions':
                 field['choices'] = self.make_choices(client.get_versions(jira_project_key).json)
 
+            # huge choice lists bloat the form, let the user search them instead
+            if len(field.get('choices') or ()) > self.MAX_FORM_CHOICES:
+                del field['choices']
+                field['url'] = '%s?issuetype=%s' % (
+                    self.get_autocomplete_url(group), quote_plus(issue_type),
+                )
+                field['has_autocomplete'] = True
+                field['placeholder'] = 'Start typing to search'
+
         return fields
 
+    def get_field_choices(self, project, client, jira_project_key, issue_type, field):
+        """
+        Returns all choices of a select field, for fields which are too large
+        to be sent along with the form.
+        """
+        key = 'sentry-jira:field-choices:' + md5(
+            client.instance_url, client.username, jira_project_key, issue_type, field
+        ).hexdigest()
+        choices = cache.get(key)
+        if choices is not None:
+            return choices
+
+        if field == 'priority':
+            values = client.get_priorities().json
+        elif field == 'fixVersions':
+            # unreleased versions are the likely targets, so they go first
+            values = sorted(
+                client.get_versions(jira_project_key).json or [],
+                key=lambda v: (bool(v.get('released')), bool(v.get('archived'))),
+            )
+        else:
+            issue_type_fields = self.get_cached_issue_type_fields(
+                project, client, jira_project_key, issue_type
+            ) or {}
+            values = issue_type_fields.get(field, {}).get('allowedValues')
+
+        choices = self.make_choices(values)
+        cache.set(key, choices, self.FORM_SCHEMA_TTL)
+        return choices
+
     def get_link_existing_issue_fields(self, request, group, event, **kwargs):
         return [
             {
@@ -269,6 +438,11 @@ class JiraPlugin(CorePluginMixin, IssuePlugin2):
         return {'title': issue['fields']['summary']}
 
     def get_issue_label(self, group, issue_id, **kwargs):
+        # the state of linked issues is synced periodically, see ``tasks``
+        instance = self.get_option('instance_url', group.project)
+        snapshot = get_snapshot(instance, issue_id) if instance else None
+        if snapshot and snapshot.get('status'):
+            return '%s (%s)' % (issue_id, snapshot['status'])
         return issue_id
 
     def get_issue_url(self, group, issue_id, **kwargs):
@@ -303,6 +477,35 @@ class JiraPlugin(CorePluginMixin, IssuePlugin2):
                 ]
                 return Response({field: issues})
 
+        issue_type = request.GET.get('issuetype')
+        if issue_type:
+            client = self.get_jira_client(group.project)
+            try:
+                choices = self.get_field_choices(
+                    group.project, client, project, issue_type, field
+                )
+            except JIRAError as e:
+                return Response(
+                    {
+                        'error_type': 'validation',
+                        'errors': [{
+                            '__all__': self.message_from_error(e)
+                        }]
+                    },
+                    status=400
+                )
+            return Response(
+                {
+                    field: [
+                        {
+                            'id': choice_id,
+                            'text': text
+                        } for choice_id, text in
+                        filter_choices(choices, query or '', self.MAX_AUTOCOMPLETE_CHOICES)
+                    ]
+                }
+            )
+
         jira_url = request.GET.get('jira_url')
         if jira_url:
             jira_url = unquote_plus(jira_url)
@@ -314,6 +517,15 @@ class JiraPlugin(CorePluginMixin, IssuePlugin2):
             is_user_api = '/rest/api/latest/user/' in jira_url
 
             if is_user_api:  # its the JSON version of the autocompleter
+                # the index only has assignable users, other user pickers
+                # (e.g. the reporter) search all users
+                if parsed[2].rstrip('/').endswith('/user/assignable/search'):
+                    users = self.search_assignable_users(
+                        group.project, jira_client, project, query
+                    )
+                    if users:
+                        return Response({field: users})
+
                 is_xml = False
                 jira_query['username'] = query.encode('utf8')
                 jira_query.pop(
@@ -330,17 +542,28 @@ class JiraPlugin(CorePluginMixin, IssuePlugin2):
             parsed[3] = urlencode(jira_query)
             final_url = urlunsplit(parsed)
 
-            autocomplete_response = jira_client.get_cached(final_url)
+            autocomplete_response = jira_client.get_cached(
+                final_url, ttl=jira_client.USERS_CACHE_TTL
+            )
             users = []
 
             if is_xml:
-                for userxml in autocomplete_response.xml.findAll("users"):
-                    users.append(
+                try:
+                    users = [
                         {
-                            'id': userxml.find('name').text,
-                            'text': userxml.find('html').text
-                        }
-                    )
+                            'id': name,
+                            'text': text
+                        } for name, text in iter_xml_users(autocomplete_response.text)
+                    ]
+                except XMLParseError:
+                    # BeautifulSoup copes with documents that aren't well formed
+                    for userxml in autocomplete_response.xml.findAll("users"):
+                        users.append(
+                            {
+                                'id': userxml.find('name').text,
+                                'text': userxml.find('html').text
+                            }
+                        )
             else:
                 for user in autocomplete_response.json:
                     users.append(
@@ -386,6 +609,25 @@ class JiraPlugin(CorePluginMixin, IssuePlugin2):
 
             return Response({field: users})
 
+    def search_assignable_users(self, project, client, jira_project, query):
+        """
+        Answer user autocomplete queries from the local index of assignable
+        users, returning ``None`` when it isn't available (yet).
+        """
+        index = AssignableUserIndex(client, jira_project)
+        users, is_stale = index.load()
+        if is_stale and index.should_refresh():
+            refresh_assignable_users.delay(project_id=project.id, jira_project=jira_project)
+        if users is None:
+            return None
+
+        return [
+            {
+                'id': name,
+                'text': '%s %s(%s)' % (display_name, '- %s ' % email if email else '', name)
+            } for name, display_name, email in search_users(users, query or '')
+        ]
+
     def message_from_error(self, exc):
         if isinstance(exc, JIRAUnauthorized):
             return ERR_UNAUTHORIZED
@@ -411,24 +653,46 @@ class JiraPlugin(CorePluginMixin, IssuePlugin2):
             self.logger.exception(six.text_type(exc))
         raise PluginError(self.message_from_error(exc))
 
-    def create_issue(self, request, group, form_data, **kwargs):
-        cleaned_data = {}
-
+    def get_create_issue_fields(self, client, project, form_data):
+        """
+        Returns the create meta fields of the issue type selected in
+        ``form_data``.
+        """
         # protect against mis-configured plugin submitting a form without an
         # issuetype assigned.
         if not form_data.get('issuetype'):
             raise PluginError('Issue Type is required.')
 
-        jira_project_key = self.get_option('default_project', group.project)
-        client = self.get_jira_client(group.project)
-        meta = client.get_create_meta_for_project(jira_project_key)
+        jira_project_key = self.get_option('default_project', project)
+        meta = self.get_cached_create_meta(project, client, jira_project_key)
 
         if not meta:
             raise PluginError('Something went wrong. Check your plugin configuration.')
 
         issue_type_meta = self.get_issue_type_meta(form_data['issuetype'], meta)
 
-        fs = issue_type_meta['fields']
+        return self.get_cached_issue_type_fields(
+            project, client, jira_project_key, issue_type_meta['id']
+        ) or {}
+
+    def create_issue(self, request, group, form_data, **kwargs):
+        client = self.get_jira_client(group.project)
+        fs = self.get_create_issue_fields(client, group.project, form_data)
+        cleaned_data = self.clean_issue_data(fs, form_data)
+
+        try:
+            response = client.create_issue(cleaned_data)
+        except Exception as e:
+            self.raise_error(e)
+
+        return response.json.get('key')
+
+    def clean_issue_data(self, fs, form_data):
+        """
+        Converts the submitted form into the fields JIRA expects, based on the
+        issue type's create meta fields (``fs``).
+        """
+        cleaned_data = {}
         for field in fs.keys():
             f = fs[field]
             if field == 'description':
@@ -478,12 +742,173 @@ class JiraPlugin(CorePluginMixin, IssuePlugin2):
             # above clean method.)
             cleaned_data['issuetype'] = {'id': cleaned_data['issuetype']}
 
+        return cleaned_data
+
+    def view_create_issues(self, request, group, **kwargs):
+        """
+        Create issues for ``group`` and the other groups of its project in
+        ``groups`` at once, see ``create_issues``.
+        """
+        if request.method != 'POST':
+            return Response(status=405)
+
+        form_data = dict(request.DATA)
+        group_ids = form_data.pop('groups', None) or []
+        groups = [group] + list(
+            Group.objects.filter(
+                project=group.project,
+                id__in=group_ids,
+            ).exclude(id=group.id)
+        )
         try:
-            response = client.create_issue(cleaned_data)
-        except Exception as e:
-            self.raise_error(e)
+            created, errors = self.create_issues(request, groups, form_data)
+        except PluginError as e:
+            return Response(
+                {
+                    'error_type': 'validation',
+                    'errors': [{
+                        '__all__': six.text_type(e)
+                    }]
+                },
+                status=400
+            )
+        return Response({'created': created, 'errors': errors})
 
-        return response.json.get('key')
+    def create_issues(self, request, groups, form_data, **kwargs):
+        """
+        Create an issue for each of ``groups`` (which must belong to the same
+        project) with JIRA's bulk API, sharing everything but the title and
+        description of ``form_data``.
+
+        Returns a ``(created, errors)`` tuple, mapping group ids to issue keys
+        and error messages respectively. Created issues are linked to their
+        groups, groups which are linked already are skipped.
+        """
+        created = {}
+        errors = {}
+        if not groups:
+            return created, errors
+
+        project = groups[0].project
+        client = self.get_jira_client(project)
+        fs = self.get_create_issue_fields(client, project, form_data)
+
+        prefix = self.get_conf_key()
+        linked = set(
+            GroupMeta.objects.filter(
+                group__in=groups,
+                key='%s:tid' % prefix,
+            ).values_list('group_id', flat=True)
+        )
+
+        issues = []
+        titles = {}
+        for group in groups:
+            if group.id in linked:
+                errors[group.id] = 'Already linked to a JIRA issue.'
+                continue
+            event = group.get_latest_event()
+            group_form_data = dict(
+                form_data,
+                title=self.get_group_title(request, group, event),
+                description=self.get_group_description(request, group, event),
+            )
+            issues.append((group, self.clean_issue_data(fs, group_form_data)))
+            titles[group.id] = group_form_data['title']
+
+        chunk_size = client.BULK_CREATE_MAX_ISSUES
+        for offset in range(0, len(issues), chunk_size):
+            chunk = issues[offset:offset + chunk_size]
+            try:
+                result = client.create_issues([data for _, data in chunk]).json
+            except JIRAError as e:
+                # when only some of the issues fail JIRA still tells us which
+                # of them have been created
+                if not (e.json and 'issues' in e.json):
+                    for group, _ in chunk:
+                        errors[group.id] = self.message_from_error(e)
+                    continue
+                result = e.json
+
+            failed = {}
+            for error in result.get('errors') or ():
+                failed[error['failedElementNumber']] = ' '.join(
+                    '%s: %s' % item
+                    for item in six.iteritems(error['elementErrors'].get('errors') or {})
+                ) or ' '.join(error['elementErrors'].get('errorMessages') or ())
+
+            # created issues are listed in order, leaving out the failed ones
+            created_issues = iter(result.get('issues') or ())
+            for index, (group, _) in enumerate(chunk):
+                if index in failed:
+                    errors[group.id] = failed[index] or ERR_INTERNAL
+                    continue
+                issue = next(created_issues, None)
+                if issue is None:
+                    errors[group.id] = ERR_INTERNAL
+                else:
+                    created[group.id] = issue['key']
+
+        self.link_created_issues(request, groups, titles, created, errors)
+        return created, errors
+
+    def link_created_issues(self, request, groups, titles, created, errors):
+        """
+        Link the issues created by ``create_issues`` to their groups, and
+        record their creation in the groups' activity.
+        """
+        key = '%s:tid' % self.get_conf_key()
+        try:
+            with transaction.atomic():
+                GroupMeta.objects.bulk_create(
+                    [
+                        GroupMeta(group_id=group_id, key=key, value=issue_key)
+                        for group_id, issue_key in six.iteritems(created)
+                    ]
+                )
+        except IntegrityError:
+            # some groups have been linked in the meantime, the issues exist
+            # in JIRA regardless so link the others one at a time
+            for group_id, issue_key in list(six.iteritems(created)):
+                try:
+                    with transaction.atomic():
+                        GroupMeta.objects.create(group_id=group_id, key=key, value=issue_key)
+                except IntegrityError:
+                    del created[group_id]
+                    errors[group_id] = (
+                        'Created %s, but the group was linked to another JIRA issue '
+                        'in the meantime.' % (issue_key, )
+                    )
+
+        # bulk inserts bypass the cache ``GroupMeta.objects.set_value`` keeps
+        linked_groups = [group for group in groups if group.id in created]
+        GroupMeta.objects.populate_cache(linked_groups)
+
+        user = request.user if request.user.is_authenticated() else None
+        Activity.objects.bulk_create(
+            [
+                Activity(
+                    project=group.project,
+                    group=group,
+                    type=Activity.CREATE_ISSUE,
+                    user=user,
+                    data={
+                        'title': titles[group.id],
+                        'provider': self.get_title(),
+                        'location': self.get_issue_url(group, created[group.id]),
+                        'label': self.get_issue_label(group, created[group.id]),
+                    },
+                ) for group in linked_groups
+            ]
+        )
+
+        if linked_groups:
+            issue_tracker_used.send(
+                plugin=self,
+                project=linked_groups[0].project,
+                user=request.user,
+                sender=IssuePlugin2,
+            )
 
     def get_jira_client(self, project):
         instance = self.get_option('instance_url', project)
@@ -515,6 +940,10 @@ class JiraPlugin(CorePluginMixin, IssuePlugin2):
         except JIRAError as e:
             self.raise_error(e)
 
+        # this is an action rather than a setting, so it's never stored
+        if config.pop('refresh_meta', False) and config.get('default_project'):
+            client.invalidate_create_meta(config['default_project'])
+
         return config
 
     def get_configure_plugin_fields(self, request, project, **kwargs):
@@ -556,7 +985,7 @@ class JiraPlugin(CorePluginMixin, IssuePlugin2):
                         default_priority = default_priority or priorities[0]['id']
 
                 try:
-                    meta = client.get_create_meta_for_project(jira_project)
+                    meta = self.get_cached_create_meta(project, client, jira_project)
                 except JIRAError:
                     meta = None
                 else:
@@ -619,6 +1048,13 @@ class JiraPlugin(CorePluginMixin, IssuePlugin2):
                 'type': 'bool',
                 'required': False,
                 'help': 'Automatically create a JIRA ticket for EVERY new issue'
+            }, {
+                'name': 'refresh_meta',
+                'label': 'Refresh JIRA metadata',
+                'default': False,
+                'type': 'bool',
+                'required': False,
+                'help': 'Discard the cached issue types and fields of the linked project on save'
             }
         ]
 
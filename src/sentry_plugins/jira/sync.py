@@ -0,0 +1,149 @@
+"""
+Snapshots of the state of JIRA issues linked to Sentry groups.
+
+Rather than asking JIRA about each linked issue, a periodic task searches
+for the issues of the linked JIRA project that were updated since it last
+ran and stores the status, assignee and resolution of the linked ones in
+Redis, one key per issue. Every so often (and on the first run) all linked
+issues are fetched instead, so snapshots of issues which don't change are
+kept around too.
+
+The task has to be added to the ``CELERYBEAT_SCHEDULE`` (see the README.)
+"""
+from __future__ import absolute_import
+
+import math
+import six
+import time
+
+from sentry.models import GroupMeta
+from sentry.utils import json
+
+from sentry_plugins.cache import cluster
+from sentry_plugins.jira.client import md5
+
+# snapshots which haven't been updated in this long are dropped
+SNAPSHOT_TTL = 60 * 60 * 24 * 30
+
+# how often all linked issues are synced, rather than just the updated ones
+FULL_SYNC_INTERVAL = 60 * 60 * 24 * 7
+
+# searches start a bit before the last sync, as JQL only has minute
+# granularity and the clocks of Sentry and JIRA may disagree
+SYNC_OVERLAP = 60 * 2
+
+PAGE_SIZE = 100
+
+SYNC_FIELDS = ('status', 'assignee', 'resolution')
+
+
+def get_snapshot_key(instance_url, issue_key):
+    return 'sentry-plugins:jira:issue-state:%s:%s' % (
+        md5(instance_url.rstrip('/')).hexdigest(), issue_key,
+    )
+
+
+def get_watermark_key(project, jira_project):
+    return 'sentry-plugins:jira:issue-sync:%s:%s' % (project.id, jira_project)
+
+
+def make_snapshot(issue):
+    fields = issue.get('fields') or {}
+    snapshot = {}
+    for name, attr in (('status', 'name'), ('assignee', 'displayName'), ('resolution', 'name')):
+        value = fields.get(name)
+        snapshot[name] = value.get(attr) if value else None
+    return snapshot
+
+
+def get_snapshot(instance_url, issue_key):
+    value = cluster.get_routing_client().get(get_snapshot_key(instance_url, issue_key))
+    if value is None:
+        return None
+    return json.loads(value)
+
+
+def save_snapshots(instance_url, snapshots):
+    if not snapshots:
+        return
+    with cluster.map() as client:
+        for issue_key, snapshot in six.iteritems(snapshots):
+            client.setex(
+                get_snapshot_key(instance_url, issue_key), SNAPSHOT_TTL, json.dumps(snapshot)
+            )
+
+
+def save_linked_snapshots(client, project, conf_key, issues):
+    linked = set(
+        GroupMeta.objects.filter(
+            group__project=project,
+            key='%s:tid' % conf_key,
+            value__in=[i['key'] for i in issues],
+        ).values_list('value', flat=True)
+    )
+    save_snapshots(
+        client.instance_url,
+        {i['key']: make_snapshot(i) for i in issues if i['key'] in linked},
+    )
+
+
+def sync_all_issue_states(client, project, jira_project, conf_key):
+    """
+    Update the snapshots of all issues in ``jira_project`` linked to groups
+    of ``project``.
+    """
+    issue_keys = sorted(
+        set(
+            GroupMeta.objects.filter(
+                group__project=project,
+                key='%s:tid' % conf_key,
+                value__startswith='%s-' % jira_project,
+            ).values_list('value', flat=True)
+        )
+    )
+    for offset in range(0, len(issue_keys), PAGE_SIZE):
+        issues = client.search_issues_by_key(
+            issue_keys[offset:offset + PAGE_SIZE], max_results=PAGE_SIZE, fields=SYNC_FIELDS
+        ).json or {}
+        save_linked_snapshots(client, project, conf_key, issues.get('issues') or [])
+
+
+def sync_issue_states(client, project, jira_project, conf_key):
+    """
+    Update the snapshots of the issues in ``jira_project`` linked to groups
+    of ``project`` which changed since the last sync, or of all of them if
+    there wasn't a full sync in ``FULL_SYNC_INTERVAL``.
+    """
+    now = time.time()
+    redis = cluster.get_routing_client()
+    watermark_key = get_watermark_key(project, jira_project)
+    full_sync_key = watermark_key + ':full'
+    watermark = redis.get(watermark_key)
+    if redis.set(full_sync_key, now, ex=FULL_SYNC_INTERVAL, nx=True) or watermark is None:
+        try:
+            sync_all_issue_states(client, project, jira_project, conf_key)
+        except Exception:
+            redis.delete(full_sync_key)
+            raise
+        redis.set(watermark_key, now)
+        return
+
+    window = now - float(watermark) + SYNC_OVERLAP
+    minutes = int(math.ceil(window / 60.0))
+
+    start_at = 0
+    while True:
+        result = client.search_updated_issues(
+            jira_project, minutes, start_at=start_at, max_results=PAGE_SIZE, fields=SYNC_FIELDS
+        ).json or {}
+        issues = result.get('issues') or []
+        if not issues:
+            break
+
+        save_linked_snapshots(client, project, conf_key, issues)
+
+        start_at += len(issues)
+        if start_at >= result.get('total', 0):
+            break
+
+    redis.set(watermark_key, now)
@@ -0,0 +1,66 @@
+from __future__ import absolute_import
+
+from sentry.models import Project, ProjectOption
+from sentry.plugins import plugins
+from sentry.tasks.base import instrumented_task, retry
+
+from sentry_plugins.jira import sync
+from sentry_plugins.jira.users import AssignableUserIndex
+
+
+@instrumented_task(
+    name='sentry_plugins.jira.tasks.refresh_assignable_users',
+    default_retry_delay=60 * 5,
+    max_retries=2,
+)
+@retry(exclude=(Project.DoesNotExist, ))
+def refresh_assignable_users(project_id, jira_project, **kwargs):
+    project = Project.objects.get_from_cache(id=project_id)
+    client = plugins.get('jira').get_jira_client(project)
+    AssignableUserIndex(client, jira_project).refresh()
+
+
+@instrumented_task(
+    name='sentry_plugins.jira.tasks.refresh_create_meta',
+    default_retry_delay=60 * 5,
+    max_retries=2,
+)
+@retry(exclude=(Project.DoesNotExist, ))
+def refresh_create_meta(project_id, jira_project, **kwargs):
+    project = Project.objects.get_from_cache(id=project_id)
+    client = plugins.get('jira').get_jira_client(project)
+    client.refresh_create_meta(jira_project)
+
+
+@instrumented_task(
+    name='sentry_plugins.jira.tasks.sync_issue_states',
+    default_retry_delay=60 * 5,
+    max_retries=2,
+)
+@retry(exclude=(Project.DoesNotExist, ))
+def sync_issue_states(project_id, **kwargs):
+    project = Project.objects.get_from_cache(id=project_id)
+    plugin = plugins.get('jira')
+    if not (plugin.is_enabled(project) and plugin.is_configured(None, project)):
+        return
+
+    sync.sync_issue_states(
+        plugin.get_jira_client(project),
+        project,
+        plugin.get_option('default_project', project),
+        plugin.get_conf_key(),
+    )
+
+
+@instrumented_task(name='sentry_plugins.jira.tasks.schedule_issue_state_syncs')
+def schedule_issue_state_syncs(**kwargs):
+    """
+    Queue a sync of linked issue states for every project linked to a JIRA
+    project. Meant to be run periodically (add it to ``CELERYBEAT_SCHEDULE``,
+    see the README.)
+    """
+    project_ids = ProjectOption.objects.filter(
+        key='jira:default_project',
+    ).values_list('project_id', flat=True)
+    for project_id in project_ids:
+        sync_issue_states.delay(project_id=project_id)
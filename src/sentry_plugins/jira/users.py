@@ -0,0 +1,113 @@
+"""
+A local index of the users that can be assigned issues in a JIRA project.
+
+The user picker asks for matching users on every keystroke, which against a
+slow JIRA server means a round trip per keystroke. Instead we walk
+``/user/assignable/search`` once, keep a compressed copy of the result in
+Redis and answer autocomplete queries from it, refreshing it in the
+background every so often.
+"""
+from __future__ import absolute_import
+
+import time
+import zlib
+
+from sentry.utils import json, metrics
+from sentry.utils.cache import cache
+
+from sentry_plugins.cache import cluster
+from sentry_plugins.jira.client import md5
+
+# indexes older than this are served but refreshed in the background
+INDEX_TTL = 60 * 60
+INDEX_EXPIRY = 60 * 60 * 24
+
+# a queued refresh is assumed to have failed after this long
+REFRESH_TIMEOUT = 60 * 10
+
+# users fetched per request while building the index (JIRA's upper bound)
+PAGE_SIZE = 1000
+
+# indexes are only built for projects with at most this many users
+MAX_USERS = 20000
+
+# number of users returned for a query
+MAX_RESULTS = 20
+
+
+class AssignableUserIndex(object):
+    def __init__(self, client, project):
+        self.client = client
+        self.project = project
+
+    def get_key(self):
+        # who shows up depends on the user's permissions
+        return 'sentry-plugins:jira:assignable-users:' + md5(
+            self.client.instance_url, self.client.username, self.project
+        ).hexdigest()
+
+    def fetch(self):
+        """
+        Walk all pages of assignable users, returning ``None`` if the project
+        has too many of them to be worth indexing.
+        """
+        users = []
+        while True:
+            page = self.client.get_assignable_users(
+                self.project, start_at=len(users), max_results=PAGE_SIZE
+            ).json or []
+            users.extend(
+                (user['name'], user.get('displayName') or '', user.get('emailAddress') or '')
+                for user in page
+            )
+            if len(users) > MAX_USERS:
+                return None
+            if len(page) < PAGE_SIZE:
+                return users
+
+    def refresh(self):
+        users = self.fetch()
+        if users is None:
+            metrics.incr('sentry-plugins.jira.assignable-users.too-many')
+        value = zlib.compress(json.dumps({
+            'timestamp': time.time(),
+            'users': users,
+        }))
+        cluster.get_routing_client().setex(self.get_key(), INDEX_EXPIRY, value)
+        return users
+
+    def load(self):
+        """
+        Returns a ``(users, is_stale)`` tuple, where ``users`` is ``None`` if
+        there's no usable index.
+        """
+        value = cluster.get_routing_client().get(self.get_key())
+        if value is None:
+            return None, True
+        data = json.loads(zlib.decompress(value))
+        return data['users'], data['timestamp'] + INDEX_TTL < time.time()
+
+    def should_refresh(self):
+        # only one refresh per index is queued at a time
+        return cache.add(self.get_key() + ':refresh', 1, REFRESH_TIMEOUT)
+
+
+def search_users(users, query, limit=MAX_RESULTS):
+    """
+    Returns users whose username, display name (or any word in it) or email
+    starts with ``query``, followed by those which merely contain it.
+    """
+    query = query.lower()
+    prefix_matches = []
+    substring_matches = []
+    for user in users:
+        name, display_name, email = [bit.lower() for bit in user]
+        words = [name, display_name, email] + display_name.split()
+        if any(word.startswith(query) for word in words):
+            prefix_matches.append(user)
+            if len(prefix_matches) >= limit:
+                break
+        elif len(substring_matches) < limit and \
+                any(query in bit for bit in (name, display_name, email)):
+            substring_matches.append(user)
+    return (prefix_matches + substring_matches)[:limit]
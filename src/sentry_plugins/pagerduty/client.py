@@ -1,10 +1,10 @@
 from __future__ import absolute_import
 
 from requests.exceptions import HTTPError
-from sentry.http import build_session
 from sentry.utils.http import absolute_uri
 
 from sentry_plugins.exceptions import ApiError
+from sentry_plugins.http import get_session
 
 import os
 
@@ -27,7 +27,7 @@ class PagerDutyClient(object):
         }
         payload.update(data)
 
-        session = build_session()
+        session = get_session(INTEGRATION_API_URL)
         try:
             resp = session.post(
                 url=INTEGRATION_API_URL,
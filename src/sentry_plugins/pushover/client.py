@@ -1,9 +1,9 @@
 from __future__ import absolute_import
 
 from requests.exceptions import HTTPError
-from sentry.http import build_session
 
 from sentry_plugins.exceptions import ApiError
+from sentry_plugins.http import get_session
 
 
 class PushoverClient(object):
@@ -23,7 +23,7 @@ class PushoverClient(object):
         }
         payload.update(data)
 
-        session = build_session()
+        session = get_session(self.base_url)
         try:
             resp = getattr(session, method.lower())(
                 url='{}{}'.format(self.base_url, path),
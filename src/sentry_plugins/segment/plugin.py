@@ -1,9 +1,9 @@
 from __future__ import absolute_import
 
-from sentry import http
 from sentry.plugins.bases.data_forwarding import DataForwardingPlugin
 
 from sentry_plugins.base import CorePluginMixin
+from sentry_plugins.http import get_session
 from sentry_plugins.utils import get_secret_field_config
 
 
@@ -140,5 +140,5 @@ class SegmentPlugin(CorePluginMixin, DataForwardingPlugin):
         if not write_key:
             return
 
-        session = http.build_session()
+        session = get_session(self.endpoint)
         session.post(self.endpoint, json=payload, auth=(write_key, ''))
@@ -0,0 +1,72 @@
+from __future__ import absolute_import
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from sentry.models import Commit, CommitAuthor, Repository
+
+
+def count_author_queries(func):
+    with CaptureQueriesContext(connection) as ctx:
+        func()
+    return len([q for q in ctx.captured_queries if 'sentry_commitauthor' in q['sql']])
+
+
+class PushEventAuthorsFixture(object):
+    """
+    Tests for the commit authors of push webhooks, shared by the repository
+    providers.
+
+    Subclasses set the ``provider``, the ``webhook`` handler class and the
+    ``repository_id`` and ``repository_name`` their events refer to, and
+    build events with ``make_event(prefix, count)``, which has to return a
+    push of ``count`` commits with their own authors (``Author <i>``,
+    ``author-<prefix>-<i>@example.com``) and commit ids (``prefix`` followed
+    by ``i`` padded to 40 characters.)
+    """
+    provider = None
+    webhook = None
+    repository_id = None
+    repository_name = None
+
+    def make_event(self, prefix, count):
+        raise NotImplementedError
+
+    def create_push_repository(self):
+        return Repository.objects.create(
+            organization_id=self.project.organization.id,
+            external_id=self.repository_id,
+            provider=self.provider,
+            name=self.repository_name,
+        )
+
+    def test_bounded_queries(self):
+        organization = self.project.organization
+        self.create_push_repository()
+
+        few = count_author_queries(
+            lambda: self.webhook()(organization, self.make_event('a', 2))
+        )
+        many = count_author_queries(
+            lambda: self.webhook()(organization, self.make_event('b', 20))
+        )
+        assert few == many
+        assert CommitAuthor.objects.filter(organization_id=organization.id).count() == 22
+
+    def test_reuses_existing_authors(self):
+        organization = self.project.organization
+        self.create_push_repository()
+        existing = CommitAuthor.objects.create(
+            organization_id=organization.id,
+            email='author-a-0@example.com',
+            name='Author 0',
+            external_id=self.get_author_external_id('author-a-0'),
+        )
+
+        self.webhook()(organization, self.make_event('a', 3))
+
+        assert CommitAuthor.objects.filter(organization_id=organization.id).count() == 3
+        commit = Commit.objects.get(key='a%039d' % 0)
+        assert commit.author_id == existing.id
+
+    def get_author_external_id(self, username):
+        return None
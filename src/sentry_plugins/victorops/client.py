@@ -1,9 +1,9 @@
 from __future__ import absolute_import
 
 from requests.exceptions import HTTPError
-from sentry.http import build_session
 
 from sentry_plugins.exceptions import ApiError
+from sentry_plugins.http import get_session
 
 
 class VictorOpsClient(object):
@@ -23,7 +23,7 @@ class VictorOpsClient(object):
             self.routing_key,
         )
 
-        session = build_session()
+        session = get_session(endpoint)
         try:
             resp = session.post(
                 url=endpoint,
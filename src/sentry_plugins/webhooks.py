@@ -0,0 +1,123 @@
+"""
+Helpers shared by the webhook endpoints of the repository plugins.
+"""
+from __future__ import absolute_import
+
+import logging
+
+from django.db import IntegrityError, transaction
+from django.http import Http404
+from sentry.models import CommitAuthor, Organization
+from sentry.utils.cache import cache
+
+logger = logging.getLogger('sentry.webhooks')
+
+# how long we remember webhook delivery ids for deduplication
+WEBHOOK_DELIVERY_TTL = 60 * 60
+
+
+def get_webhook_delivery_key(provider, delivery_id):
+    return 'sentry-plugins:%s:webhook-delivery:%s' % (provider, delivery_id)
+
+
+def record_webhook_delivery(provider, delivery_id):
+    """
+    Remember a webhook delivery id, returning ``False`` if we've already
+    seen it (i.e. this is a redelivery that should be dropped).
+    """
+    if not delivery_id:
+        return True
+    return cache.add(get_webhook_delivery_key(provider, delivery_id), 1, WEBHOOK_DELIVERY_TTL)
+
+
+def forget_webhook_delivery(provider, delivery_id):
+    if delivery_id:
+        cache.delete(get_webhook_delivery_key(provider, delivery_id))
+
+
+def process_webhook_event(provider, endpoint, organization_id, event_type, event):
+    """
+    Handle an event queued by the webhook ``endpoint`` of ``provider``, this
+    is what the providers' ``process_webhook`` tasks do.
+    """
+    handler = endpoint.get_handler(event_type)
+    if handler is None:
+        return
+
+    organization = Organization.objects.get_from_cache(id=organization_id)
+    try:
+        handler()(organization, event)
+    except Http404:
+        logger.info(
+            '%s.webhook.missing-repository' % (provider, ),
+            extra={
+                'organization_id': organization_id,
+            }
+        )
+
+
+def get_or_create_commit_authors(organization_id, names, external_ids=None):
+    """
+    Given a mapping of email to name, return a mapping of email to
+    ``CommitAuthor``, creating any authors which don't exist yet.
+    ``external_ids`` optionally maps emails to the external id new authors
+    are created with.
+
+    Existing authors are fetched with a single query and missing ones are
+    bulk inserted, so the number of queries doesn't grow with the number of
+    authors in a push.
+    """
+    if not names:
+        return {}
+    external_ids = external_ids or {}
+
+    authors = {
+        a.email: a
+        for a in CommitAuthor.objects.filter(
+            organization_id=organization_id,
+            email__in=list(names),
+        )
+    }
+
+    missing = [email for email in names if email not in authors]
+    if not missing:
+        return authors
+
+    try:
+        with transaction.atomic():
+            CommitAuthor.objects.bulk_create(
+                [
+                    CommitAuthor(
+                        organization_id=organization_id,
+                        email=email,
+                        name=names[email][:128],
+                        external_id=external_ids.get(email),
+                    ) for email in missing
+                ]
+            )
+    except IntegrityError:
+        # another request created some of these in the meantime (or already
+        # owns one of the external ids, which callers have to reconcile)
+        pass
+
+    authors.update(
+        {
+            a.email: a
+            for a in CommitAuthor.objects.filter(
+                organization_id=organization_id,
+                email__in=missing,
+            )
+        }
+    )
+
+    for email in missing:
+        if email not in authors:
+            authors[email] = CommitAuthor.objects.get_or_create(
+                organization_id=organization_id,
+                email=email,
+                defaults={
+                    'name': names[email][:128],
+                }
+            )[0]
+
+    return authors
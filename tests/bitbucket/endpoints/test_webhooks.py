@@ -1,13 +1,21 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
 
+import mock
+import six
+
 from datetime import datetime
 from django.utils import timezone
 from sentry.models import Commit, CommitAuthor, Repository
 from sentry.testutils import APITestCase, TestCase
+from sentry.utils import json
+from uuid import uuid4
 
-from sentry_plugins.bitbucket.endpoints.webhook import parse_raw_user_email, parse_raw_user_name
+from sentry_plugins.bitbucket.endpoints.webhook import (
+    PushEventWebhook, parse_raw_user_email, parse_raw_user_name
+)
 from sentry_plugins.bitbucket.testutils import PUSH_EVENT_EXAMPLE
+from sentry_plugins.testutils import PushEventAuthorsFixture
 
 BAD_IP = '109.111.111.10'
 BITBUCKET_IP = '104.192.143.10'
@@ -157,3 +165,125 @@ class PushEventWebhookTest(APITestCase):
         assert commit.author.email == 'max@getsentry.com'
         assert commit.author.external_id is None
         assert commit.date_added == datetime(2017, 5, 24, 1, 5, 47, tzinfo=timezone.utc)
+
+
+class PushEventAuthorsTest(APITestCase, PushEventAuthorsFixture):
+    provider = 'bitbucket'
+    webhook = PushEventWebhook
+    repository_id = '{c78dfb25-7882-4550-97b1-4e0d38f32859}'
+    repository_name = 'maxbittker/newsdiffs'
+
+    def make_event(self, prefix, count):
+        event = json.loads(PUSH_EVENT_EXAMPLE)
+        change = event['push']['changes'][0]
+        template = change['commits'][0]
+        change['commits'] = [
+            dict(
+                template,
+                hash='%s%039d' % (prefix, i),
+                author=dict(
+                    template['author'],
+                    raw='Author %d <author-%s-%d@example.com>' % (i, prefix, i),
+                ),
+            ) for i in range(count)
+        ]
+        return event
+
+
+class AsyncWebhookTest(APITestCase):
+    @mock.patch('sentry_plugins.bitbucket.endpoints.webhook.process_webhook')
+    def test_deduplicates_deliveries(self, mock_process_webhook):
+        project = self.project  # force creation
+
+        url = '/plugins/bitbucket/organizations/{}/webhook/'.format(
+            project.organization.id,
+        )
+
+        delivery_id = six.text_type(uuid4())
+
+        with self.settings(BITBUCKET_WEBHOOK_ASYNC=True):
+            for _ in range(2):
+                response = self.client.post(
+                    path=url,
+                    data=PUSH_EVENT_EXAMPLE,
+                    content_type='application/json',
+                    HTTP_X_EVENT_KEY='repo:push',
+                    HTTP_X_REQUEST_UUID=delivery_id,
+                    REMOTE_ADDR=BITBUCKET_IP,
+                )
+
+                assert response.status_code == 202
+
+        assert mock_process_webhook.delay.call_count == 1
+        kwargs = mock_process_webhook.delay.call_args[1]
+        assert kwargs['organization_id'] == project.organization.id
+        assert kwargs['event_type'] == 'repo:push'
+        assert kwargs['event']['repository']['uuid'] == '{c78dfb25-7882-4550-97b1-4e0d38f32859}'
+
+    @mock.patch('sentry_plugins.bitbucket.endpoints.webhook.process_webhook')
+    def test_forgets_delivery_if_queueing_fails(self, mock_process_webhook):
+        project = self.project  # force creation
+
+        url = '/plugins/bitbucket/organizations/{}/webhook/'.format(
+            project.organization.id,
+        )
+
+        delivery_id = six.text_type(uuid4())
+        mock_process_webhook.delay.side_effect = [Exception('broker is down'), None]
+
+        with self.settings(BITBUCKET_WEBHOOK_ASYNC=True):
+            with self.assertRaises(Exception):
+                self.client.post(
+                    path=url,
+                    data=PUSH_EVENT_EXAMPLE,
+                    content_type='application/json',
+                    HTTP_X_EVENT_KEY='repo:push',
+                    HTTP_X_REQUEST_UUID=delivery_id,
+                    REMOTE_ADDR=BITBUCKET_IP,
+                )
+
+            # the redelivery is queued rather than dropped as a duplicate
+            response = self.client.post(
+                path=url,
+                data=PUSH_EVENT_EXAMPLE,
+                content_type='application/json',
+                HTTP_X_EVENT_KEY='repo:push',
+                HTTP_X_REQUEST_UUID=delivery_id,
+                REMOTE_ADDR=BITBUCKET_IP,
+            )
+            assert response.status_code == 202
+
+        assert mock_process_webhook.delay.call_count == 2
+
+    @mock.patch('sentry_plugins.bitbucket.endpoints.webhook.process_webhook')
+    def test_invalid_body_does_not_claim_delivery(self, mock_process_webhook):
+        project = self.project  # force creation
+
+        url = '/plugins/bitbucket/organizations/{}/webhook/'.format(
+            project.organization.id,
+        )
+
+        delivery_id = six.text_type(uuid4())
+
+        with self.settings(BITBUCKET_WEBHOOK_ASYNC=True):
+            response = self.client.post(
+                path=url,
+                data=PUSH_EVENT_EXAMPLE[:-10],
+                content_type='application/json',
+                HTTP_X_EVENT_KEY='repo:push',
+                HTTP_X_REQUEST_UUID=delivery_id,
+                REMOTE_ADDR=BITBUCKET_IP,
+            )
+            assert response.status_code == 400
+
+            response = self.client.post(
+                path=url,
+                data=PUSH_EVENT_EXAMPLE,
+                content_type='application/json',
+                HTTP_X_EVENT_KEY='repo:push',
+                HTTP_X_REQUEST_UUID=delivery_id,
+                REMOTE_ADDR=BITBUCKET_IP,
+            )
+            assert response.status_code == 202
+
+        assert mock_process_webhook.delay.call_count == 1
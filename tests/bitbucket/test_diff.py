@@ -0,0 +1,115 @@
+from __future__ import absolute_import
+
+from sentry.testutils import TestCase
+
+from sentry_plugins.bitbucket.diff import MAX_LINE_LENGTH, get_file_changes, iter_lines
+
+DIFF_EXAMPLE = b"""diff --git a/README.md b/README.md
+index 1c5b0a3..a2c4f33 100644
+--- a/README.md
++++ b/README.md
+@@ -1,2 +1,2 @@
+ hello
+--- a/not-a-header.sql
++world
+diff --git a/schema.sql b/schema.sql
+new file mode 100644
+index 0000000..3b18e51
+--- /dev/null
++++ b/schema.sql
+@@ -0,0 +1 @@
++-- comment
+\\ No newline at end of file
+diff --git a/old.txt b/old.txt
+deleted file mode 100644
+index 3b18e51..0000000
+--- a/old.txt
++++ /dev/null
+@@ -1 +0,0 @@
+-goodbye
+"""
+
+# files without any hunks, which are only described by their headers
+HEADERS_ONLY_EXAMPLE = b"""diff --git a/logo.png b/logo.png
+new file mode 100644
+index 0000000..9a1f2b3
+Binary files /dev/null and b/logo.png differ
+diff --git a/empty.txt b/empty.txt
+new file mode 100644
+index 0000000..e69de29
+diff --git a/gone.txt b/gone.txt
+deleted file mode 100644
+index e69de29..0000000
+diff --git a/old name.txt b/new name.txt
+similarity index 100%
+rename from old name.txt
+rename to new name.txt
+diff --git a/run.sh b/run.sh
+old mode 100644
+new mode 100755
+diff --git "a/caf\303\251.txt" "b/caf\303\251.txt"
+index 1c5b0a3..a2c4f33 100644
+Binary files "a/caf\303\251.txt" and "b/caf\303\251.txt" differ
+"""
+
+
+class DiffTest(TestCase):
+    def test_iter_lines(self):
+        chunks = [b'ab', b'c\nd', b'\n\nef']
+        assert list(iter_lines(chunks)) == [b'abc', b'd', b'', b'ef']
+
+    def test_get_file_changes(self):
+        expected = [
+            {
+                'path': 'schema.sql',
+                'type': 'A',
+            },
+            {
+                'path': 'old.txt',
+                'type': 'D',
+            },
+            {
+                'path': 'README.md',
+                'type': 'M',
+            },
+        ]
+        for size in (1, 7, len(DIFF_EXAMPLE)):
+            chunks = [DIFF_EXAMPLE[i:i + size] for i in range(0, len(DIFF_EXAMPLE), size)]
+            assert get_file_changes(iter_lines(chunks)) == expected
+
+    def test_iter_lines_long_line(self):
+        chunks = [b'x' * 1000] * (MAX_LINE_LENGTH // 100) + [b'\nshort\n']
+        lines = list(iter_lines(chunks))
+        assert lines == [b'x' * MAX_LINE_LENGTH, b'short']
+
+    def test_headers_only(self):
+        assert get_file_changes(iter_lines([HEADERS_ONLY_EXAMPLE])) == [
+            {
+                'path': 'logo.png',
+                'type': 'A',
+            },
+            {
+                'path': 'empty.txt',
+                'type': 'A',
+            },
+            {
+                'path': 'new name.txt',
+                'type': 'A',
+            },
+            {
+                'path': 'gone.txt',
+                'type': 'D',
+            },
+            {
+                'path': 'old name.txt',
+                'type': 'D',
+            },
+            {
+                'path': 'run.sh',
+                'type': 'M',
+            },
+            {
+                'path': u'caf\xe9.txt',
+                'type': 'M',
+            },
+        ]
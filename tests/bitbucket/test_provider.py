@@ -1,10 +1,14 @@
 from __future__ import absolute_import
 
+import mock
+import responses
+
 from exam import fixture
 from sentry.models import Repository
 from sentry.testutils import PluginTestCase
 from sentry.utils import json
 
+from sentry_plugins.bitbucket.client import BitbucketClient
 from sentry_plugins.bitbucket.plugin import BitbucketRepositoryProvider
 from sentry_plugins.bitbucket.testutils import COMPARE_COMMITS_EXAMPLE
 
@@ -33,3 +37,125 @@ class BitbucketPluginTest(PluginTestCase):
                 'patch_set': None
             }
         ]
+
+
+DIFF_EXAMPLE = b"""diff --git a/README.md b/README.md
+index 1c5b0a3..a2c4f33 100644
+--- a/README.md
++++ b/README.md
+@@ -1 +1 @@
+-hello
++hello world
+"""
+
+
+class BitbucketClientTest(PluginTestCase):
+    @fixture
+    def client(self):
+        auth = mock.Mock(
+            tokens={
+                'oauth_token': '123456789abcdefghi',
+                'oauth_token_secret': '123456789123456789abcdefghijklmn',
+            }
+        )
+        return BitbucketClient(auth)
+
+    @responses.activate
+    def test_get_last_commits_only_fetches_returned_diffs(self):
+        responses.add(
+            responses.GET,
+            'https://api.bitbucket.org/2.0/repositories/maxbittker/newsdiffs/commits/c',
+            body=json.dumps({'values': [{'hash': 'c'}, {'hash': 'b'}, {'hash': 'a'}]}),
+        )
+        for sha in ('c', 'b'):
+            responses.add(
+                responses.GET,
+                'https://api.bitbucket.org/2.0/repositories/maxbittker/newsdiffs/diff/%s' % sha,
+                body=DIFF_EXAMPLE,
+            )
+
+        res = self.client.get_last_commits('maxbittker/newsdiffs', 'c', limit=2)
+
+        assert [c['hash'] for c in res] == ['c', 'b']
+        assert res[0]['patch_set'] == [{'path': 'README.md', 'type': 'M'}]
+        assert res[1]['patch_set'] == [{'path': 'README.md', 'type': 'M'}]
+        assert len(responses.calls) == 3
+
+    @responses.activate
+    def test_compare_commits_paginates_until_start_sha(self):
+        base_url = 'https://api.bitbucket.org/2.0/repositories/maxbittker/newsdiffs/commits/d'
+        responses.add(
+            responses.GET,
+            base_url,
+            body=json.dumps(
+                {
+                    'values': [{'hash': 'd'}, {'hash': 'c'}],
+                    'next': base_url + '?page=2',
+                }
+            ),
+            match_querystring=True,
+        )
+        responses.add(
+            responses.GET,
+            base_url + '?page=2',
+            body=json.dumps(
+                {
+                    'values': [{'hash': 'b'}, {'hash': 'a'}],
+                    'next': base_url + '?page=3',
+                }
+            ),
+            match_querystring=True,
+        )
+        for sha in ('d', 'c', 'b'):
+            responses.add(
+                responses.GET,
+                'https://api.bitbucket.org/2.0/repositories/maxbittker/newsdiffs/diff/%s' % sha,
+                body=DIFF_EXAMPLE,
+            )
+
+        with mock.patch('sentry_plugins.bitbucket.client.logger') as mock_logger:
+            res = self.client.compare_commits('maxbittker/newsdiffs', 'a', 'd')
+
+        assert not mock_logger.warning.called
+        assert [c['hash'] for c in res] == ['d', 'c', 'b']
+        assert all(c['patch_set'] == [{'path': 'README.md', 'type': 'M'}] for c in res)
+        # two pages and three diffs, page three is never requested
+        assert len(responses.calls) == 5
+
+    @responses.activate
+    def test_compare_commits_limit(self):
+        base_url = 'https://api.bitbucket.org/2.0/repositories/maxbittker/newsdiffs/commits/d'
+        responses.add(
+            responses.GET,
+            base_url,
+            body=json.dumps(
+                {
+                    'values': [{'hash': 'd'}, {'hash': 'c'}],
+                    'next': base_url + '?page=2',
+                }
+            ),
+            match_querystring=True,
+        )
+        for sha in ('d', 'c'):
+            responses.add(
+                responses.GET,
+                'https://api.bitbucket.org/2.0/repositories/maxbittker/newsdiffs/diff/%s' % sha,
+                body=DIFF_EXAMPLE,
+            )
+
+        with mock.patch('sentry_plugins.bitbucket.client.logger') as mock_logger:
+            res = self.client.compare_commits('maxbittker/newsdiffs', 'a', 'd', limit=2)
+
+        assert [c['hash'] for c in res] == ['d', 'c']
+        assert len(responses.calls) == 3
+        # releases covering more commits than the limit lose some
+        assert mock_logger.warning.call_args[0][0] == 'bitbucket.compare-commits.truncated'
+
+    @mock.patch('sentry_plugins.bitbucket.client.ThreadPool')
+    def test_zip_commit_data_without_pool(self, mock_pool):
+        with mock.patch.object(self.client, 'get_commit_filechanges', return_value=[]):
+            assert self.client.zip_commit_data('maxbittker/newsdiffs', iter([])) == []
+            assert self.client.zip_commit_data(
+                'maxbittker/newsdiffs', iter([{'hash': 'a'}])
+            ) == [{'hash': 'a', 'patch_set': []}]
+        assert not mock_pool.called
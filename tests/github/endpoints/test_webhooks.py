@@ -1,15 +1,26 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
 
+import hashlib
+import hmac
+import mock
 import six
 
 from datetime import datetime
+from ijson.common import JSONError
+from tempfile import SpooledTemporaryFile
 from django.utils import timezone
-from sentry.models import Commit, CommitAuthor, OrganizationOption, Repository
+from sentry.models import (
+    Commit, CommitAuthor, CommitFileChange, OrganizationOption, Repository
+)
 from sentry.testutils import APITestCase
+from sentry.utils import json
 from uuid import uuid4
 
+from sentry_plugins.github.cache import get_user_email_key, user_email_cache, user_id_cache
+from sentry_plugins.github.endpoints.webhook import PushEventWebhook, load_json_event
 from sentry_plugins.github.testutils import PUSH_EVENT_EXAMPLE
+from sentry_plugins.testutils import PushEventAuthorsFixture
 
 
 class WebhookTest(APITestCase):
@@ -200,3 +211,320 @@ class PushEventWebhookTest(APITestCase):
         assert commit.author.name == u'bàxterthehacker'
         assert commit.author.email == 'baxterthehacker@example.com'
         assert commit.date_added == datetime(2015, 5, 5, 23, 40, 15, tzinfo=timezone.utc)
+
+    def test_existing_commits(self):
+        project = self.project  # force creation
+
+        url = '/plugins/github/organizations/{}/webhook/'.format(
+            project.organization.id,
+        )
+
+        secret = 'b3002c3e321d4b7880360d397db2ccfd'
+
+        OrganizationOption.objects.set_value(
+            organization=project.organization,
+            key='github:webhook_secret',
+            value=secret,
+        )
+
+        repo = Repository.objects.create(
+            organization_id=project.organization.id,
+            external_id='35129377',
+            provider='github',
+            name='baxterthehacker/public-repo',
+        )
+
+        existing = Commit.objects.create(
+            repository_id=repo.id,
+            organization_id=project.organization_id,
+            key='0d1a26e67d8f5eaf1f6ba5c57fc3c7d91ac0fd1c',
+            message='Update README.md',
+        )
+
+        response = self.client.post(
+            path=url,
+            data=PUSH_EVENT_EXAMPLE,
+            content_type='application/json',
+            HTTP_X_GITHUB_EVENT='push',
+            HTTP_X_HUB_SIGNATURE='sha1=98196e70369945ffa6b248cf70f7dc5e46dff241',
+            HTTP_X_GITHUB_DELIVERY=six.text_type(uuid4())
+        )
+
+        assert response.status_code == 204
+
+        assert Commit.objects.filter(
+            organization_id=project.organization_id,
+        ).count() == 2
+        assert Commit.objects.get(key=existing.key).id == existing.id
+
+        commit = Commit.objects.get(key='133d60480286590a610a0eb7352ff6e02b9674c4')
+        file_changes = list(
+            CommitFileChange.objects.filter(
+                organization_id=project.organization_id,
+            )
+        )
+        assert len(file_changes) == 1
+        assert file_changes[0].commit_id == commit.id
+        assert file_changes[0].filename == 'README.md'
+        assert file_changes[0].type == 'M'
+
+
+class LoadJsonEventTest(APITestCase):
+    def test_lazy_keys(self):
+        spool = SpooledTemporaryFile()
+        event = load_json_event(
+            six.BytesIO(PUSH_EVENT_EXAMPLE), spool, lazy_keys=('commits', )
+        )
+        expected = json.loads(PUSH_EVENT_EXAMPLE)
+        assert list(event.pop('commits')) == expected.pop('commits')
+        assert event == expected
+
+    def test_malformed_lazy_key(self):
+        body = PUSH_EVENT_EXAMPLE.replace(b'"distinct": true', b'"distinct": tru', 1)
+        with self.assertRaises(JSONError):
+            load_json_event(six.BytesIO(body), SpooledTemporaryFile(), lazy_keys=('commits', ))
+
+
+class StreamedBodyTest(APITestCase):
+    secret = 'b3002c3e321d4b7880360d397db2ccfd'
+
+    def setUp(self):
+        super(StreamedBodyTest, self).setUp()
+        self.url = '/plugins/github/organizations/{}/webhook/'.format(
+            self.organization.id,
+        )
+        OrganizationOption.objects.set_value(
+            organization=self.organization,
+            key='github:webhook_secret',
+            value=self.secret,
+        )
+        self.repo = Repository.objects.create(
+            organization_id=self.organization.id,
+            external_id='35129377',
+            provider='github',
+            name='baxterthehacker/public-repo',
+        )
+
+    def post(self, body, event_type='push'):
+        signature = hmac.new(self.secret.encode('utf-8'), body, hashlib.sha1).hexdigest()
+        return self.client.post(
+            path=self.url,
+            data=body,
+            content_type='application/json',
+            HTTP_X_GITHUB_EVENT=event_type,
+            HTTP_X_HUB_SIGNATURE='sha1=%s' % signature,
+            HTTP_X_GITHUB_DELIVERY=six.text_type(uuid4()),
+        )
+
+    def get_commit_keys(self):
+        return set(Commit.objects.filter(repository_id=self.repo.id).values_list('key', flat=True))
+
+    @mock.patch('sentry_plugins.github.endpoints.webhook.BODY_CHUNK_SIZE', 7)
+    def test_chunked_signature(self):
+        assert self.post(PUSH_EVENT_EXAMPLE).status_code == 204
+        assert len(self.get_commit_keys()) == 2
+
+        body = PUSH_EVENT_EXAMPLE.replace(b'"forced": false', b'"forced": true')
+        signature = hmac.new(self.secret.encode('utf-8'), PUSH_EVENT_EXAMPLE, hashlib.sha1)
+        response = self.client.post(
+            path=self.url,
+            data=body,
+            content_type='application/json',
+            HTTP_X_GITHUB_EVENT='push',
+            HTTP_X_HUB_SIGNATURE='sha1=%s' % signature.hexdigest(),
+        )
+        assert response.status_code == 401
+
+    @mock.patch('sentry_plugins.github.endpoints.webhook.MAX_BODY_MEMORY_SIZE', 64)
+    @mock.patch.object(PushEventWebhook, 'batch_size', 1)
+    def test_streamed_commits(self):
+        assert self.post(PUSH_EVENT_EXAMPLE).status_code == 204
+        assert self.get_commit_keys() == {
+            '133d60480286590a610a0eb7352ff6e02b9674c4',
+            '0d1a26e67d8f5eaf1f6ba5c57fc3c7d91ac0fd1c',
+        }
+
+    def test_malformed_commits(self):
+        # the first commit is fine, the second one is broken
+        body = PUSH_EVENT_EXAMPLE.replace(
+            b'"message": "Update README.md",', b'"message": "Update README.md" ,,', 1
+        )
+        assert body != PUSH_EVENT_EXAMPLE
+
+        assert self.post(body).status_code == 400
+        with mock.patch('sentry_plugins.github.endpoints.webhook.MAX_BODY_MEMORY_SIZE', 64):
+            with mock.patch.object(PushEventWebhook, 'batch_size', 1):
+                assert self.post(body).status_code == 400
+        assert self.get_commit_keys() == set()
+
+    def test_missing_body(self):
+        # checked before anything else about the request, as it always was
+        assert self.post(b'', event_type='UnregisteredEvent').status_code == 400
+
+
+class AnonymousAuthorsTest(APITestCase):
+    def setUp(self):
+        super(AnonymousAuthorsTest, self).setUp()
+        user_email_cache.local.clear()
+        user_id_cache.local.clear()
+        self.repo = Repository.objects.create(
+            organization_id=self.organization.id,
+            external_id='35129377',
+            provider='github',
+            name='baxterthehacker/public-repo',
+        )
+
+    @mock.patch('sentry_plugins.github.client.GitHubClient.request_no_auth')
+    def test_known_author_before_cache(self, mock_request):
+        # the cache says something else, but the author we already linked to
+        # the username wins, just like without the cache
+        user_email_cache.set(
+            get_user_email_key(self.organization, 'baxterthehacker'),
+            'stale@example.com',
+        )
+        author = CommitAuthor.objects.create(
+            external_id='github:baxterthehacker',
+            organization_id=self.organization.id,
+            email='baxterthehacker@example.com',
+            name=u'bàxterthehacker',
+        )
+
+        PushEventWebhook()(self.organization, json.loads(PUSH_EVENT_EXAMPLE))
+
+        assert not mock_request.called
+        assert set(
+            Commit.objects.filter(repository_id=self.repo.id).values_list('author_id', flat=True)
+        ) == {author.id}
+
+    @mock.patch('sentry_plugins.github.client.GitHubClient.request_no_auth')
+    def test_cached_email_updates_anonymous_author(self, mock_request):
+        user_email_cache.set(
+            get_user_email_key(self.organization, 'baxterthehacker'),
+            'baxterthehacker@example.com',
+        )
+        author = CommitAuthor.objects.create(
+            external_id='github:baxterthehacker',
+            organization_id=self.organization.id,
+            email='baxterthehacker@users.noreply.github.com',
+            name=u'bàxterthehacker',
+        )
+
+        PushEventWebhook()(self.organization, json.loads(PUSH_EVENT_EXAMPLE))
+
+        # resolved from the cache without asking GitHub, and the existing
+        # author is reused rather than a new one created for the email
+        assert not mock_request.called
+        author = CommitAuthor.objects.get(id=author.id)
+        assert author.email == 'baxterthehacker@example.com'
+        assert CommitAuthor.objects.filter(organization_id=self.organization.id).count() == 1
+        assert set(
+            Commit.objects.filter(repository_id=self.repo.id).values_list('author_id', flat=True)
+        ) == {author.id}
+
+
+class PushEventAuthorsTest(APITestCase, PushEventAuthorsFixture):
+    provider = 'github'
+    webhook = PushEventWebhook
+    repository_id = '35129377'
+    repository_name = 'baxterthehacker/public-repo'
+
+    def make_event(self, prefix, count):
+        event = json.loads(PUSH_EVENT_EXAMPLE)
+        template = event['commits'][0]
+        event['commits'] = [
+            dict(
+                template,
+                id='%s%039d' % (prefix, i),
+                author={
+                    'name': 'Author %d' % i,
+                    'email': 'author-%s-%d@example.com' % (prefix, i),
+                    'username': 'author-%s-%d' % (prefix, i),
+                },
+            ) for i in range(count)
+        ]
+        return event
+
+    def get_author_external_id(self, username):
+        return 'github:%s' % username
+
+    def test_new_authors_have_external_ids(self):
+        self.create_push_repository()
+        PushEventWebhook()(self.project.organization, self.make_event('a', 2))
+        author = CommitAuthor.objects.get(
+            organization_id=self.project.organization_id,
+            email='author-a-1@example.com',
+        )
+        assert author.external_id == 'github:author-a-1'
+
+
+class AsyncWebhookTest(APITestCase):
+    @mock.patch('sentry_plugins.github.endpoints.webhook.process_webhook')
+    def test_deduplicates_deliveries(self, mock_process_webhook):
+        project = self.project  # force creation
+
+        url = '/plugins/github/organizations/{}/webhook/'.format(
+            project.organization.id,
+        )
+
+        secret = 'b3002c3e321d4b7880360d397db2ccfd'
+
+        OrganizationOption.objects.set_value(
+            organization=project.organization,
+            key='github:webhook_secret',
+            value=secret,
+        )
+
+        delivery_id = six.text_type(uuid4())
+
+        with self.settings(GITHUB_WEBHOOK_ASYNC=True):
+            for _ in range(2):
+                response = self.client.post(
+                    path=url,
+                    data=PUSH_EVENT_EXAMPLE,
+                    content_type='application/json',
+                    HTTP_X_GITHUB_EVENT='push',
+                    HTTP_X_HUB_SIGNATURE='sha1=98196e70369945ffa6b248cf70f7dc5e46dff241',
+                    HTTP_X_GITHUB_DELIVERY=delivery_id,
+                )
+
+                assert response.status_code == 202
+
+        assert mock_process_webhook.delay.call_count == 1
+        kwargs = mock_process_webhook.delay.call_args[1]
+        assert kwargs['organization_id'] == project.organization.id
+        assert kwargs['event_type'] == 'push'
+        assert kwargs['event']['repository']['id'] == 35129377
+
+    @mock.patch('sentry_plugins.github.endpoints.webhook.process_webhook')
+    def test_invalid_body_does_not_claim_delivery(self, mock_process_webhook):
+        project = self.project  # force creation
+
+        url = '/plugins/github/organizations/{}/webhook/'.format(
+            project.organization.id,
+        )
+
+        secret = 'b3002c3e321d4b7880360d397db2ccfd'
+
+        OrganizationOption.objects.set_value(
+            organization=project.organization,
+            key='github:webhook_secret',
+            value=secret,
+        )
+
+        delivery_id = six.text_type(uuid4())
+
+        with self.settings(GITHUB_WEBHOOK_ASYNC=True):
+            for body, status_code in ((PUSH_EVENT_EXAMPLE[:-10], 400), (PUSH_EVENT_EXAMPLE, 202)):
+                response = self.client.post(
+                    path=url,
+                    data=body,
+                    content_type='application/json',
+                    HTTP_X_GITHUB_EVENT='push',
+                    HTTP_X_HUB_SIGNATURE='sha1=%s' % (
+                        hmac.new(secret.encode('utf-8'), body, hashlib.sha1).hexdigest(),
+                    ),
+                    HTTP_X_GITHUB_DELIVERY=delivery_id,
+                )
+                assert response.status_code == status_code
+
+        assert mock_process_webhook.delay.call_count == 1
@@ -0,0 +1,66 @@
+from __future__ import absolute_import
+
+import mock
+
+from sentry.testutils import TestCase
+
+from sentry_plugins.cache import cluster
+from sentry_plugins.github.cache import GitHubUserCache, LocalCache, MISSING
+
+
+class LocalCacheTest(TestCase):
+    @mock.patch('sentry_plugins.github.cache.time.time')
+    def test_expiry(self, mock_time):
+        cache = LocalCache(max_size=10)
+        mock_time.return_value = 1000
+        cache.set('foo', 'bar', 60)
+        assert cache.get('foo') == 'bar'
+        mock_time.return_value = 1061
+        assert cache.get('foo') is MISSING
+
+    def test_evicts_least_recently_used(self):
+        cache = LocalCache(max_size=2)
+        cache.set('a', 1, 60)
+        cache.set('b', 2, 60)
+        cache.get('a')
+        cache.set('c', 3, 60)
+        assert cache.get('a') == 1
+        assert cache.get('b') is MISSING
+        assert cache.get('c') == 3
+
+
+@mock.patch('sentry_plugins.github.cache.metrics')
+class GitHubUserCacheTest(TestCase):
+    def setUp(self):
+        self.cache = GitHubUserCache('test', ttl=3600, miss_ttl=60)
+
+    def get_metrics(self, mock_metrics):
+        return [c[0][0] for c in mock_metrics.incr.call_args_list]
+
+    def test_miss(self, mock_metrics):
+        assert self.cache.get('ghost') is MISSING
+        assert self.get_metrics(mock_metrics) == ['sentry-plugins.github.test-cache.miss']
+
+    def test_hit(self, mock_metrics):
+        self.cache.set('octocat', '583231')
+        assert self.cache.get('octocat') == '583231'
+
+        # another process only has it in redis
+        self.cache.local.clear()
+        assert self.cache.get('octocat') == '583231'
+        assert self.cache.get('octocat') == '583231'
+
+        assert self.get_metrics(mock_metrics) == [
+            'sentry-plugins.github.test-cache.local-hit',
+            'sentry-plugins.github.test-cache.hit',
+            'sentry-plugins.github.test-cache.local-hit',
+        ]
+
+    def test_caches_unknown_users(self, mock_metrics):
+        self.cache.set('nobody', None)
+        self.cache.local.clear()
+
+        assert self.cache.get('nobody') is None
+        client = cluster.get_routing_client()
+        assert 0 < client.ttl(self.cache.get_key('nobody')) <= 60
+        assert self.get_metrics(mock_metrics) == ['sentry-plugins.github.test-cache.hit']
@@ -1,5 +1,7 @@
 from __future__ import absolute_import
 
+import mock
+
 from exam import fixture
 from sentry.models import Repository
 from sentry.testutils import PluginTestCase
@@ -51,3 +53,28 @@ class GitHubPluginTest(PluginTestCase):
                 'repository': 'example'
             }
         ]
+
+    def test_compare_commits_cached(self):
+        repo = Repository.objects.create(
+            provider='github',
+            name='example',
+            organization_id=1,
+        )
+
+        commits = self.provider._format_commits(
+            repo, json.loads(COMPARE_COMMITS_EXAMPLE)['commits']
+        )
+        start_sha = '0d1a26e67d8f5eaf1f6ba5c57fc3c7d91ac0fd1c'
+        end_sha = '6dcb09b5b57875f334f61aebed695e2e4193db5e'
+
+        with mock.patch.object(
+            GitHubRepositoryProvider, '_compare_commits', return_value=commits
+        ) as mock_compare_commits:
+            assert self.provider.compare_commits(repo, start_sha, end_sha, actor=self.user) == commits
+            assert self.provider.compare_commits(repo, start_sha, end_sha, actor=self.user) == commits
+            assert mock_compare_commits.call_count == 1
+
+            # branch names can move, so they're never cached
+            self.provider.compare_commits(repo, start_sha, 'master', actor=self.user)
+            self.provider.compare_commits(repo, start_sha, 'master', actor=self.user)
+            assert mock_compare_commits.call_count == 3
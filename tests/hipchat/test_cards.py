@@ -0,0 +1,59 @@
+from __future__ import absolute_import
+
+import mock
+
+from sentry.models import Activity
+from sentry.testutils import TestCase
+
+from sentry_plugins.hipchat_ac import cards
+from sentry_plugins.hipchat_ac.testutils import HipchatFixture
+
+
+class EventNotificationTest(TestCase, HipchatFixture):
+    def test_rendered_once_per_event(self):
+        project = self.create_project()
+        group = self.create_group(project=project)
+        event = self.create_event(group=group)
+        tenant = self.create_tenant(projects=[project])
+        tenant2 = self.create_tenant(projects=[project])
+
+        cache = {}
+        with mock.patch.object(cards, '_make_event_card', wraps=cards._make_event_card) as render:
+            n1 = cards.make_event_notification(group, event, tenant, cache=cache)
+            n2 = cards.make_event_notification(group, event, tenant2, cache=cache)
+            assert render.call_count == 1
+
+            # a different link gets its own card
+            n3 = cards.make_event_notification(group, event, tenant, event_target=True, cache=cache)
+            assert render.call_count == 2
+
+        assert n1 == n2 == cards.make_event_notification(group, event, tenant)
+        assert n1['card'] is not n2['card']
+        assert n1['card']['metadata'] is not n2['card']['metadata']
+        assert n3['card']['url'].endswith('/events/%s/' % event.id)
+
+
+class ActivityNotificationTest(TestCase, HipchatFixture):
+    def test_rendered_once_per_activity(self):
+        project = self.create_project()
+        group = self.create_group(project=project)
+        self.create_event(group=group)
+        activity = Activity.objects.create(
+            project=project,
+            group=group,
+            type=Activity.NOTE,
+            user=self.user,
+            data={'text': 'hello'},
+        )
+        tenant = self.create_tenant(projects=[project])
+        tenant2 = self.create_tenant(projects=[project])
+
+        activity.group = group
+        cache = {}
+        with mock.patch.object(group, 'get_latest_event', wraps=group.get_latest_event) as latest:
+            n1 = cards.make_activity_notification(activity, tenant, cache=cache)
+            n2 = cards.make_activity_notification(activity, tenant2, cache=cache)
+            assert latest.call_count == 1
+
+        assert n1 == n2
+        assert n1['card'] is not n2['card']
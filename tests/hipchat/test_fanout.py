@@ -0,0 +1,125 @@
+from __future__ import absolute_import
+
+import mock
+import threading
+import time
+
+from multiprocessing import TimeoutError
+from sentry.testutils import TestCase
+
+from sentry_plugins.hipchat_ac.fanout import Fanout
+
+
+class FanoutTest(TestCase):
+    def test_runs_tenants_concurrently(self):
+        fanout = Fanout(max_workers=4)
+        barrier = threading.Event()
+
+        def wait(key):
+            # only returns if every call is running at the same time
+            if key == 'c':
+                barrier.set()
+            assert barrier.wait(1)
+            return key
+
+        results, errors = fanout.run([(k, wait, (k, )) for k in 'abc'])
+        assert results == {'a': 'a', 'b': 'b', 'c': 'c'}
+        assert errors == {}
+
+    def test_per_tenant_limit(self):
+        fanout = Fanout(max_workers=4, max_tenant_concurrency=1)
+        running = []
+        overlaps = []
+        lock = threading.Lock()
+
+        def call(key):
+            with lock:
+                running.append(key)
+                overlaps.append(running.count(key))
+            time.sleep(0.05)
+            with lock:
+                running.remove(key)
+
+        # concurrent fan-outs (e.g. from several events) sharing a tenant
+        threads = [
+            threading.Thread(target=fanout.run, args=([(k, call, (k, ))], ))
+            for k in ('a', 'a', 'a', 'b')
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(overlaps) == 4
+        assert max(overlaps) == 1
+
+    def test_busy_tenant_leaves_workers_free(self):
+        fanout = Fanout(max_workers=2, max_tenant_concurrency=1)
+        release = threading.Event()
+        started = threading.Event()
+
+        def busy():
+            started.set()
+            release.wait(1)
+
+        # queued calls of 'a' must not sit in the second worker
+        threads = [
+            threading.Thread(target=fanout.run, args=([('a', busy, ())], )) for _ in range(3)
+        ]
+        for thread in threads:
+            thread.start()
+        assert started.wait(1)
+        time.sleep(0.05)
+        try:
+            results, errors = fanout.run([('b', lambda: 'b', ())], timeout=0.5)
+        finally:
+            release.set()
+            for thread in threads:
+                thread.join()
+        assert results == {'b': 'b'}
+        assert errors == {}
+
+    @mock.patch('sentry_plugins.hipchat_ac.fanout.metrics')
+    @mock.patch('sentry_plugins.hipchat_ac.fanout.logger')
+    def test_orphaned_calls(self, logger, metrics):
+        fanout = Fanout(max_workers=2, max_tenant_concurrency=1)
+        release = threading.Event()
+        ran = []
+
+        def slow(key):
+            ran.append(key)
+            release.wait(1)
+
+        results, errors = fanout.run(
+            [('a', slow, ('a', )), ('a', slow, ('queued', ))],
+            timeout=0.1,
+        )
+        release.set()
+        time.sleep(0.1)
+
+        assert isinstance(errors['a'], TimeoutError)
+        # the running call is reported, the queued one never starts
+        assert ran == ['a']
+        assert logger.warning.call_count == 1
+        metrics.incr.assert_called_once_with('sentry-plugins.hipchat-ac.fanout.orphaned')
+
+    def test_partial_failures(self):
+        fanout = Fanout(max_workers=4)
+
+        def fail():
+            raise ValueError('nope')
+
+        def slow():
+            time.sleep(0.5)
+
+        results, errors = fanout.run(
+            [
+                ('ok', lambda: 'ok', ()),
+                ('failed', fail, ()),
+                ('slow', slow, ()),
+            ],
+            timeout=0.1,
+        )
+        assert results == {'ok': 'ok'}
+        assert isinstance(errors['failed'], ValueError)
+        assert isinstance(errors['slow'], TimeoutError)
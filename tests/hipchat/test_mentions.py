@@ -1,5 +1,9 @@
 from __future__ import absolute_import
 
+import json
+import mock
+import time
+
 from sentry.testutils import TestCase
 
 from sentry_plugins.hipchat_ac import mentions
@@ -21,9 +25,13 @@ class HipchatMentionsTest(TestCase, HipchatFixture):
         result = mentions.get_recent_mentions(tenant)
 
         assert len(result) == 1
-        assert result[0]['project'] == project
-        assert result[0]['group'] == group
-        assert result[0]['event'] == event
+        assert result[0]['project'] == project.id
+        assert result[0]['group'] == group.id
+        assert result[0]['event'] == event.id
+        assert result[0]['event_id'] == event.id
+        assert result[0]['message'] == event.message
+        assert result[0]['project_name'] == project.name
+        assert result[0]['group_url'] == group.get_absolute_url()
         assert result[0]['last_mentioned']
 
         mentions.clear_project_mentions(tenant, [project2])
@@ -46,3 +54,73 @@ class HipchatMentionsTest(TestCase, HipchatFixture):
         result = mentions.get_recent_mentions(tenant)
 
         assert not result
+
+    def test_snapshot(self):
+        project = self.create_project(name='bar')
+        group = self.create_group(project=project)
+        event = self.create_event(group=group)
+        tenant = self.create_tenant(projects=[project])
+
+        mentions.mention_event(project, group, tenant)
+
+        with self.assertNumQueries(0):
+            result = mentions.get_recent_mentions(tenant)
+        assert len(result) == 1
+        assert result[0]['event'] is None
+        assert result[0]['event_id'] == event.id
+        assert result[0]['culprit'] == event.culprit
+
+    def test_legacy_layout(self):
+        project = self.create_project(name='bar')
+        group = self.create_group(project=project)
+        event = self.create_event(group=group)
+        tenant = self.create_tenant(projects=[project])
+
+        # a mention as stored before items were kept in a hash
+        id = '%s/%s' % (group.id, event.id)
+        key = mentions.get_key(tenant)
+        client = mentions.cluster.get_routing_client()
+        client.zadd(key, time.time(), id)
+        client.set(
+            mentions.get_legacy_item_key(tenant, id),
+            json.dumps({
+                'project': project.id,
+                'group': group.id,
+                'event': event.id,
+                'last_mentioned': time.time(),
+            })
+        )
+
+        result = mentions.get_recent_mentions(tenant)
+        assert len(result) == 1
+        assert result[0]['event_id'] == event.id
+        assert not client.exists(mentions.get_legacy_item_key(tenant, id))
+
+        # the snapshot built for it is stored along with it
+        with self.assertNumQueries(0):
+            result = mentions.get_recent_mentions(tenant)
+        assert len(result) == 1
+        assert result[0]['event_id'] == event.id
+        assert client.smembers(mentions.get_project_key(tenant, project.id)) == set([id])
+
+        mentions.clear_project_mentions(tenant, [project])
+        assert mentions.count_recent_mentions(tenant) == 0
+        assert not client.exists(mentions.get_items_key(tenant))
+
+    def test_trim(self):
+        project = self.create_project(name='bar')
+        group = self.create_group(project=project)
+        tenant = self.create_tenant(projects=[project])
+        client = mentions.cluster.get_routing_client()
+
+        events = [self.create_event(group=group) for _ in range(mentions.TRIM_THRESHOLD + 1)]
+        with mock.patch.object(mentions, 'trim_mentions', wraps=mentions.trim_mentions) as trim:
+            for event in events:
+                mentions.mention_event(project, group, tenant, event)
+            # only once enough mentions piled up
+            assert trim.call_count == 1
+
+        assert client.zcard(mentions.get_key(tenant)) == mentions.MAX_RECENT
+        assert client.hlen(mentions.get_items_key(tenant)) == mentions.MAX_RECENT
+        assert mentions.count_recent_mentions(tenant) == mentions.MAX_RECENT
+        assert len(mentions.get_recent_mentions(tenant)) == mentions.MAX_RECENT
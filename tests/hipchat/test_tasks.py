@@ -0,0 +1,33 @@
+from __future__ import absolute_import
+
+import mock
+
+from sentry.testutils import TestCase
+
+from sentry_plugins.hipchat_ac.models import Context
+from sentry_plugins.hipchat_ac.tasks import (
+    GLANCE_DEBOUNCE, push_recent_events_glance, schedule_recent_events_glance
+)
+from sentry_plugins.hipchat_ac.testutils import HipchatFixture
+
+
+class GlanceDebounceTest(TestCase, HipchatFixture):
+    @mock.patch.object(Context, 'push_recent_events_glance')
+    @mock.patch('sentry_plugins.hipchat_ac.tasks.push_recent_events_glance.apply_async')
+    def test_pushes_are_coalesced(self, apply_async, push):
+        tenant = self.create_tenant(projects=[self.create_project()])
+        ctx = Context.for_tenant(tenant)
+
+        assert schedule_recent_events_glance(ctx)
+        assert not schedule_recent_events_glance(ctx)
+        assert apply_async.call_count == 1
+        kwargs = apply_async.call_args[1]
+        assert kwargs['countdown'] == GLANCE_DEBOUNCE
+        assert kwargs['kwargs'] == {'tenant_id': tenant.id, 'room_id': tenant.room_id}
+
+        push_recent_events_glance(**kwargs['kwargs'])
+        assert push.call_count == 1
+
+        # once the pending push ran the next change schedules another one
+        assert schedule_recent_events_glance(ctx)
+        assert apply_async.call_count == 2
@@ -1,8 +1,12 @@
 from __future__ import absolute_import
 
-from sentry.testutils import PluginTestCase
+import mock
+
+from sentry.testutils import PluginTestCase, TestCase
 
 from sentry_plugins.hipchat_ac import views
+from sentry_plugins.hipchat_ac.models import Context
+from sentry_plugins.hipchat_ac.testutils import HipchatFixture
 
 
 class HipchatPluginTest(PluginTestCase):
@@ -14,3 +18,16 @@ class HipchatPluginTest(PluginTestCase):
         match_new = views.get_link_regexp(
         ).search(views.options.get('system.url-prefix') + "/org/proj/issues/123/events/456")
         assert match_new is not None
+
+
+class TenantNotificationTest(TestCase, HipchatFixture):
+    @mock.patch.object(Context, 'send_notification')
+    @mock.patch.object(Context, 'push_recent_events_glance')
+    @mock.patch('sentry_plugins.hipchat_ac.views.schedule_recent_events_glance')
+    def test_removal_pushes_glance(self, schedule, push, send_notification):
+        tenant = self.create_tenant(projects=[self.create_project()])
+
+        views.notify_tenant_removal(tenant)
+        assert send_notification.call_count == 1
+        assert push.call_count == 1
+        assert not schedule.called
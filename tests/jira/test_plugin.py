@@ -1,16 +1,22 @@
 from __future__ import absolute_import
 
 import mock
+import responses
+import time
 
 from exam import fixture
 from django.contrib.auth.models import AnonymousUser
 from django.core.urlresolvers import reverse
 from django.test import RequestFactory
+from sentry.models import Activity, GroupMeta
 from sentry.testutils import TestCase
 from sentry.utils import json
+from sentry.utils.locking import UnableToAcquireLock
 
-from sentry_plugins.jira.client import JIRAResponse
-from sentry_plugins.jira.plugin import JiraPlugin
+from sentry_plugins.jira.client import (
+    JIRAClient, JIRAError, JIRAResponse, XMLParseError, iter_xml_users
+)
+from sentry_plugins.jira.plugin import ERR_INTERNAL, JiraPlugin, filter_choices
 
 create_meta_response = {
     'expand':
@@ -283,6 +289,12 @@ class JiraPluginTest(TestCase):
     def test_conf_key(self):
         assert self.plugin.conf_key == 'jira'
 
+    def test_filter_choices(self):
+        choices = [('1', 'Beta'), ('2', None), ('3', 'Alpha'), ('4', 'alphabet')]
+        assert filter_choices(choices, 'al', 10) == [('3', 'Alpha'), ('4', 'alphabet')]
+        assert filter_choices(choices, 'ta', 10) == [('1', 'Beta')]
+        assert filter_choices(choices, '', 10) == choices
+
     def test_get_issue_label(self):
         group = self.create_group(message='Hello world', culprit='foo.bar')
         assert self.plugin.get_issue_label(group, 'SEN-1') == 'SEN-1'
@@ -323,6 +335,370 @@ class JiraPluginTest(TestCase):
         }
         assert self.plugin.create_issue(request, group, form_data) == 'SEN-1'
 
+    @mock.patch('sentry_plugins.jira.plugin.refresh_create_meta.delay')
+    @mock.patch('sentry_plugins.jira.client.JIRAClient.get_create_meta')
+    def test_create_meta_cached(self, mock_get_create_meta, mock_refresh):
+        mock_get_create_meta.return_value = JIRAResponse(json.dumps(create_meta_response), 200)
+        project = self.create_project()
+        client = JIRAClient('https://createmeta.atlassian.net', 'foo', 'bar')
+
+        meta = self.plugin.get_cached_create_meta(project, client, 'SEN')
+        assert meta['key'] == 'SEN'
+        assert 'fields' not in meta['issuetypes'][0]
+        fields = self.plugin.get_cached_issue_type_fields(
+            project, client, 'SEN', meta['issuetypes'][0]['id']
+        )
+        assert 'summary' in fields
+        assert mock_get_create_meta.call_count == 1
+
+        # other users may not see the same projects and issue types
+        other_client = JIRAClient('https://createmeta.atlassian.net', 'baz', 'bar')
+        assert other_client.get_create_meta_key('SEN') != client.get_create_meta_key('SEN')
+
+        # stale entries are served while a task refreshes them, and only
+        # one task is queued at a time
+        with mock.patch('sentry_plugins.jira.client.time.time') as mock_time:
+            mock_time.return_value = time.time() + client.CREATE_META_TTL + 1
+            assert self.plugin.get_cached_create_meta(project, client, 'SEN')['key'] == 'SEN'
+            assert self.plugin.get_cached_create_meta(project, client, 'SEN')['key'] == 'SEN'
+        assert mock_get_create_meta.call_count == 1
+        mock_refresh.assert_called_once_with(project_id=project.id, jira_project='SEN')
+
+        client.invalidate_create_meta('SEN')
+        self.plugin.get_cached_issue_type_fields(
+            project, client, 'SEN', meta['issuetypes'][0]['id']
+        )
+        assert mock_get_create_meta.call_count == 2
+
+    @responses.activate
+    def test_get_cached(self):
+        responses.add(
+            responses.GET,
+            'https://cached.atlassian.net/rest/api/2/priority',
+            body='[{"id": "1", "name": "Highest"}, {"id": "2", "name": "High"}]'
+        )
+        client = JIRAClient('https://cached.atlassian.net', 'foo', 'bar')
+        assert client.get_priorities().json == [
+            {'id': '1', 'name': 'Highest'}, {'id': '2', 'name': 'High'}
+        ]
+
+        response = client.get_priorities()
+        assert len(responses.calls) == 1
+        assert ' ' not in response.text
+        assert response.json == [{'id': '1', 'name': 'Highest'}, {'id': '2', 'name': 'High'}]
+
+    @responses.activate
+    def test_get_cached_single_flight(self):
+        responses.add(
+            responses.GET,
+            'https://stampede.atlassian.net/rest/api/2/project',
+            body='[{"key": "SEN", "name": "Sentry"}]'
+        )
+        client = JIRAClient('https://stampede.atlassian.net', 'foo', 'bar')
+        client.get_projects_list()
+
+        lock = mock.Mock()
+        lock.acquire.side_effect = UnableToAcquireLock
+        expired = time.time() + client.PROJECTS_CACHE_TTL * 1.5
+        with mock.patch('sentry_plugins.jira.client.locks.get', return_value=lock), \
+                mock.patch('sentry_plugins.jira.client.time.time', return_value=expired):
+            # somebody else is refilling the key, serve the stale value
+            assert client.get_projects_list().json == [{'key': 'SEN', 'name': 'Sentry'}]
+        assert len(responses.calls) == 1
+
+        with mock.patch('sentry_plugins.jira.client.time.time', return_value=expired):
+            client.get_projects_list()
+        assert len(responses.calls) == 2
+
+        # with nothing to serve we wait for the refill, but not forever
+        client = JIRAClient('https://stampede-cold.atlassian.net', 'foo', 'bar')
+        clock = mock.Mock(side_effect=lambda: clock.now)
+        clock.now = time.time()
+
+        def sleep(seconds):
+            clock.now += seconds
+
+        with mock.patch('sentry_plugins.jira.client.locks.get', return_value=lock), \
+                mock.patch('sentry_plugins.jira.client.time.time', clock), \
+                mock.patch('sentry_plugins.jira.client.time.sleep', sleep):
+            with self.assertRaises(JIRAError):
+                client.get_projects_list()
+        assert len(responses.calls) == 2
+
+    @responses.activate
+    def test_get_cached_without_lock(self):
+        responses.add(
+            responses.GET,
+            'https://nolock.atlassian.net/rest/api/2/user/search',
+            body='[{"name": "jdoe"}]'
+        )
+        client = JIRAClient('https://nolock.atlassian.net', 'foo', 'bar')
+        with mock.patch('sentry_plugins.jira.client.locks.get') as mock_lock:
+            assert client.get_cached('/rest/api/2/user/search').json == [{'name': 'jdoe'}]
+            assert client.get_cached('/rest/api/2/user/search').json == [{'name': 'jdoe'}]
+        assert not mock_lock.called
+        assert len(responses.calls) == 1
+
+    def test_iter_xml_users(self):
+        response = JIRAResponse(
+            '<?xml version="1.0" encoding="ISO-8859-1" standalone="yes"?>'
+            '<userPickerResultsBean><users><name>jdoe</name>'
+            '<html>&lt;strong&gt;J&lt;/strong&gt;ohn Doe - jdoe@example.com (jdoe)</html>'
+            '</users><total>1</total></userPickerResultsBean>', 200
+        )
+        assert list(iter_xml_users(response.text)) == [
+            ('jdoe', '<strong>J</strong>ohn Doe - jdoe@example.com (jdoe)'),
+        ]
+        assert response._xml is None
+
+        with self.assertRaises(XMLParseError):
+            list(iter_xml_users('<?xml version="1.0"?><users><name>jdoe</users>'))
+
+    @mock.patch(
+        'sentry_plugins.jira.client.JIRAClient.get_create_meta',
+        mock.Mock(return_value=JIRAResponse(json.dumps(create_meta_response), 200))
+    )
+    @mock.patch(
+        'sentry_plugins.jira.client.JIRAClient.get_priorities',
+        mock.Mock(return_value=JIRAResponse('[{"id": "1", "name": "Highest"}]', 200))
+    )
+    @mock.patch(
+        'sentry_plugins.jira.client.JIRAClient.get_versions',
+        mock.Mock(return_value=JIRAResponse('[]', 200))
+    )
+    def test_get_new_issue_fields_memoized(self):
+        self.plugin.set_option('instance_url', 'https://schema.atlassian.net', self.project)
+        self.plugin.set_option('default_project', 'SEN', self.project)
+        group = self.create_group(message='Hello world', culprit='foo.bar')
+        other_group = self.create_group(message='Goodbye world', culprit='foo.baz')
+
+        with mock.patch.object(
+            self.plugin, 'build_dynamic_fields', wraps=self.plugin.build_dynamic_fields
+        ) as build_dynamic_fields:
+            fields = self.plugin.get_new_issue_fields(
+                None, group, self.create_event(group=group)
+            )
+            other_fields = self.plugin.get_new_issue_fields(
+                None, other_group, self.create_event(group=other_group)
+            )
+        assert build_dynamic_fields.call_count == 1
+        assert [f['name'] for f in fields] == [f['name'] for f in other_fields]
+
+        priority = [f for f in fields if f['name'] == 'priority'][0]
+        assert priority['choices'] == [('1', 'Highest')]
+        urls = [f['url'] for f in other_fields if 'url' in f]
+        assert urls
+        assert all(u.startswith('/api/0/issues/%s/' % other_group.id) for u in urls)
+
+        # a refetched create meta gets its own schema
+        client = self.plugin.get_jira_client(self.project)
+        with mock.patch('sentry_plugins.jira.client.time.time', return_value=time.time() + 1):
+            client.refresh_create_meta('SEN')
+        with mock.patch.object(
+            self.plugin, 'build_dynamic_fields', wraps=self.plugin.build_dynamic_fields
+        ) as build_dynamic_fields:
+            self.plugin.get_new_issue_fields(None, group, self.create_event(group=group))
+        assert build_dynamic_fields.call_count == 1
+
+    @mock.patch(
+        'sentry_plugins.jira.client.JIRAClient.get_versions',
+        mock.Mock(
+            return_value=JIRAResponse(
+                json.dumps(
+                    [
+                        {'id': '1', 'name': '1.0', 'released': True},
+                        {'id': '2', 'name': '1.1', 'released': True},
+                        {'id': '3', 'name': '2.0', 'released': False},
+                        {'id': '4', 'name': 'Next 1.x', 'released': False},
+                    ]
+                ), 200
+            )
+        )
+    )
+    def test_autocomplete_field_choices(self):
+        self.plugin.set_option('instance_url', 'https://choices.atlassian.net', self.project)
+        self.plugin.set_option('default_project', 'SEN', self.project)
+        group = self.create_group(message='Hello world', culprit='foo.bar')
+
+        request = self.request.get(
+            '/', {
+                'issuetype': '1',
+                'autocomplete_field': 'fixVersions',
+                'autocomplete_query': '1',
+            }
+        )
+        request.user = AnonymousUser()
+        response = self.plugin.view_autocomplete(request, group)
+        # unreleased versions first, then prefix before substring matches
+        assert response.data == {
+            'fixVersions': [
+                {'id': '1', 'text': '1.0'},
+                {'id': '2', 'text': '1.1'},
+                {'id': '4', 'text': 'Next 1.x'},
+            ]
+        }
+
+        request = self.request.get(
+            '/', {
+                'issuetype': '1',
+                'autocomplete_field': 'fixVersions',
+                'autocomplete_query': '',
+            }
+        )
+        request.user = AnonymousUser()
+        response = self.plugin.view_autocomplete(request, group)
+        assert [c['id'] for c in response.data['fixVersions']] == ['3', '4', '1', '2']
+
+    @responses.activate
+    @mock.patch.object(JiraPlugin, 'search_assignable_users')
+    def test_autocomplete_users(self, mock_search):
+        mock_search.return_value = [{'id': 'jdoe', 'text': 'John Doe - jdoe@example.com (jdoe)'}]
+        responses.add(
+            responses.GET,
+            'https://users.atlassian.net/rest/api/latest/user/search',
+            body=json.dumps([{
+                'name': 'asmith',
+                'displayName': 'Alice Smith',
+                'emailAddress': 'alice@example.com',
+            }]),
+        )
+        self.plugin.set_option('instance_url', 'https://users.atlassian.net', self.project)
+        self.plugin.set_option('username', 'foo', self.project)
+        self.plugin.set_option('password', 'bar', self.project)
+        self.plugin.set_option('default_project', 'SEN', self.project)
+        group = self.create_group(message='Hello world', culprit='foo.bar')
+
+        def autocomplete(jira_url):
+            request = self.request.get(
+                '/', {
+                    'autocomplete_field': 'assignee',
+                    'autocomplete_query': 'j',
+                    'jira_url': jira_url,
+                }
+            )
+            request.user = AnonymousUser()
+            return self.plugin.view_autocomplete(request, group).data['assignee']
+
+        # assignees come from the index of assignable users
+        assert autocomplete(
+            'https://users.atlassian.net/rest/api/latest/user/assignable/search?issueKey=null'
+        ) == mock_search.return_value
+        assert len(responses.calls) == 0
+
+        # other user pickers (e.g. the reporter) search all users
+        assert autocomplete(
+            'https://users.atlassian.net/rest/api/latest/user/search?username='
+        ) == [{'id': 'asmith', 'text': 'Alice Smith - alice@example.com (asmith)'}]
+        assert mock_search.call_count == 1
+        assert len(responses.calls) == 1
+
+    @mock.patch(
+        'sentry_plugins.jira.client.JIRAClient.get_create_meta',
+        mock.Mock(return_value=JIRAResponse(json.dumps(create_meta_response), 200))
+    )
+    @mock.patch('sentry_plugins.jira.client.JIRAClient.create_issues')
+    def test_create_issues(self, mock_create_issues):
+        mock_create_issues.side_effect = JIRAError(
+            json.dumps(
+                {
+                    'issues': [{'id': '10001', 'key': 'SEN-1'}],
+                    'errors': [
+                        {
+                            'status': 400,
+                            'elementErrors': {
+                                'errorMessages': [],
+                                'errors': {'summary': 'Summary is too long.'},
+                            },
+                            'failedElementNumber': 1,
+                        }
+                    ],
+                }
+            ), 400
+        )
+        self.plugin.set_option('instance_url', 'https://bulk.atlassian.net', self.project)
+        self.plugin.set_option('default_project', 'SEN', self.project)
+        groups = [
+            self.create_group(message='Hello world', culprit='foo.bar'),
+            self.create_group(message='Goodbye world', culprit='foo.baz'),
+        ]
+        for group in groups:
+            self.create_event(group=group)
+
+        request = self.request.get('/')
+        request.user = AnonymousUser()
+        with mock.patch('sentry_plugins.jira.plugin.issue_tracker_used') as mock_signal:
+            created, errors = self.plugin.create_issues(
+                request, groups, {'issuetype': '10002', 'project': '10000'}
+            )
+        assert created == {groups[0].id: 'SEN-1'}
+        assert errors == {groups[1].id: 'summary: Summary is too long.'}
+        assert mock_signal.send.call_count == 1
+        assert mock_signal.send.call_args[1]['project'] == self.project
+        # the link shows up in the same request
+        assert GroupMeta.objects.get_value(groups[0], 'jira:tid') == 'SEN-1'
+
+        issue_updates = mock_create_issues.call_args[0][0]
+        assert len(issue_updates) == 2
+        assert all(i['issuetype'] == {'id': '10002'} for i in issue_updates)
+        assert GroupMeta.objects.get(group=groups[0], key='jira:tid').value == 'SEN-1'
+        assert not GroupMeta.objects.filter(group=groups[1]).exists()
+        activity = Activity.objects.get(group=groups[0], type=Activity.CREATE_ISSUE)
+        assert activity.data['location'] == 'https://bulk.atlassian.net/browse/SEN-1'
+        assert not Activity.objects.filter(group=groups[1]).exists()
+
+    @mock.patch(
+        'sentry_plugins.jira.client.JIRAClient.get_create_meta',
+        mock.Mock(return_value=JIRAResponse(json.dumps(create_meta_response), 200))
+    )
+    @mock.patch('sentry_plugins.jira.client.JIRAClient.create_issues')
+    def test_view_create_issues(self, mock_create_issues):
+        # fewer issues than we asked for and no errors to tell which failed
+        mock_create_issues.return_value = JIRAResponse(
+            json.dumps({'issues': [{'id': '10001', 'key': 'SEN-1'}], 'errors': []}), 201
+        )
+        self.plugin.set_option('instance_url', 'https://bulk.atlassian.net', self.project)
+        self.plugin.set_option('default_project', 'SEN', self.project)
+        groups = [
+            self.create_group(message='Hello world', culprit='foo.bar'),
+            self.create_group(message='Goodbye world', culprit='foo.baz'),
+        ]
+        for group in groups:
+            self.create_event(group=group)
+        other_group = self.create_group(project=self.create_project())
+
+        request = self.request.post('/')
+        request.user = AnonymousUser()
+        request.DATA = {
+            'issuetype': '10002',
+            'project': '10000',
+            'groups': [groups[1].id, other_group.id],
+        }
+        response = self.plugin.view_create_issues(request, groups[0])
+        assert response.data == {
+            'created': {groups[0].id: 'SEN-1'},
+            'errors': {groups[1].id: ERR_INTERNAL},
+        }
+        assert len(mock_create_issues.call_args[0][0]) == 2
+
+    def test_link_created_issues_race(self):
+        self.plugin.set_option('instance_url', 'https://bulk.atlassian.net', self.project)
+        groups = [self.create_group(), self.create_group()]
+        # linked by somebody else after we checked
+        GroupMeta.objects.create(group=groups[1], key='jira:tid', value='SEN-3')
+
+        request = self.request.post('/')
+        request.user = AnonymousUser()
+        created = {groups[0].id: 'SEN-1', groups[1].id: 'SEN-2'}
+        errors = {}
+        self.plugin.link_created_issues(
+            request, groups, {g.id: 'Title' for g in groups}, created, errors
+        )
+        assert created == {groups[0].id: 'SEN-1'}
+        assert 'SEN-2' in errors[groups[1].id]
+        assert GroupMeta.objects.get(group=groups[0], key='jira:tid').value == 'SEN-1'
+        assert GroupMeta.objects.get(group=groups[1], key='jira:tid').value == 'SEN-3'
+        assert Activity.objects.filter(type=Activity.CREATE_ISSUE).count() == 1
+
     @mock.patch(
         'sentry_plugins.jira.client.JIRAClient.get_issue',
         mock.Mock(return_value=JIRAResponse(json.dumps(issue_response), 200))
@@ -0,0 +1,84 @@
+from __future__ import absolute_import
+
+import mock
+
+from sentry.models import GroupMeta
+from sentry.testutils import TestCase
+from sentry.utils import json
+
+from sentry_plugins.cache import cluster
+from sentry_plugins.jira.client import JIRAClient, JIRAResponse
+from sentry_plugins.jira.plugin import JiraPlugin
+from sentry_plugins.jira.sync import (
+    PAGE_SIZE, SNAPSHOT_TTL, get_snapshot, get_snapshot_key, sync_issue_states
+)
+
+
+def make_issue(key, status, assignee=None):
+    return {
+        'key': key,
+        'fields': {
+            'status': {'name': status},
+            'assignee': {'displayName': assignee} if assignee else None,
+            'resolution': None,
+        },
+    }
+
+
+class SyncIssueStatesTest(TestCase):
+    @mock.patch('sentry_plugins.jira.client.JIRAClient.search_updated_issues')
+    @mock.patch('sentry_plugins.jira.client.JIRAClient.search_issues_by_key')
+    def test_sync(self, mock_search_by_key, mock_search):
+        group = self.create_group(message='Hello world', culprit='foo.bar')
+        GroupMeta.objects.create(group=group, key='jira:tid', value='SEN-1')
+        other_group = self.create_group(message='Goodbye world', culprit='foo.baz')
+        GroupMeta.objects.create(group=other_group, key='jira:tid', value='OTHER-1')
+
+        # the first sync fetches all linked issues of the project, however
+        # long ago they were linked
+        mock_search_by_key.return_value = JIRAResponse(json.dumps({
+            'total': 1,
+            'issues': [make_issue('SEN-1', 'Open')],
+        }), 200)
+        client = JIRAClient('https://sync.atlassian.net/', 'foo', 'bar')
+        sync_issue_states(client, self.project, 'SEN', 'jira')
+
+        assert mock_search_by_key.call_args[0][0] == ['SEN-1']
+        assert not mock_search.called
+        assert get_snapshot('https://sync.atlassian.net', 'SEN-1')['status'] == 'Open'
+
+        # later syncs only look for issues updated since the previous one
+        mock_search.side_effect = [
+            JIRAResponse(json.dumps({
+                'total': 3,
+                'issues': [
+                    make_issue('SEN-1', 'In Progress', 'John Doe'),
+                    make_issue('SEN-2', 'Done'),
+                ],
+            }), 200),
+            JIRAResponse(json.dumps({
+                'total': 3,
+                'issues': [make_issue('SEN-3', 'Open')],
+            }), 200),
+        ]
+        sync_issue_states(client, self.project, 'SEN', 'jira')
+
+        assert mock_search_by_key.call_count == 1
+        assert [c[1]['start_at'] for c in mock_search.call_args_list] == [0, 2]
+        assert mock_search.call_args[1]['max_results'] == PAGE_SIZE
+        assert mock_search.call_args[0][1] <= 4
+        assert get_snapshot('https://sync.atlassian.net', 'SEN-1') == {
+            'status': 'In Progress',
+            'assignee': 'John Doe',
+            'resolution': None,
+        }
+        # only linked issues are stored
+        assert get_snapshot('https://sync.atlassian.net', 'SEN-2') is None
+
+        # each snapshot expires on its own
+        key = get_snapshot_key('https://sync.atlassian.net', 'SEN-1')
+        assert 0 < cluster.get_routing_client().ttl(key) <= SNAPSHOT_TTL
+
+        plugin = JiraPlugin()
+        plugin.set_option('instance_url', 'https://sync.atlassian.net/', self.project)
+        assert plugin.get_issue_label(group, 'SEN-1') == 'SEN-1 (In Progress)'
@@ -0,0 +1,61 @@
+from __future__ import absolute_import
+
+import mock
+import responses
+
+from sentry.testutils import TestCase
+from sentry.utils import json
+
+from sentry_plugins.jira.client import JIRAClient
+from sentry_plugins.jira.users import AssignableUserIndex, search_users
+
+USERS = [
+    ('jdoe', 'John Doe', 'jdoe@example.com'),
+    ('asmith', 'Alice Smith', 'alice@example.com'),
+    ('bjohnson', 'Bob Johnson', ''),
+]
+
+
+class SearchUsersTest(TestCase):
+    def test_prefix_matches_first(self):
+        assert search_users(USERS, 'jo') == [USERS[0], USERS[2]]
+        assert search_users(USERS, 'smith') == [USERS[1]]
+        assert search_users(USERS, 'ohn') == [USERS[0], USERS[2]]
+
+    def test_limit(self):
+        assert search_users(USERS, '', limit=2) == USERS[:2]
+
+
+class AssignableUserIndexTest(TestCase):
+    @responses.activate
+    @mock.patch('sentry_plugins.jira.users.PAGE_SIZE', 2)
+    def test_refresh(self):
+        url = 'https://users.atlassian.net/rest/api/2/user/assignable/search'
+        responses.add(
+            responses.GET,
+            url + '?project=SEN&startAt=0&maxResults=2',
+            body=json.dumps([
+                {'name': name, 'displayName': display_name, 'emailAddress': email}
+                for name, display_name, email in USERS[:2]
+            ]),
+            match_querystring=True,
+        )
+        responses.add(
+            responses.GET,
+            url + '?project=SEN&startAt=2&maxResults=2',
+            body=json.dumps([{'name': 'bjohnson', 'displayName': 'Bob Johnson'}]),
+            match_querystring=True,
+        )
+
+        index = AssignableUserIndex(JIRAClient('https://users.atlassian.net', 'foo', 'bar'), 'SEN')
+        assert index.load() == (None, True)
+        index.refresh()
+
+        users, is_stale = index.load()
+        assert [tuple(u) for u in users] == USERS
+        assert not is_stale
+
+    def test_keyed_per_user(self):
+        index = AssignableUserIndex(JIRAClient('https://users.atlassian.net', 'foo', 'bar'), 'SEN')
+        other = AssignableUserIndex(JIRAClient('https://users.atlassian.net', 'baz', 'bar'), 'SEN')
+        assert index.get_key() != other.get_key()
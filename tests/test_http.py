@@ -0,0 +1,79 @@
+from __future__ import absolute_import
+
+import mock
+import threading
+
+from sentry.testutils import TestCase
+
+from sentry_plugins.http import SessionPool
+
+
+class SessionPoolTest(TestCase):
+    def test_reuses_session_per_host(self):
+        pool = SessionPool()
+        session = pool.get('https://api.github.com/repos/getsentry/sentry')
+        assert pool.get('https://api.github.com/users/octocat') is session
+        assert pool.get('https://api.bitbucket.org/2.0/repositories') is not session
+        assert len(pool) == 2
+
+    def test_does_not_persist_cookies(self):
+        pool = SessionPool()
+        session = pool.get('https://api.github.com')
+        assert session.cookies.get_policy()._allowed_domains == []
+
+    @mock.patch('sentry_plugins.http.time.time')
+    def test_evicts_idle_sessions(self, mock_time):
+        pool = SessionPool(idle_timeout=60)
+        mock_time.return_value = 1000
+        session = pool.get('https://api.github.com')
+        mock_time.return_value = 1030
+        pool.get('https://api.bitbucket.org')
+        mock_time.return_value = 1070
+        pool.get('https://api.bitbucket.org')
+        assert len(pool) == 1
+        assert pool.get('https://api.github.com') is not session
+
+    def test_bounded_size(self):
+        pool = SessionPool(max_sessions=2)
+        pool.get('https://a.example.com')
+        pool.get('https://b.example.com')
+        pool.get('https://c.example.com')
+        assert len(pool) == 2
+
+    @mock.patch('sentry_plugins.http.os.getpid')
+    def test_discards_sessions_after_fork(self, mock_getpid):
+        mock_getpid.return_value = 1
+        pool = SessionPool()
+        session = pool.get('https://api.github.com')
+        mock_getpid.return_value = 2
+        assert pool.get('https://api.github.com') is not session
+
+    def test_evicted_sessions_stay_usable(self):
+        pool = SessionPool(max_sessions=1)
+        session = pool.get('https://api.github.com')
+        in_use = threading.Event()
+        evicted = threading.Event()
+        errors = []
+
+        def use_session():
+            # holds on to the session while another thread evicts it
+            try:
+                in_use.set()
+                evicted.wait(5)
+                adapter = session.get_adapter('https://api.github.com')
+                adapter.get_connection('https://api.github.com')
+            except Exception as e:
+                errors.append(e)
+
+        with mock.patch.object(session, 'close') as mock_close:
+            thread = threading.Thread(target=use_session)
+            thread.start()
+            in_use.wait(5)
+            pool.get('https://api.bitbucket.org')
+            evicted.set()
+            thread.join(5)
+
+        assert not mock_close.called
+        assert not errors
+        assert len(pool) == 1
+        assert pool.get('https://api.github.com') is not session
@@ -0,0 +1,54 @@
+from __future__ import absolute_import
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from sentry.models import CommitAuthor
+from sentry.testutils import TestCase
+
+from sentry_plugins.webhooks import get_or_create_commit_authors
+
+
+class GetOrCreateCommitAuthorsTest(TestCase):
+    def test_reuses_existing_authors(self):
+        organization = self.create_organization()
+        existing = CommitAuthor.objects.create(
+            organization_id=organization.id,
+            email='jane@example.com',
+            name='Jane',
+        )
+
+        authors = get_or_create_commit_authors(
+            organization.id,
+            {
+                'jane@example.com': 'Jane',
+                'john@example.com': 'John',
+            },
+            external_ids={'john@example.com': 'github:john'},
+        )
+
+        assert authors['jane@example.com'].id == existing.id
+        assert authors['john@example.com'].name == 'John'
+        assert authors['john@example.com'].external_id == 'github:john'
+        assert CommitAuthor.objects.filter(organization_id=organization.id).count() == 2
+
+        again = get_or_create_commit_authors(
+            organization.id,
+            {
+                'jane@example.com': 'Jane',
+                'john@example.com': 'John',
+            },
+        )
+        assert {e: a.id for e, a in again.items()} == {e: a.id for e, a in authors.items()}
+        assert CommitAuthor.objects.filter(organization_id=organization.id).count() == 2
+
+    def test_query_count_does_not_grow_with_authors(self):
+        organization = self.create_organization()
+
+        def count_queries(count):
+            names = {'author-%d-%d@example.com' % (count, i): 'Author' for i in range(count)}
+            with CaptureQueriesContext(connection) as ctx:
+                authors = get_or_create_commit_authors(organization.id, names)
+            assert len(authors) == count
+            return len(ctx.captured_queries)
+
+        assert count_queries(2) == count_queries(20)